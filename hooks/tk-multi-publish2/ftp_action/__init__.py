@@ -0,0 +1,26 @@
+# :coding: utf-8
+
+"""
+Ftp transfer, sync and publish helpers shared by the publish hooks.
+
+The hooks get this package from the configuration's ftp_action_hook.py and
+load its modules with import_module().
+"""
+
+import importlib
+import sys
+
+
+def import_module(module_name):
+    """
+    Return the named module of this package, e.g. "transfer".
+    """
+    return importlib.import_module("%s.%s" % (__name__, module_name))
+
+
+def loaded_module(module_name):
+    """
+    Return the named module of this package if a hook has imported it in
+    this process, None otherwise.
+    """
+    return sys.modules.get("%s.%s" % (__name__, module_name))
@@ -0,0 +1,519 @@
+# :coding: utf-8
+
+"""
+ftpsync.py - mirror a local directory tree to an FTP server
+
+Usage: ftpsync.py [options] host source-dir target-dir
+
+This is the production counterpart of the sandbox
+`ftputil/sandbox/ftpsync-0.1/ftpsync.py`. Files are uploaded over
+several parallel data connections (one `FTPHost` per stream, since
+ftputil hosts are not thread-safe) and every finished file and
+finished directory subtree is appended to a checkpoint manifest. An
+interrupted run can be resumed with `--restart`; subtrees recorded as
+complete in the manifest are skipped without walking or listing them
+again. An existing manifest is never replaced unless
+`--overwrite-manifest` is given, and `--dry-run` only reads it. Uploads run in the bulk bandwidth lane, so they yield to
+interactive publishes in the same process; `--bwlimit` caps the rate
+in KB/s.
+
+Login data is never asked for interactively. `host` may be given as
+"user:pass@hostname", otherwise the credentials are taken from the
+`FTPSYNC_USER`/`FTPSYNC_PASSWORD` environment variables or `~/.netrc`.
+"""
+
+import fnmatch
+import ftplib
+import getopt
+import hashlib
+import logging
+import netrc
+import os
+import queue
+import sys
+import threading
+import time
+
+from ftputil import ftputil, ftp_error, bandwidth
+
+
+logger = logging.getLogger("ftpsync")
+
+# Manifest record types
+_FILE_DONE = "F"
+_DIR_DONE = "D"
+
+
+class ManifestExistsError(Exception):
+    """
+    Raised when a new run would replace the manifest of an earlier one.
+    """
+
+
+def login_data(host):
+    """
+    Derive login data for different FTP host formats:
+
+    "user:pass@hostname": parse
+    "user@hostname": parse, take the password from the environment
+    "hostname": check the environment, then the .netrc file, try
+        anonymous otherwise
+
+    Any of these may use "hostname:port" for a non-standard port.
+    """
+    user = os.getenv("FTPSYNC_USER", "")
+    passwd = os.getenv("FTPSYNC_PASSWORD", "")
+    acct = ""
+
+    at = host.rfind("@")
+    if at != -1:
+        user, host = host[:at], host[at + 1:]
+        col = user.find(":")
+        if col != -1:
+            user, passwd = user[:col], user[col + 1:]
+    elif not user:
+        try:
+            (user, acct, passwd) = netrc.netrc().authenticators(
+                host.partition(":")[0])
+        except (IOError, TypeError, netrc.NetrcParseError):
+            # no netrc file or no entry in netrc
+            pass
+
+    if not user:
+        user = "anonymous"
+
+    return (host, user, passwd, acct)
+
+
+def connect(login):
+    """
+    Return a new `FTPHost` for the login data from `login_data`. The
+    hostname may carry a ":port" suffix.
+    """
+    host, user, passwd, acct = login
+    hostname, _, port = host.partition(":")
+    if not port:
+        ftp_host = ftputil.FTPHost(host, user, passwd, acct)
+        ftp_host.set_bandwidth_scheduler(bandwidth.scheduler_for(hostname))
+        return ftp_host
+
+    class _Session(ftplib.FTP):
+        def __init__(self, host, user, passwd, acct):
+            ftplib.FTP.__init__(self)
+            self.connect(host, int(port))
+            self.login(user, passwd, acct)
+
+    ftp_host = ftputil.FTPHost(hostname, user, passwd, acct,
+                               session_factory=_Session)
+    ftp_host.set_bandwidth_scheduler(bandwidth.scheduler_for(hostname))
+    return ftp_host
+
+
+def log_checkpoint(msg):
+    logger.info("%s %s %s" % (os.path.basename(__file__), msg,
+                              time.strftime("%Y-%m-%d, %H:%M",
+                                            time.localtime())))
+
+
+def default_manifest_path(host, source, target):
+    """
+    Return the default manifest path for a (host, source, target)
+    combination, so that a restarted run finds the manifest of the
+    interrupted one without extra options.
+    """
+    key = "%s\0%s\0%s" % (host.split("@")[-1], os.path.abspath(source), target)
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser("~"), ".ftpsync",
+                        "%s.manifest" % digest)
+
+
+class Manifest(object):
+    """
+    Append-only checkpoint log of completed files and directory subtrees.
+
+    Each line is either
+
+        F<TAB>relative path<TAB>size<TAB>mtime
+        D<TAB>relative path
+
+    Lines are flushed as they are written, so the manifest is usable
+    after the process has been killed. A file entry only counts as done
+    if the local file still has the recorded size and mtime.
+
+    `restart` appends to an existing manifest, `overwrite` allows
+    starting a new one in its place (otherwise `ManifestExistsError` is
+    raised) and `read_only` only loads it (restart) or starts empty,
+    without ever opening the file for writing.
+    """
+
+    def __init__(self, path, restart=False, overwrite=False, read_only=False):
+        self.path = path
+        self.files = {}
+        self.dirs = set()
+        self._lock = threading.Lock()
+        self._fobj = None
+        exists = os.path.exists(path)
+        if restart and exists:
+            self._load()
+        if read_only:
+            return
+        if exists and not (restart or overwrite):
+            raise ManifestExistsError(
+                "manifest %s exists, resume with --restart or start over "
+                "with --overwrite-manifest" % path)
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._fobj = open(path, "a" if restart else "w")
+
+    def _load(self):
+        with open(self.path) as fobj:
+            for line in fobj:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] == _FILE_DONE and len(fields) == 4:
+                    self.files[fields[1]] = (int(fields[2]), int(fields[3]))
+                elif fields[0] == _DIR_DONE and len(fields) == 2:
+                    self.dirs.add(fields[1])
+                # Anything else is a partially written last line.
+
+    def file_done(self, relpath, size, mtime):
+        return self.files.get(relpath) == (size, int(mtime))
+
+    def dir_done(self, relpath):
+        return relpath in self.dirs
+
+    def _write(self, line):
+        if self._fobj is None:
+            return
+        with self._lock:
+            self._fobj.write(line + "\n")
+            self._fobj.flush()
+
+    def record_file(self, relpath, size, mtime):
+        self._write("\t".join((_FILE_DONE, relpath, str(size),
+                               str(int(mtime)))))
+
+    def record_dir(self, relpath):
+        self._write("\t".join((_DIR_DONE, relpath)))
+
+    def close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+
+
+class ParallelUploader(object):
+    """
+    Upload a local tree to an FTP server over `streams` parallel
+    connections, checkpointing progress into a `Manifest`.
+    """
+
+    def __init__(self, login, source, target, manifest, streams=4,
+                 excludes=(), dry_run=False):
+        self.login = login
+        self.source = os.path.abspath(source)
+        self.target = target
+        self.manifest = manifest
+        self.streams = max(1, streams)
+        self.excludes = list(excludes)
+        self.dry_run = dry_run
+
+        self._queue = queue.Queue(maxsize=self.streams * 64)
+        self._lock = threading.Lock()
+        # relative dir -> number of files and subdirs not yet finished
+        self._pending = {}
+        self._failed = []
+
+        self.bytes_sent = 0
+        self.files_sent = 0
+        self.files_skipped = 0
+        self.files_vanished = 0
+        self.dirs_skipped = 0
+        self.stream_bytes = [0] * self.streams
+
+    def _excluded(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.excludes)
+
+    def _remote(self, relpath):
+        if not relpath:
+            return self.target
+        return "/".join([self.target.rstrip("/")] + relpath.split(os.sep))
+
+    #
+    # completion bookkeeping
+    #
+    def _finish_one(self, reldir):
+        """
+        Decrement the pending count of `reldir` and, once it reaches
+        zero, record the directory as complete and propagate upwards.
+        Must be called with `self._lock` held.
+        """
+        while reldir is not None:
+            self._pending[reldir] -= 1
+            if self._pending[reldir]:
+                return
+            del self._pending[reldir]
+            if not self.dry_run:
+                self.manifest.record_dir(reldir)
+            reldir = None if not reldir else os.path.dirname(reldir)
+
+    #
+    # workers
+    #
+    def _worker(self, index):
+        host = None
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                reldir, relpath, size, mtime = job
+                try:
+                    if not self.dry_run:
+                        if host is None:
+                            host = connect(self.login)
+                        host.upload(os.path.join(self.source, relpath),
+                                    self._remote(relpath), mode="b",
+                                    priority=bandwidth.PRIORITY_BULK)
+                        self.manifest.record_file(relpath, size, mtime)
+                    logger.debug("[%d] upload %s" % (index, relpath))
+                except Exception as exc:
+                    logger.error("[%d] upload %s failed: %s"
+                                 % (index, relpath, exc))
+                    with self._lock:
+                        self._failed.append(relpath)
+                    # A broken session is replaced for the next file.
+                    if host is not None:
+                        try:
+                            host.close()
+                        except Exception:
+                            pass
+                        host = None
+                    continue
+                with self._lock:
+                    self.bytes_sent += size
+                    self.files_sent += 1
+                    self.stream_bytes[index] += size
+                    self._finish_one(reldir)
+        finally:
+            if host is not None:
+                host.close()
+
+    #
+    # tree walk (producer)
+    #
+    def _walk_error(self, error):
+        # os.walk skips the directories it can't list: the directory stays
+        # pending, so neither it nor its parents are recorded as complete
+        logger.error("cannot list %s: %s" % (error.filename, error.strerror))
+        with self._lock:
+            self._failed.append(os.path.relpath(error.filename, self.source))
+
+    def _walk(self, control):
+        for dirpath, dirnames, filenames in os.walk(self.source,
+                                                    onerror=self._walk_error):
+            reldir = os.path.relpath(dirpath, self.source)
+            if reldir == os.curdir:
+                reldir = ""
+
+            subdirs = []
+            for name in sorted(dirnames):
+                relpath = os.path.join(reldir, name)
+                if self._excluded(name):
+                    continue
+                if os.path.islink(os.path.join(dirpath, name)):
+                    # os.walk doesn't descend into it, so it must not be
+                    # counted as pending
+                    logger.debug("skip symlinked directory %s" % relpath)
+                    continue
+                if self.manifest.dir_done(relpath):
+                    self.dirs_skipped += 1
+                    continue
+                subdirs.append(name)
+            # prune completed and excluded subtrees from the walk
+            dirnames[:] = subdirs
+
+            jobs = []
+            for name in sorted(filenames):
+                if self._excluded(name):
+                    continue
+                relpath = os.path.join(reldir, name)
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError as exc:
+                    # broken symlink or deleted since the directory was
+                    # listed: nothing to upload
+                    logger.warning("skip %s: %s" % (relpath, exc.strerror))
+                    self.files_vanished += 1
+                    continue
+                if self.manifest.file_done(relpath, st.st_size, st.st_mtime):
+                    self.files_skipped += 1
+                    continue
+                jobs.append((reldir, relpath, st.st_size, st.st_mtime))
+
+            if (jobs or subdirs) and not self.dry_run:
+                control.makedirs(self._remote(reldir))
+
+            with self._lock:
+                # +1 keeps the count above zero until all jobs are queued
+                self._pending[reldir] = len(jobs) + len(subdirs) + 1
+            for job in jobs:
+                self._queue.put(job)
+            with self._lock:
+                self._finish_one(reldir)
+
+    def run(self):
+        control = None if self.dry_run else connect(self.login)
+        workers = [threading.Thread(target=self._worker, args=(index,))
+                   for index in range(self.streams)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            self._walk(control)
+        finally:
+            for worker in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+            if control is not None:
+                control.close()
+        return not self._failed
+
+    def summary(self, elapsed):
+        """Return a human readable throughput summary."""
+        elapsed = max(elapsed, 1e-6)
+        megabytes = self.bytes_sent / (1024.0 * 1024.0)
+        lines = [
+            "files uploaded:   %d (%.1f MB)" % (self.files_sent, megabytes),
+            "files skipped:    %d (already in manifest)" % self.files_skipped,
+            "files vanished:   %d (broken link or deleted during the walk)"
+            % self.files_vanished,
+            "subtrees skipped: %d" % self.dirs_skipped,
+            "files failed:     %d" % len(self._failed),
+            "elapsed:          %.1f s" % elapsed,
+            "throughput:       %.2f MB/s over %d streams"
+            % (megabytes / elapsed, self.streams),
+        ]
+        for index, sent in enumerate(self.stream_bytes):
+            lines.append("  stream %d: %.2f MB/s"
+                         % (index, sent / (1024.0 * 1024.0) / elapsed))
+        for relpath in self._failed:
+            lines.append("  failed: %s" % relpath)
+        return "\n".join(lines)
+
+
+class _Params(object):
+    """
+    Class representing options and arguments for do_sync().
+    """
+
+    class UsageError(Exception):
+        pass
+
+    known = ["streams=", "manifest=", "restart", "overwrite-manifest",
+             "exclude=", "bwlimit=", "dry-run", "verbose", "quiet", "debug"]
+
+    def usage(self):
+        sys.stderr.write("""\
+Usage: %s [options] host source-dir target-dir
+Known options: %s
+""" % (sys.argv[0], ", ".join(["--" + x for x in self.known])))
+        raise self.UsageError()
+
+    def __init__(self, argv=None):
+        self.level = logging.INFO
+        self.streams = 4
+        self.manifest = None
+        self.restart = False
+        self.overwrite_manifest = False
+        self.excludes = []
+        self.bwlimit = None
+        self.dry_run = False
+
+        try:
+            (opts, args) = getopt.gnu_getopt(
+                sys.argv[1:] if argv is None else argv, "", self.known)
+        except getopt.GetoptError as exc:
+            sys.stderr.write("%s\n" % exc)
+            self.usage()
+
+        for (o, v) in opts:
+            if o == "--streams":
+                self.streams = int(v)
+            elif o == "--manifest":
+                self.manifest = v
+            elif o == "--restart":
+                self.restart = True
+            elif o == "--overwrite-manifest":
+                self.overwrite_manifest = True
+            elif o == "--exclude":
+                self.excludes.append(v)
+            elif o == "--bwlimit":
+                # KB/s, like rsync
+                self.bwlimit = int(v) * 1024
+            elif o == "--dry-run":
+                self.dry_run = True
+            elif o == "--verbose":
+                self.level = logging.INFO
+            elif o == "--debug":
+                self.level = logging.DEBUG
+            elif o == "--quiet":
+                self.level = logging.WARNING
+
+        if len(args) != 3:
+            self.usage()
+
+        (self.host, self.source, self.target) = args
+        if not os.path.isdir(self.source):
+            sys.stderr.write("%s is not a directory\n" % self.source)
+            self.usage()
+        if self.manifest is None:
+            self.manifest = default_manifest_path(self.host, self.source,
+                                                  self.target)
+
+
+def do_sync(parm):
+    logging.basicConfig(level=parm.level,
+                        format="%(asctime)s %(name)s: %(message)s")
+    log_checkpoint("starting at")
+
+    if parm.bwlimit:
+        bandwidth.configure(parm.host.split("@")[-1].partition(":")[0],
+                            rate=parm.bwlimit)
+    manifest = Manifest(parm.manifest, restart=parm.restart,
+                        overwrite=parm.overwrite_manifest,
+                        read_only=parm.dry_run)
+    logger.info("manifest: %s (%d files, %d subtrees already done)"
+                % (parm.manifest, len(manifest.files), len(manifest.dirs)))
+    uploader = ParallelUploader(login_data(parm.host), parm.source,
+                                parm.target, manifest,
+                                streams=parm.streams,
+                                excludes=parm.excludes,
+                                dry_run=parm.dry_run)
+    start = time.time()
+    try:
+        ok = uploader.run()
+    finally:
+        manifest.close()
+        sys.stdout.write(uploader.summary(time.time() - start) + "\n")
+
+    log_checkpoint("finished at")
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        parm = _Params()
+        ok = do_sync(parm)
+    except KeyboardInterrupt:
+        sys.stderr.write("Interrupted. Resume with --restart.\n")
+        sys.exit(130)
+    except _Params.UsageError:
+        sys.exit(129)
+    except ManifestExistsError as exc:
+        sys.stderr.write("%s\n" % exc)
+        sys.exit(1)
+    except ftp_error.FTPError as exc:
+        sys.stderr.write("%s\n" % exc)
+        sys.exit(1)
+    sys.exit(0 if ok else 1)
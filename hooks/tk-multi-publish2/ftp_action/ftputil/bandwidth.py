@@ -0,0 +1,138 @@
+# See the file LICENSE for licensing terms.
+
+"""
+bandwidth.py - token bucket rate limiting with priority lanes for transfers
+
+A `BandwidthScheduler` is shared by all transfers to one host in this
+process. Each chunk of a transfer asks the scheduler for permission
+via `consume` before it's sent. Transfers in a more urgent priority
+lane always go first: as long as a chunk of higher priority is
+waiting, lower lanes don't get any tokens. This keeps small
+interactive uploads from queueing behind bulk transfers.
+
+The rate can differ by time of day (e. g. limit bulk traffic during
+working hours only).
+"""
+
+import threading
+import time
+
+
+__all__ = ['PRIORITY_INTERACTIVE', 'PRIORITY_NORMAL', 'PRIORITY_BULK',
+           'BandwidthScheduler', 'configure', 'scheduler_for']
+
+# Priority lanes, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+_PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK)
+
+
+class BandwidthScheduler(object):
+    """
+    Token bucket with strict priority lanes.
+
+    `rate` is the default rate in bytes per second (`None` means
+    unlimited). `windows` is a sequence of `(start_hour, end_hour,
+    rate)` tuples in local time which override the default rate; the
+    end hour is exclusive and a window may wrap past midnight, e. g.
+    `(22, 6, None)`. `burst` is the bucket size in bytes and defaults
+    to one second's worth of the current rate.
+    """
+
+    def __init__(self, rate=None, windows=(), burst=None):
+        self.rate = rate
+        self.windows = list(windows)
+        self.burst = burst
+        self._condition = threading.Condition()
+        self._tokens = 0.0
+        self._stamp = time.time()
+        self._waiting = [0] * len(_PRIORITIES)
+
+    def current_rate(self, now=None):
+        """Return the rate in bytes per second in effect at `now`."""
+        local_time = time.localtime(now)
+        hour = local_time.tm_hour + local_time.tm_min / 60.0
+        for start, end, rate in self.windows:
+            if start <= end:
+                inside = start <= hour < end
+            else:
+                inside = hour >= start or hour < end
+            if inside:
+                return rate
+        return self.rate
+
+    def _refill(self, rate, now):
+        burst = self.burst or rate
+        self._tokens = min(burst, self._tokens + (now - self._stamp) * rate)
+        self._stamp = now
+
+    def consume(self, nbytes, priority=PRIORITY_NORMAL):
+        """
+        Block until `nbytes` may be sent in the given priority lane.
+
+        A chunk larger than the bucket is let through as soon as the
+        bucket is non-empty; the bucket then goes into debt which
+        later chunks have to wait for.
+        """
+        if priority not in _PRIORITIES:
+            raise ValueError("invalid transfer priority %r" % (priority,))
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    rate = self.current_rate(now)
+                    if not rate:
+                        # Unlimited; don't build up credit meanwhile.
+                        self._tokens = 0.0
+                        self._stamp = now
+                        return
+                    self._refill(rate, now)
+                    blocked = any(self._waiting[:priority])
+                    if not blocked and self._tokens > 0:
+                        self._tokens -= nbytes
+                        return
+                    if blocked:
+                        # Woken up by the higher lane when it's done.
+                        timeout = 0.1
+                    else:
+                        timeout = max(-self._tokens / rate, 0.001)
+                    self._condition.wait(timeout)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+
+# Schedulers shared by all `FTPHost` objects talking to the same host
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def configure(host, rate=None, windows=(), burst=None):
+    """
+    Set the rate limits for `host` and return its scheduler. Already
+    existing `FTPHost` objects for `host` pick up the new limits.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(host)
+        if scheduler is None:
+            scheduler = _schedulers[host] = BandwidthScheduler()
+    with scheduler._condition:
+        scheduler.rate = rate
+        scheduler.windows = list(windows)
+        scheduler.burst = burst
+    return scheduler
+
+
+def scheduler_for(host):
+    """
+    Return the scheduler for `host`, creating an unlimited one if the
+    host hasn't been configured.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(host)
+        if scheduler is None:
+            scheduler = _schedulers[host] = BandwidthScheduler()
+        return scheduler
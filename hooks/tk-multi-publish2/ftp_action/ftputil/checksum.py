@@ -0,0 +1,90 @@
+# See the file LICENSE for licensing terms.
+
+"""
+checksum.py - checksums computed while a file is transferred
+
+A `StreamChecksum` is fed with exactly the bytes written to the target
+of a transfer (see `file_transfer.copyfileobj`), so the source doesn't
+have to be read a second time. Besides MD5 and CRC32 digests it keeps
+the first and last bytes of the stream for a sampled read-back if the
+server can't compute checksums itself.
+"""
+
+import hashlib
+import zlib
+
+
+__all__ = ['StreamChecksum', 'parse_features', 'parse_hash_reply']
+
+# Number of bytes kept from the start and the end of the stream
+SAMPLE_SIZE = 64 * 1024
+
+
+class StreamChecksum(object):
+    """Running digests and head/tail samples of a byte stream."""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.size = 0
+        self.head = b''
+        self.tail = b''
+        self._md5 = hashlib.md5()
+        self._crc32 = 0
+
+    def update(self, data):
+        """Add the bytes `data` to the checksums."""
+        if not data:
+            return
+        self._md5.update(data)
+        self._crc32 = zlib.crc32(data, self._crc32)
+        self.size += len(data)
+        if len(self.head) < self.sample_size:
+            self.head += data[:self.sample_size - len(self.head)]
+        self.tail = (self.tail + data)[-self.sample_size:]
+
+    def hexdigest(self, algorithm):
+        """
+        Return the lowercase hex digest for `algorithm`, which is
+        "MD5" or "CRC32".
+        """
+        algorithm = algorithm.upper()
+        if algorithm == 'MD5':
+            return self._md5.hexdigest()
+        if algorithm == 'CRC32':
+            return '%08x' % (self._crc32 & 0xffffffff)
+        raise ValueError("unsupported checksum algorithm %r" % (algorithm,))
+
+    def as_dict(self):
+        """Return the checksums as a dictionary, e. g. for logging."""
+        return {'size': self.size,
+                'md5': self.hexdigest('MD5'),
+                'crc32': self.hexdigest('CRC32')}
+
+
+def parse_features(reply):
+    """
+    Return a dictionary mapping the uppercase feature names of a
+    `FEAT` reply to the rest of their line.
+    """
+    features = {}
+    for line in reply.splitlines()[1:-1]:
+        parts = line.strip().split(None, 1)
+        if parts:
+            features[parts[0].upper()] = parts[1] if len(parts) > 1 else ''
+    return features
+
+
+def parse_hash_reply(reply):
+    """
+    Return the lowercase hex digest from the reply to a `HASH`, `XMD5`
+    or `XCRC` command.
+
+    `HASH` replies look like "213 MD5 0-1234 <digest> <path>", the
+    others like "250 <digest>".
+    """
+    words = reply.split()
+    if words[0] == '213' and len(words) >= 4:
+        digest = words[3]
+    else:
+        digest = words[1]
+    return digest.lower().lstrip('0') or '0'
@@ -6,6 +6,9 @@ file_transfer.py - upload, download and generic file copy
 """
 
 import os
+import zlib
+
+from . import bandwidth
 
 
 #TODO Think a bit more about the API before making it public.
@@ -17,6 +20,14 @@ __all__ = []
 # Maximum size of chunk in `FTPHost.copyfileobj` in bytes.
 MAX_COPY_CHUNK_SIZE = 64 * 1024
 
+# Compressed uploads store the gzip blob as `<target>.gz` and, once the
+#  blob is complete, a JSON sidecar `<target>.gz.json` describing it.
+COMPRESSED_SUFFIX = ".gz"
+SIDECAR_SUFFIX = ".gz.json"
+
+# `wbits` value selecting the gzip container for `zlib`
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
 
 class LocalFile(object):
     """
@@ -118,18 +129,73 @@ def chunks(fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE):
         yield chunk
 
 
+def compressed_chunks(fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE):
+    """
+    Return an iterator which yields the contents of the file object
+    gzip compressed, one compressed piece per chunk read (empty pieces
+    are skipped).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    for chunk in chunks(fobj, max_chunk_size):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 def copyfileobj(source_fobj, target_fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE,
-                callback=None):
-    """Copy data from file-like object source to file-like object target."""
+                callback=None, scheduler=None,
+                priority=bandwidth.PRIORITY_NORMAL,
+                compress=False, decompress=False, checksum=None):
+    """
+    Copy data from file-like object source to file-like object target.
+
+    If a `bandwidth.BandwidthScheduler` is given as `scheduler`, each
+    chunk waits for its turn in the `priority` lane before it's written.
+
+    With `compress` the data is gzip compressed on the fly, with
+    `decompress` gzip data from the source is decompressed on the fly.
+    Rate limiting and `callback` see the data as it travels over the
+    wire, i. e. compressed.
+
+    If a `checksum.StreamChecksum` is given as `checksum`, it's updated
+    with the data written to the target.
+
+    Return the number of bytes written to the target.
+    """
     # Inspired by `shutil.copyfileobj` (I don't use the `shutil`
     #  code directly because it might change)
-    for chunk in chunks(source_fobj, max_chunk_size):
-        target_fobj.write(chunk)
+    if compress:
+        source = compressed_chunks(source_fobj, max_chunk_size)
+    else:
+        source = chunks(source_fobj, max_chunk_size)
+    decompressor = zlib.decompressobj(_GZIP_WBITS) if decompress else None
+    written = 0
+    for chunk in source:
+        if scheduler is not None:
+            scheduler.consume(len(chunk), priority)
+        if decompressor is not None:
+            data = decompressor.decompress(chunk)
+        else:
+            data = chunk
+        target_fobj.write(data)
+        written += len(data)
+        if checksum is not None:
+            checksum.update(data)
         if callback is not None:
             callback(chunk)
-
-
-def copy_file(source_file, target_file, conditional, callback):
+    if decompressor is not None:
+        data = decompressor.flush()
+        target_fobj.write(data)
+        written += len(data)
+        if checksum is not None:
+            checksum.update(data)
+    return written
+
+
+def copy_file(source_file, target_file, conditional, callback,
+              scheduler=None, priority=bandwidth.PRIORITY_NORMAL,
+              compress=False, decompress=False, checksum=None):
     """
     Copy a file from `source_file` to `target_file`.
 
@@ -139,7 +205,8 @@ def copy_file(source_file, target_file, conditional, callback):
     copied if the target doesn't exist or is older than the
     source. If `conditional` is false, the file is copied
     unconditionally. Return `True` if the file was copied, else
-    `False`.
+    `False`. `scheduler`, `priority`, `compress`, `decompress` and
+    `checksum` are passed on to `copyfileobj`.
     """
     if conditional:
         # Evaluate condition: The target file either doesn't exist or is
@@ -154,7 +221,10 @@ def copy_file(source_file, target_file, conditional, callback):
     try:
         target_fobj = target_file.fobj()
         try:
-            copyfileobj(source_fobj, target_fobj, callback=callback)
+            copyfileobj(source_fobj, target_fobj, callback=callback,
+                        scheduler=scheduler, priority=priority,
+                        compress=compress, decompress=decompress,
+                        checksum=checksum)
         finally:
             target_fobj.close()
     finally:
@@ -123,6 +123,10 @@ class SyncError(PermanentError):
     """Raised for problems specific to syncing directories."""
     pass
 
+class VerificationError(FTPError):
+    """Raised if an uploaded file doesn't match its local checksum."""
+    pass
+
 
 #XXX Do you know better names for `_try_with_oserror` and
 #    `_try_with_ioerror`?
@@ -60,13 +60,18 @@ class _FTPFile(object):
         self._read_mode = None
         self._fo = None
 
-    def _open(self, path, mode):
-        """Open the remote file with given path name and mode."""
+    def _open(self, path, mode, rest=None):
+        """
+        Open the remote file with given path name and mode. For reading,
+        `rest` is the byte offset to start at.
+        """
         # Check mode.
         if 'a' in mode:
             raise ftp_error.FTPIOError("append mode not supported")
         if mode not in ('r', 'rb', 'w', 'wb'):
             raise ftp_error.FTPIOError("invalid mode '%s'" % mode)
+        if rest is not None and mode != 'rb':
+            raise ftp_error.FTPIOError("offset only supported in mode 'rb'")
         # Remember convenience variables instead of the mode itself.
         self._bin_mode = 'b' in mode
         self._read_mode = 'r' in mode
@@ -83,7 +88,7 @@ class _FTPFile(object):
             mode = mode + 'b'
         # Get connection and file object.
         self._conn = ftp_error._try_with_ioerror(
-                       self._session.transfercmd, command)
+                       self._session.transfercmd, command, rest)
         self._fo = self._conn.makefile(mode)
         # This comes last so that `close` won't try to close `_FTPFile`
         #  objects without `_conn` and `_fo` attributes in case of an error.
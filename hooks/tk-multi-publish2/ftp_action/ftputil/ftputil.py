@@ -48,11 +48,15 @@ Note: ftputil currently is not threadsafe. More specifically, you can
 """
 
 import ftplib
+import json
+import os
 import stat
 import sys
 import time
 import warnings
 
+from . import bandwidth
+from . import checksum as checksum_
 from . import file_transfer
 from . import ftp_error
 from . import ftp_file
@@ -124,6 +128,11 @@ class FTPHost(object):
         # Set default time shift (used in `upload_if_newer` and
         #  `download_if_newer`).
         self.set_time_shift(0.0)
+        # Uploads and downloads aren't rate limited unless a
+        #  `bandwidth.BandwidthScheduler` is set.
+        self._bandwidth_scheduler = None
+        # Server features from `FEAT`, queried on first use
+        self._features = None
 
     def keep_alive(self):
         """
@@ -192,13 +201,14 @@ class FTPHost(object):
         # Be explicit.
         return None
 
-    def file(self, path, mode='r'):
+    def file(self, path, mode='r', rest=None):
         """
         Return an open file(-like) object which is associated with
         this `FTPHost` object.
 
         This method tries to reuse a child but will generate a new one
-        if none is available.
+        if none is available. For reading, `rest` is the byte offset to
+        start at (needs a binary mode).
         """
         host = self._available_child()
         if host is None:
@@ -221,7 +231,7 @@ class FTPHost(object):
             #  raise an `IOError`, not an `OSError`.
             raise ftp_error.FTPIOError("remote directory '%s' doesn't exist "
                   "or has insufficient access rights" % effective_dir)
-        host._file._open(effective_file, mode)
+        host._file._open(effective_file, mode, rest)
         if 'w' in mode:
             # Invalidate cache entry because size and timestamps will change.
             self.stat_cache.invalidate(effective_path)
@@ -290,6 +300,24 @@ class FTPHost(object):
         self._stat._parser = parser
         self._stat._allow_parser_switching = False
 
+    #
+    # Bandwidth limiting
+    #
+    def set_bandwidth_scheduler(self, scheduler):
+        """
+        Rate limit `upload(_if_newer)` and `download(_if_newer)` with
+        the given `bandwidth.BandwidthScheduler`. Pass `None` to
+        disable rate limiting. Share one scheduler between all
+        `FTPHost` objects for the same server (see
+        `bandwidth.scheduler_for`) so their transfers are limited
+        together.
+        """
+        self._bandwidth_scheduler = scheduler
+
+    def bandwidth_scheduler(self):
+        """Return the bandwidth scheduler or `None`."""
+        return self._bandwidth_scheduler
+
     #
     # Time shift adjustment between client (i. e. us) and server
     #
@@ -454,17 +482,175 @@ class FTPHost(object):
         target_file = file_transfer.RemoteFile(self, target_path, target_mode)
         return source_file, target_file
 
-    def upload(self, source, target, mode='', callback=None):
+    def upload(self, source, target, mode='', callback=None,
+               priority=bandwidth.PRIORITY_NORMAL, compress=False,
+               checksum=None):
         """
         Upload a file from the local source (name) to the remote
         target (name). The argument `mode` is an empty string or 'a' for
-        text copies, or 'b' for binary copies.
+        text copies, or 'b' for binary copies. `priority` is the
+        bandwidth lane used if a bandwidth scheduler is set.
+
+        If `compress` is true, the file is gzip compressed on the fly
+        and stored as `target + file_transfer.COMPRESSED_SUFFIX`,
+        followed by a JSON sidecar `target + file_transfer.SIDECAR_SUFFIX`.
+        `download` decompresses such files transparently. The transfer
+        is always binary in this case.
+
+        If a `checksum.StreamChecksum` is given as `checksum`, it's
+        updated with the bytes stored on the server (the compressed
+        ones if `compress` is true); see `verify_upload`.
         """
+        if compress:
+            self._upload_compressed(source, target, callback, priority,
+                                    checksum)
+            return
         source_file, target_file = self._upload_files(source, target, mode)
         file_transfer.copy_file(source_file, target_file,
-                                conditional=False, callback=callback)
+                                conditional=False, callback=callback,
+                                scheduler=self._bandwidth_scheduler,
+                                priority=priority, checksum=checksum)
+
+    def _upload_compressed(self, source, target, callback, priority,
+                           checksum=None):
+        """
+        Upload `source` gzip compressed, then write the sidecar which
+        marks the compressed upload as complete.
+        """
+        source_file, target_file = self._upload_files(
+          source, target + file_transfer.COMPRESSED_SUFFIX, 'b')
+        source_fobj = source_file.fobj()
+        try:
+            target_fobj = target_file.fobj()
+            try:
+                compressed_size = file_transfer.copyfileobj(
+                  source_fobj, target_fobj, callback=callback,
+                  scheduler=self._bandwidth_scheduler, priority=priority,
+                  compress=True, checksum=checksum)
+            finally:
+                target_fobj.close()
+        finally:
+            source_fobj.close()
+        sidecar = {
+          "codec": "gzip",
+          "name": os.path.basename(source),
+          "size": os.path.getsize(source_file.name),
+          "mtime": source_file.mtime(),
+          "compressed_size": compressed_size,
+          }
+        sidecar_fobj = self.file(target + file_transfer.SIDECAR_SUFFIX, 'wb')
+        try:
+            sidecar_fobj.write(json.dumps(sidecar).encode("utf-8"))
+        finally:
+            sidecar_fobj.close()
+
+    def compressed_sidecar(self, path):
+        """
+        Return the sidecar dictionary if `path` was uploaded with
+        `compress=True` (and isn't also present uncompressed), else
+        `None`.
+        """
+        sidecar_path = path + file_transfer.SIDECAR_SUFFIX
+        if self.path.exists(path) or not self.path.isfile(sidecar_path):
+            return None
+        sidecar_fobj = self.file(sidecar_path, 'rb')
+        try:
+            return json.loads(sidecar_fobj.read().decode("utf-8"))
+        finally:
+            sidecar_fobj.close()
+
+    def features(self):
+        """
+        Return a dictionary of the server's `FEAT` reply, mapping
+        uppercase feature names to their parameters (empty if the
+        server doesn't support `FEAT`).
+        """
+        if self._features is None:
+            try:
+                reply = ftp_error._try_with_oserror(self._session.sendcmd,
+                                                    'FEAT')
+            except ftp_error.PermanentError:
+                reply = ''
+            self._features = checksum_.parse_features(reply)
+        return self._features
 
-    def upload_if_newer(self, source, target, mode='', callback=None):
+    def remote_checksum(self, path, algorithms=('MD5', 'CRC32')):
+        """
+        Return a tuple `(command, algorithm, hexdigest)` with a
+        checksum of the remote file `path` computed by the server, or
+        `None` if the server supports none of the `HASH`, `XMD5` or
+        `XCRC` commands for the given algorithms.
+        """
+        features = self.features()
+        candidates = []
+        if 'HASH' in features:
+            offered = [name.rstrip('*').upper()
+                       for name in features['HASH'].split(';')]
+            candidates.extend(('HASH', name) for name in algorithms
+                              if name in offered)
+        for command, name in (('XMD5', 'MD5'), ('XCRC', 'CRC32')):
+            if command in features and name in algorithms:
+                candidates.append((command, name))
+        for command, name in candidates:
+            try:
+                if command == 'HASH':
+                    ftp_error._try_with_oserror(self._session.sendcmd,
+                                                'OPTS HASH %s' % name)
+                reply = ftp_error._try_with_oserror(
+                          self._session.sendcmd, '%s %s' % (command, path))
+            except ftp_error.PermanentError:
+                continue
+            return command, name, checksum_.parse_hash_reply(reply)
+        return None
+
+    def _read_sample(self, path, offset, size):
+        """Return up to `size` bytes of remote file `path` at `offset`."""
+        fobj = self.file(path, 'rb', rest=offset or None)
+        try:
+            data = b''
+            while len(data) < size:
+                chunk = fobj.read(size - len(data))
+                if not chunk:
+                    break
+                data += chunk
+            return data
+        finally:
+            fobj.close()
+
+    def verify_upload(self, target, checksum, compress=False):
+        """
+        Check the remote file against the `checksum.StreamChecksum`
+        filled during `upload(..., checksum=checksum)` and return a
+        dictionary with the checksums, the verification `method` and
+        `ok`.
+
+        A server side checksum (`HASH`, `XMD5` or `XCRC`) is preferred.
+        Otherwise the remote size is compared and the first and last
+        bytes are read back.
+        """
+        if compress:
+            target = target + file_transfer.COMPRESSED_SUFFIX
+        result = checksum.as_dict()
+        remote = self.remote_checksum(target)
+        if remote is not None:
+            command, algorithm, digest = remote
+            local_digest = checksum.hexdigest(algorithm).lstrip('0') or '0'
+            result['method'] = '%s %s' % (command, algorithm)
+            result['ok'] = (digest == local_digest)
+            return result
+        result['method'] = 'size+sample'
+        self.stat_cache.invalidate(target)
+        if self.path.getsize(target) != checksum.size:
+            result['ok'] = False
+            return result
+        head = self._read_sample(target, 0, len(checksum.head))
+        tail_offset = checksum.size - len(checksum.tail)
+        tail = self._read_sample(target, tail_offset, len(checksum.tail))
+        result['ok'] = (head == checksum.head and tail == checksum.tail)
+        return result
+
+    def upload_if_newer(self, source, target, mode='', callback=None,
+                        priority=bandwidth.PRIORITY_NORMAL):
         """
         Upload a file only if it's newer than the target on the
         remote host or if the target file does not exist. See the
@@ -475,7 +661,9 @@ class FTPHost(object):
         """
         source_file, target_file = self._upload_files(source, target, mode)
         return file_transfer.copy_file(source_file, target_file,
-                                       conditional=True, callback=callback)
+                                       conditional=True, callback=callback,
+                                       scheduler=self._bandwidth_scheduler,
+                                       priority=priority)
 
     def _download_files(self, source_path, target_path, mode):
         """
@@ -487,17 +675,29 @@ class FTPHost(object):
         target_file = file_transfer.LocalFile(target_path, target_mode)
         return source_file, target_file
 
-    def download(self, source, target, mode='', callback=None):
+    def download(self, source, target, mode='', callback=None,
+                 priority=bandwidth.PRIORITY_NORMAL):
         """
         Download a file from the remote source (name) to the local
         target (name). The argument mode is an empty string or 'a' for
-        text copies, or 'b' for binary copies.
+        text copies, or 'b' for binary copies. `priority` is the
+        bandwidth lane used if a bandwidth scheduler is set.
+
+        If `source` only exists as a compressed upload (see `upload`),
+        it's decompressed on the fly.
         """
+        decompress = self.compressed_sidecar(source) is not None
+        if decompress:
+            source = source + file_transfer.COMPRESSED_SUFFIX
+            mode = 'b'
         source_file, target_file = self._download_files(source, target, mode)
         file_transfer.copy_file(source_file, target_file,
-                                conditional=False, callback=callback)
+                                conditional=False, callback=callback,
+                                scheduler=self._bandwidth_scheduler,
+                                priority=priority, decompress=decompress)
 
-    def download_if_newer(self, source, target, mode='', callback=None):
+    def download_if_newer(self, source, target, mode='', callback=None,
+                          priority=bandwidth.PRIORITY_NORMAL):
         """
         Download a file only if it's newer than the target on the
         local host or if the target file does not exist. See the
@@ -508,7 +708,9 @@ class FTPHost(object):
         """
         source_file, target_file = self._download_files(source, target, mode)
         return file_transfer.copy_file(source_file, target_file,
-                                       conditional=True, callback=callback)
+                                       conditional=True, callback=callback,
+                                       scheduler=self._bandwidth_scheduler,
+                                       priority=priority)
 
     #
     # Helper methods to descend into a directory before executing a command
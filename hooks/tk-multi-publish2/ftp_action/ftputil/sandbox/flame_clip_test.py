@@ -0,0 +1,224 @@
+# :coding: utf-8
+
+"""
+Tests of the journaled, byte preserving open clip updates of the
+configuration's nuke_update_flame_clip.py hook.
+
+Run it with any python 3 interpreter, no ShotGrid or toolkit install needed:
+
+    python flame_clip_test.py
+
+The hook is loaded with a minimal stand-in for the sgtk module; only its
+module level clip functions are tested.
+"""
+
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+HOOK_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir,
+    os.pardir,
+    os.pardir,
+    "nuke",
+    "basic",
+    "nuke_update_flame_clip.py",
+)
+
+CLIP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<clip type="clip" version="6">
+  <!-- written by flame -->
+  <name type="string">sh010_comp</name>
+  <tracks type="tracks">
+    <track type="track" uid="audio">
+      <trackType>audio</trackType>
+      <feeds><feed type="feed" uid="a1"/></feeds>
+    </track>
+    <track type="track" uid="video">
+      <trackType>video</trackType>
+      <feeds currentVersion="v001">
+        <feed type="feed" vuid="v001" uid="v001">
+          <spans type="spans" version="5">
+            <span type="span" version="5"><path encoding="pattern">/a.[1-2].exr</path></span>
+          </spans>
+        </feed>
+      </feeds>
+    </track>
+  </tracks>
+  <versions type="versions" currentVersion="v001"><version type="version" uid="v001"/></versions>
+</clip>
+"""
+
+
+class _Engine(object):
+    def execute_hook_expression(self, expression, method_name, **kwargs):
+        # the clip functions don't use the ftp_action package
+        return None
+
+
+def _load_hook():
+    sgtk = types.ModuleType("sgtk")
+    util = types.ModuleType("sgtk.util")
+    platform = types.ModuleType("sgtk.platform")
+    util.get_published_file_entity_type = None
+    util.resolve_publish_path = None
+    util.register_publish = None
+    platform.current_engine = _Engine
+    sgtk.util = util
+    sgtk.platform = platform
+    sgtk.get_hook_baseclass = lambda: object
+    modules = {"sgtk": sgtk, "sgtk.util": util, "sgtk.platform": platform}
+
+    saved = dict((name, sys.modules.get(name)) for name in modules)
+    sys.modules.update(modules)
+    try:
+        spec = importlib.util.spec_from_file_location("flame_clip_test_hook", HOOK_PATH)
+        hook = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(hook)
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+    return hook
+
+
+flame_clip = _load_hook()
+
+
+def _entry(uid):
+    return {
+        "uid": uid,
+        "path": "/show/sh010/%s/sh010.[1001-1010].exr" % uid,
+        "name": "sh010_comp_%s" % uid,
+        "date": "2026/10/19 12:00:00",
+    }
+
+
+class ScanTest(unittest.TestCase):
+    def test_first_video_track(self):
+        found = flame_clip._scan_flame_clip(CLIP)
+        (start, end) = found["feeds"]
+        self.assertTrue(CLIP[start:].startswith(b'<feeds currentVersion="v001">'))
+        self.assertTrue(CLIP[end:].startswith(b"</feeds>"))
+        (start, end) = found["versions"]
+        self.assertTrue(CLIP[start:].startswith(b"<versions "))
+        self.assertTrue(CLIP[end:].startswith(b"</versions>"))
+        self.assertEqual(found["spans_version"], "5")
+
+    def test_no_video_track(self):
+        clip = CLIP.replace(b"<trackType>video</trackType>", b"")
+        self.assertIsNone(flame_clip._scan_flame_clip(clip)["feeds"])
+
+
+class InsertTest(unittest.TestCase):
+    def test_rest_of_file_kept(self):
+        found = flame_clip._scan_flame_clip(CLIP)
+        feed = ElementTree.Element("feed", {"uid": "v002"})
+        version = ElementTree.Element("version")
+        data = flame_clip._insert_into_flame_clip(
+            CLIP,
+            [
+                (found["feeds"], "feeds", [feed]),
+                (found["versions"], "versions", [version]),
+            ],
+        )
+        self.assertEqual(
+            data.replace(b'<feed uid="v002" />', b"").replace(b"<version />", b""),
+            CLIP,
+        )
+        video_feeds = ElementTree.fromstring(data).findall("tracks/track")[1]
+        self.assertEqual(
+            [f.get("uid") for f in video_feeds.find("feeds")], ["v001", "v002"]
+        )
+
+    def test_empty_parent(self):
+        clip = b'<clip><versions type="versions"/></clip>'
+        data = flame_clip._insert_into_flame_clip(
+            clip,
+            [((6, 6), "versions", [ElementTree.Element("version")])],
+        )
+        self.assertEqual(
+            data, b'<clip><versions type="versions"><version /></versions></clip>'
+        )
+
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.clip_path = os.path.join(self.folder, "sh010.clip")
+        with open(self.clip_path, "wb") as fh:
+            fh.write(CLIP)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _clip(self):
+        with open(self.clip_path, "rb") as fh:
+            return fh.read()
+
+    def test_one_rewrite_for_all_entries(self):
+        flame_clip._append_flame_clip_journal(self.clip_path, _entry("v002"))
+        flame_clip._append_flame_clip_journal(self.clip_path, _entry("v003"))
+        self.assertEqual(flame_clip._compact_flame_clip(self.clip_path), 2)
+
+        root = ElementTree.fromstring(self._clip())
+        feeds = root.findall("tracks/track")[1].find("feeds")
+        self.assertEqual([f.get("uid") for f in feeds], ["v001", "v002", "v003"])
+        self.assertEqual(
+            feeds[2].find("spans").get("version"), "5", "spans version of the clip"
+        )
+        self.assertEqual(
+            [v.get("uid") for v in root.find("versions")], ["v001", "v002", "v003"]
+        )
+        self.assertIn(b"<!-- written by flame -->", self._clip())
+
+        backups = [n for n in os.listdir(self.folder) if ".bak_" in n]
+        self.assertEqual(len(backups), 1)
+
+    def test_pending_entries_not_added_twice(self):
+        flame_clip._append_flame_clip_journal(self.clip_path, _entry("v002"))
+        flame_clip._compact_flame_clip(self.clip_path)
+        # a compaction that failed after writing the clip leaves its
+        # entries pending
+        flame_clip._append_flame_clip_journal(self.clip_path, _entry("v002"))
+        self.assertEqual(flame_clip._compact_flame_clip(self.clip_path), 0)
+        # vuid and uid of the feed, uid of the version
+        self.assertEqual(self._clip().count(b'uid="v002"'), 3)
+
+    def test_lock_files_deleted(self):
+        flame_clip._append_flame_clip_journal(self.clip_path, _entry("v002"))
+        flame_clip._compact_flame_clip(self.clip_path)
+        self.assertEqual(
+            [n for n in os.listdir(self.folder) if n.endswith(".lock")], []
+        )
+
+    def test_waiter_locks_the_new_file(self):
+        lock_path = self.clip_path + flame_clip.CLIP_COMPACT_LOCK_SUFFIX
+        lock = flame_clip._lock_file(lock_path)
+        locked = []
+        waiter = threading.Thread(
+            target=lambda: locked.append(flame_clip._lock_file(lock_path))
+        )
+        waiter.start()
+        time.sleep(0.2)
+        self.assertEqual(locked, [])
+
+        # the waiter wakes up on the deleted file and locks a new one
+        flame_clip._unlock_file(lock, lock_path)
+        waiter.join(5)
+        self.assertTrue(os.path.samestat(os.fstat(locked[0]), os.stat(lock_path)))
+        flame_clip._unlock_file(locked[0], lock_path)
+        self.assertFalse(os.path.exists(lock_path))
+
+if __name__ == "__main__":
+    unittest.main()
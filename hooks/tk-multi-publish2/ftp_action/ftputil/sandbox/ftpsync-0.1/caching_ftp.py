@@ -57,6 +57,7 @@ class CachingFTPHost(FTPHost, LoggingClass):
                 self.logger.warning("Server is case-insensitive")
                 self.path = CaseInsPath(self)
                 self._stat = CaseInsStat(self)
+                self.stat_cache = self._stat._lstat_cache
                 self.cache.invalidate_all()
             else:
                 self.logger.info("Server is case-sensitive")
@@ -93,11 +94,16 @@ class CachingFTPHost(FTPHost, LoggingClass):
             self.logger.debug("cache hit: %s" % path)
         return lines
 
+    def _invalidate_index(self, path):
+        if isinstance(self._stat, CaseInsStat):
+            self._stat.invalidate_index(path)
+
     def _invalidate_dir(self, path):
         self.logger.debug("invalidating cache for %s" % path)
-        self.cache.invalidate(
-            self.path.normcase(
-            self.path.dirname(self.path.abspath(path))))
+        dirname = self.path.normcase(
+            self.path.dirname(self.path.abspath(path)))
+        self.cache.invalidate(dirname)
+        self._invalidate_index(dirname)
 
     def file(self, path, mode='r'):
         path = self.path.abspath(path)
@@ -113,8 +119,9 @@ class CachingFTPHost(FTPHost, LoggingClass):
 
     def rmdir(self, path):
         FTPHost.rmdir(self, path)
-        self.cache.invalidate(self.path.normcase(
-            self.path.abspath(path)))
+        abspath = self.path.normcase(self.path.abspath(path))
+        self.cache.invalidate(abspath)
+        self._invalidate_index(abspath)
         self._invalidate_dir(path)
 
     def remove(self, path):
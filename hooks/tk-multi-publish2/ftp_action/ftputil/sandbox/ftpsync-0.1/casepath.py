@@ -1,5 +1,5 @@
 import posixpath
-from ftputil import ftp_path, ftp_stat
+from ftputil import ftp_error, ftp_path, ftp_stat
 from casestr import CaseInsStr
 
 class BasePath(ftp_path._Path):
@@ -96,18 +96,75 @@ class CaseInsStat(ftp_stat._Stat):
     manner.
 
     E.g. "Spam" will be found and stat'd in a directory listing "spam, eggs".
+
+    Each directory listing is parsed once into an index mapping lowercase
+    names to their stat results, so lookups don't rescan the listing.
+    An index is rebuilt whenever the host returns a different listing
+    object for the directory (i.e. after the directory cache entry was
+    invalidated or expired), and can be dropped explicitly with
+    invalidate_index().
     """
 
-    def _stat_candidates(self, lines, wanted_name):
-        """Return candidate lines for further analysis."""
-        ret =  [line
-                for line in lines
-                if CaseInsStr(line).find(wanted_name) != -1]
-        return ret
-        
+    def __init__(self, host):
+        ftp_stat._Stat.__init__(self, host)
+        # lowercase dirname -> (listing lines, {lowercase name: [stat results]})
+        self._name_index = {}
+
+    def invalidate_index(self, dirname=None):
+        """
+        Drop the name index for dirname, or all indexes if dirname is None.
+        """
+        if dirname is None:
+            self._name_index.clear()
+        else:
+            self._name_index.pop(str.lower(str(dirname)), None)
+
+    def _directory_index(self, dirname):
+        """
+        Return the name index for dirname, building it from the
+        directory listing if necessary.
+        """
+        lines = self._host_dir(dirname)
+        key = str.lower(str(dirname))
+        try:
+            indexed_lines, index = self._name_index[key]
+        except KeyError:
+            pass
+        else:
+            if indexed_lines is lines:
+                return index
+        index = {}
+        for line in lines:
+            if self._parser.ignores_line(line):
+                continue
+            stat_result = self._parser.parse_line(line,
+                                                  self._host.time_shift())
+            loop_path = self._path.join(dirname, stat_result._st_name)
+            self._lstat_cache[loop_path] = stat_result
+            index.setdefault(str.lower(stat_result._st_name),
+                             []).append(stat_result)
+        self._name_index[key] = (lines, index)
+        return index
+
     def _real_lstat(self, path,  _exception_for_missing_path=True):
 
-        path = CaseInsStr(path)
-        ret = ftp_stat._Stat._real_lstat(self, path,
-                                         _exception_for_missing_path)
-        return ret
+        path = CaseInsStr(self._path.abspath(path))
+        if path in self._lstat_cache:
+            return self._lstat_cache[path]
+        if path == '/':
+            raise ftp_error.RootDirError(
+                  "can't stat remote root directory")
+        dirname, basename = self._path.split(path)
+        candidates = self._directory_index(dirname).get(
+            str.lower(str(basename)))
+        if candidates:
+            # Prefer an exact match if the server has several entries
+            # differing only by case.
+            for stat_result in candidates:
+                if stat_result._st_name == str(basename):
+                    return stat_result
+            return candidates[0]
+        if _exception_for_missing_path:
+            raise ftp_error.PermanentError(
+                  "550 %s: no such file or directory" % path)
+        return None
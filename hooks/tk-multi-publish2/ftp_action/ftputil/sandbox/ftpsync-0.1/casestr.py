@@ -32,7 +32,13 @@ class CaseInsStr(str):
         return self.__str__()
 
     def _lower(self):
-        return str.lower(self)
+        # Cache the lowercase form; comparisons are frequent and strings
+        # are immutable.
+        try:
+            return self.__lower
+        except AttributeError:
+            self.__lower = str.lower(self)
+            return self.__lower
 
     def __cmp__(self, other):
         """
@@ -0,0 +1,409 @@
+# :coding: utf-8
+
+"""
+Tests of the sequence frame matching, the promotion modes and the batched
+publish registration of the configuration's publish_file.py hook.
+
+Run it with any python 3 interpreter, no ShotGrid or toolkit install needed:
+
+    python publish_file_test.py
+
+The hook is loaded with a minimal stand-in for the sgtk module that only
+provides what these code paths touch.
+"""
+
+import importlib.util
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+HOOKS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir
+)
+HOOK_PATH = os.path.join(HOOKS_DIR, "publish_file.py")
+FTP_ACTION_HOOK_PATH = os.path.join(HOOKS_DIR, "ftp_action_hook.py")
+FTP_ACTION_HOOK = "{config}/tk-multi-publish2/ftp_action_hook.py"
+
+
+def _fake_sgtk():
+    """
+    Return a module standing in for sgtk while publish_file.py is imported.
+    """
+    sgtk = types.ModuleType("sgtk")
+    util = types.ModuleType("sgtk.util")
+    filesystem = types.ModuleType("sgtk.util.filesystem")
+    templatekey = types.ModuleType("sgtk.templatekey")
+    platform = types.ModuleType("sgtk.platform")
+
+    def copy_file(src, dst):
+        shutil.copy(src, dst)
+        os.chmod(dst, 0o666)
+
+    def ensure_folder_exists(path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    class SequenceKey(object):
+        def __init__(self, name):
+            self.name = name
+
+    filesystem.copy_file = copy_file
+    filesystem.ensure_folder_exists = ensure_folder_exists
+    util.filesystem = filesystem
+    util.find_publish = lambda tk, paths: {}
+    templatekey.SequenceKey = SequenceKey
+    sgtk.util = util
+    sgtk.templatekey = templatekey
+    sgtk.get_hook_baseclass = lambda: object
+    sgtk.platform = platform
+    return {
+        "sgtk": sgtk,
+        "sgtk.util": util,
+        "sgtk.util.filesystem": filesystem,
+        "sgtk.templatekey": templatekey,
+        "sgtk.platform": platform,
+    }
+
+
+class _Engine(object):
+    """
+    Runs the configuration's ftp_action_hook.py, the only hook expression
+    publish_file.py executes while it is imported.
+    """
+
+    def __init__(self, ftp_action_hook):
+        self._ftp_action_hook = ftp_action_hook
+
+    def execute_hook_expression(self, expression, method_name, **kwargs):
+        assert expression == FTP_ACTION_HOOK, expression
+        return getattr(self._ftp_action_hook, method_name)(**kwargs)
+
+
+def _exec_file(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _load_hook():
+    modules = _fake_sgtk()
+    saved = dict((name, sys.modules.get(name)) for name in modules)
+    sys.modules.update(modules)
+    try:
+        ftp_action_hook = _exec_file("ftp_action_test_hook", FTP_ACTION_HOOK_PATH)
+        engine = _Engine(ftp_action_hook.FtpActionHook())
+        modules["sgtk.platform"].current_engine = lambda: engine
+        hook = _exec_file("publish_file_test_hook", HOOK_PATH)
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+    return hook, modules["sgtk"]
+
+
+publish_file, sgtk = _load_hook()
+
+
+class _Setting(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class _Properties(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class _Item(object):
+    def __init__(self, parent=None, tasks=(), children=()):
+        self.parent = parent
+        self.is_root = parent is None
+        self.tasks = list(tasks)
+        self.children = list(children)
+        self.properties = _Properties()
+
+
+class _Task(object):
+    def __init__(self, settings, active=True):
+        self.settings = settings
+        self.active = active
+
+
+class _Template(object):
+    """
+    Work or publish template of a single sequence key, "SEQ", and a fixed
+    folder. apply_fields() formats the frame like the toolkit templates.
+    """
+
+    def __init__(self, folder, name="plate.%s.exr"):
+        self.name = folder
+        self.folder = folder
+        self.file_name = name
+        self.keys = {"SEQ": sgtk.templatekey.SequenceKey("SEQ")}
+        self.parsed = []
+
+    def apply_fields(self, fields):
+        frame = fields["SEQ"]
+        if frame == "FORMAT: %d":
+            frame = "%04d"
+        else:
+            frame = "%04d" % frame
+        return os.path.join(self.folder, self.file_name % frame)
+
+    def _match(self, path):
+        self.parsed.append(path)
+        regex = publish_file._frame_regex(self.apply_fields({"SEQ": "FORMAT: %d"}))
+        return regex.match(path)
+
+    def validate(self, path):
+        return self._match(path) is not None
+
+    def get_fields(self, path):
+        return {"SEQ": int(self._match(path).group(1))}
+
+    def missing_keys(self, fields):
+        return [key for key in self.keys if key not in fields]
+
+
+class _Shotgun(object):
+    def __init__(self):
+        self.batches = []
+        self.thumbnails = []
+        self._next_id = 100
+
+    def batch(self, requests):
+        self.batches.append(list(requests))
+        results = []
+        for request in requests:
+            self._next_id += 1
+            entity = dict(request.get("data", {}))
+            entity.update(type=request["entity_type"], id=self._next_id)
+            results.append(entity)
+        return results
+
+    def upload_thumbnail(self, entity_type, entity_id, path):
+        self.thumbnails.append((entity_type, entity_id, path))
+
+
+class _Parent(object):
+    def __init__(self):
+        self.shotgun = _Shotgun()
+        self.sgtk = object()
+
+
+def _plugin():
+    plugin = publish_file.BasicFilePublishPlugin()
+    plugin.logger = logging.getLogger("publish_file_test")
+    plugin.parent = _Parent()
+    return plugin
+
+
+class FrameRegexTest(unittest.TestCase):
+    def test_padded_frame(self):
+        regex = publish_file._frame_regex("/show/sh010/plate.%04d.exr")
+        self.assertEqual(regex.match("/show/sh010/plate.1001.exr").group(1), "1001")
+        self.assertEqual(regex.match("/show/sh010/plate.10001.exr").group(1), "10001")
+        self.assertIsNone(regex.match("/show/sh010/plate.101.exr"))
+
+    def test_unpadded_frame(self):
+        regex = publish_file._frame_regex("/show/sh010/plate.%d.exr")
+        self.assertEqual(regex.match("/show/sh010/plate.7.exr").group(1), "7")
+
+    def test_special_characters_are_literal(self):
+        regex = publish_file._frame_regex("/show/sh+010 (a)/plate.%04d.exr")
+        self.assertTrue(regex.match("/show/sh+010 (a)/plate.0001.exr"))
+        self.assertIsNone(regex.match("/show/shh010 (a)/plate.0001.exr"))
+
+    def test_every_token_captured(self):
+        regex = publish_file._frame_regex("/show/%04d/plate.%04d.exr")
+        match = regex.match("/show/1001/plate.1002.exr")
+        self.assertEqual(match.groups(), ("1001", "1002"))
+
+    def test_resolve_parses_only_the_first_frame(self):
+        work = _Template("/work")
+        publish = _Template("/publish")
+        files = ["/work/plate.%04d.exr" % frame for frame in range(1001, 1011)]
+        resolved = _plugin()._resolve_publish_files(_Item(), work, publish, files)
+        self.assertEqual(
+            resolved,
+            [(f, f.replace("/work/", "/publish/")) for f in files],
+        )
+        # validate() and get_fields() of the first frame only
+        self.assertEqual(work.parsed, [files[0]] * 2)
+
+    def test_resolve_falls_back_to_the_template(self):
+        work = _Template("/work")
+        publish = _Template("/publish")
+        files = ["/work/plate.1001.exr", "/work/other.1002.exr"]
+        resolved = _plugin()._resolve_publish_files(_Item(), work, publish, files)
+        self.assertIsNone(resolved)
+        self.assertEqual(work.parsed, [files[0], files[0], files[1]])
+
+
+class PromotionTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="publish_file_test_")
+        self.work = os.path.join(self.root, "work.exr")
+        with open(self.work, "wb") as fp:
+            fp.write(b"work file data" * 1000)
+        self.publish = os.path.join(self.root, "publish", "publish.exr")
+        os.makedirs(os.path.dirname(self.publish))
+        self.plugin = _plugin()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def test_copy(self):
+        self.assertEqual(
+            self.plugin._promote_file(self.work, self.publish, "copy"), "copy"
+        )
+        self.assertEqual(self._read(self.publish), self._read(self.work))
+        self.assertNotEqual(os.stat(self.publish).st_ino, os.stat(self.work).st_ino)
+
+    def test_hardlink(self):
+        self.assertEqual(
+            self.plugin._promote_file(self.work, self.publish, "hardlink"), "hardlink"
+        )
+        self.assertEqual(os.stat(self.publish).st_ino, os.stat(self.work).st_ino)
+
+    def test_copy_over_a_hardlink_keeps_the_work_file(self):
+        data = self._read(self.work)
+        self.plugin._promote_file(self.work, self.publish, "hardlink")
+        self.plugin._promote_file(self.work, self.publish, "copy")
+        self.assertEqual(self._read(self.work), data)
+        self.assertNotEqual(os.stat(self.publish).st_ino, os.stat(self.work).st_ino)
+
+    def test_reflink_falls_back_to_a_copy(self):
+        # clones need btrfs, XFS or ZFS: elsewhere the ioctl fails
+        method = self.plugin._promote_file(self.work, self.publish, "reflink")
+        self.assertIn(method, ("reflink", "copy"))
+        self.assertEqual(self._read(self.publish), self._read(self.work))
+
+    def test_copy_file_range(self):
+        method = self.plugin._promote_file(self.work, self.publish, "copy_file_range")
+        if hasattr(os, "copy_file_range"):
+            self.assertEqual(method, "copy_file_range")
+        else:
+            self.assertEqual(method, "copy")
+        self.assertEqual(self._read(self.publish), self._read(self.work))
+
+    def test_auto_never_hardlinks(self):
+        method = self.plugin._promote_file(self.work, self.publish, "auto")
+        self.assertIn(method, ("reflink", "copy_file_range", "copy"))
+        self.assertNotEqual(os.stat(self.publish).st_ino, os.stat(self.work).st_ino)
+        self.assertEqual(self._read(self.publish), self._read(self.work))
+
+    def test_failed_method_leaves_no_partial_file(self):
+        def fail(src, dst):
+            open(dst, "wb").close()
+            os.remove(dst)
+            raise OSError("no clones here")
+
+        clone_file = publish_file._clone_file
+        publish_file._clone_file = fail
+        try:
+            method = self.plugin._promote_file(self.work, self.publish, "reflink")
+        finally:
+            publish_file._clone_file = clone_file
+        self.assertEqual(method, "copy")
+        self.assertEqual(self._read(self.publish), self._read(self.work))
+
+
+class BatchRegistrationTest(unittest.TestCase):
+    def setUp(self):
+        self.plugin = _plugin()
+        self.settings = {"Batch Publish Registration": _Setting(True)}
+        self.root = _Item()
+
+    def test_defer_only_the_last_active_task(self):
+        other = {"Batch Publish Registration": _Setting(True)}
+        item = _Item(self.root, tasks=[_Task(self.settings), _Task(other)])
+        self.assertFalse(self.plugin._defer_registration(self.settings, item))
+
+        item.tasks[1].active = False
+        self.assertTrue(self.plugin._defer_registration(self.settings, item))
+
+    def test_no_defer_with_children_or_disabled(self):
+        item = _Item(self.root, tasks=[_Task(self.settings)], children=[object()])
+        self.assertFalse(self.plugin._defer_registration(self.settings, item))
+
+        settings = {"Batch Publish Registration": _Setting(False)}
+        item = _Item(self.root, tasks=[_Task(settings)])
+        self.assertFalse(self.plugin._defer_registration(settings, item))
+
+    def test_sg_batch_chunks(self):
+        requests = [{"request_type": "create", "entity_type": "Note"}] * 250
+        results = self.plugin._sg_batch(requests)
+        self.assertEqual(len(results), 250)
+        self.assertEqual(
+            [len(batch) for batch in self.plugin.parent.shotgun.batches],
+            [100, 100, 50],
+        )
+
+    def test_register_pending_publishes(self):
+        dependency_path = "/show/sh010/plate.%04d.exr"
+        sgtk.util.find_publish = lambda tk, paths: {
+            dependency_path: {"type": "PublishedFile", "id": 7}
+        }
+        batch = self.plugin._get_publish_batch(self.root)
+        items = []
+        for index in range(3):
+            item = _Item(self.root)
+            entity_data = {"type": "PublishedFile", "code": "file%d" % index}
+            item.properties.sg_publish_data = dict(entity_data)
+            publish_data = {
+                "path": "/show/file%d.nk" % index,
+                "dependency_ids": [5],
+                "dependency_paths": [dependency_path],
+                "thumbnail_path": None,
+            }
+            batch["pending"][id(item)] = (item, entity_data, publish_data)
+            items.append(item)
+
+        self.plugin._register_pending_publishes(batch)
+
+        self.assertEqual(batch["pending"], {})
+        creates, dependencies = self.plugin.parent.shotgun.batches
+        self.assertEqual(len(creates), 3)
+        self.assertTrue(all("type" not in r["data"] for r in creates))
+        for item in items:
+            self.assertIn("id", item.properties.sg_publish_data)
+        # the parent publish and the dependency found by path, per item
+        self.assertEqual(len(dependencies), 6)
+        self.assertEqual(
+            sorted(
+                r["data"]["dependent_published_file"]["id"] for r in dependencies
+            ),
+            [5, 5, 5, 7, 7, 7],
+        )
+
+    def test_new_tree_reports_unregistered_publishes(self):
+        batch = self.plugin._get_publish_batch(self.root)
+        item = _Item(self.root)
+        batch["pending"][id(item)] = (item, {}, {"path": "/show/lost.exr"})
+
+        with self.assertLogs("publish_file_test", level="WARNING") as logs:
+            new_batch = self.plugin._get_publish_batch(_Item())
+        self.assertIsNot(new_batch, batch)
+        self.assertIn("never registered", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,42 @@
 # :coding: utf-8
 
-from ftputil import ftputil
+from .ftputil import ftputil, bandwidth, checksum
 from datetime import datetime
 import os
 
+
+def compressed_extensions(file_types, compressed_types):
+    """
+    Return the set of file extensions (lowercase, no dot) to upload
+    compressed.
+
+    :param file_types: The plugin's "File Types" setting value, a list of
+        [publish type, extension, ...] entries.
+    :param compressed_types: Publish type names to compress. Types not in
+        file_types may use the "<Ext> File" fallback name, e.g. "Xml File".
+    """
+    compressed_types = set(compressed_types or [])
+    extensions = set()
+    for type_def in file_types or []:
+        if type_def[0] in compressed_types:
+            extensions.update(ext.lower() for ext in type_def[1:])
+    for publish_type in compressed_types:
+        if publish_type.endswith(" File"):
+            extensions.add(publish_type[: -len(" File")].lower())
+    return extensions
+
+
+def is_compressed_upload(path, extensions):
+    """
+    Return True if the file at path should be uploaded compressed.
+    """
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return extension in extensions
+
 class ftpHost(ftputil.FTPHost):
     def __init__(self,ftp_host, ftp_user, ftp_pass):
         ftputil.FTPHost.__init__(self,ftp_host,ftp_user,ftp_pass)
+        self.set_bandwidth_scheduler(bandwidth.scheduler_for(ftp_host))
 
         try:
             # 연결 상태 확인
@@ -53,8 +83,34 @@ class ftpHost(ftputil.FTPHost):
     # def _set_root(self):
     #     self._root = self.getcwd()
 
-    def _upload(self, src, dest):
-        self.upload(src,dest,mode='b')
-        print(src, "===> TO WESTWORLD PUBLISH ===>", dest)
+    def _upload(self, src, dest, priority=bandwidth.PRIORITY_NORMAL, compress=False):
+        """
+        Upload src to dest and verify the remote copy against checksums
+        computed while streaming. A mismatch is retried once before
+        ftp_error.VerificationError is raised.
+
+        :returns: Dictionary with the path, size, md5, crc32 and the
+            verification method used.
+        """
+        for attempt in range(2):
+            # interactive uploads (scripts) overtake bulk ones (frames)
+            # compressed uploads land as dest.gz plus a dest.gz.json sidecar
+            stream_checksum = checksum.StreamChecksum()
+            self.upload(
+                src,dest,mode='b',priority=priority,compress=compress,
+                checksum=stream_checksum
+            )
+            result = self.verify_upload(dest, stream_checksum, compress)
+            result["path"] = dest
+            if result["ok"]:
+                break
+            print("checksum mismatch, retrying :", dest, result)
+        else:
+            raise ftputil.ftp_error.VerificationError(
+                "Uploaded file does not match its checksum: %s (%s)"
+                % (dest, result["method"])
+            )
+        print(src, "===> TO WESTWORLD PUBLISH ===>", dest, result["md5"])
+        return result
 
 
@@ -0,0 +1,255 @@
+# :coding: utf-8
+
+"""
+Opt-in timing of the publish pipeline.
+
+Publish plugins open nested sections (phase method, then sub-steps such
+as the copy, the ftp upload or register_publish) and add counters (ShotGrid
+calls, bytes copied). Sections with the same name under the same parent are
+aggregated, so a tree of 40 items reports one "validate" node with 40 calls.
+The post_phase hook writes the report after post_finalize.
+
+Enable it with the WW_PUBLISH_PROFILE environment variable or the
+"Profile Publish" plugin setting. Plugins time their phase methods with the
+profiled decorator and get the profiler with get_hook_profiler().
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+ENV_VAR = "WW_PUBLISH_PROFILE"
+
+# Shotgun API methods that are counted and timed.
+SG_METHODS = (
+    "find",
+    "find_one",
+    "create",
+    "update",
+    "delete",
+    "batch",
+    "upload",
+    "upload_thumbnail",
+    "summarize",
+)
+
+
+def _new_node():
+    return {"calls": 0, "seconds": 0.0, "children": OrderedDict()}
+
+
+class PublishProfiler(object):
+    """
+    Hierarchical timer and counter store shared by the publish hooks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._root = _new_node()
+            # the section stacks of every thread start at the old root
+            self._local = threading.local()
+            self._counters = OrderedDict()
+            self._started = None
+        self._restore_shotgun()
+
+    def enable(self, sg=None):
+        """
+        Start profiling, counting the calls made through the given Shotgun
+        API instance.
+        """
+        if not self.enabled:
+            self.enabled = True
+            self._started = time.time()
+        if sg is not None:
+            self.instrument_shotgun(sg)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = [self._root]
+        return stack
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """
+        Time the enclosed block as a child of the current section of this
+        thread. Does nothing unless the profiler is enabled.
+        """
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        with self._lock:
+            node = stack[-1]["children"].setdefault(name, _new_node())
+        stack.append(node)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            stack.pop()
+            with self._lock:
+                node["calls"] += 1
+                node["seconds"] += elapsed
+
+    def count(self, name, value=1):
+        """Add value to the named counter (thread safe)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def instrument_shotgun(self, sg):
+        """
+        Count and time the API calls of a Shotgun instance until reset().
+        The methods are wrapped on the instance only.
+        """
+        if getattr(sg, "_publish_profiler", None) is self:
+            return
+        for method_name in SG_METHODS:
+            method = getattr(sg, method_name, None)
+            if method is None:
+                continue
+            setattr(sg, method_name, self._wrap_sg(method_name, method))
+        sg._publish_profiler = self
+        self._instrumented = getattr(self, "_instrumented", []) + [sg]
+
+    def _wrap_sg(self, method_name, method):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            profiler.count("sg.%s" % method_name)
+            if method_name == "batch" and args:
+                profiler.count("sg.batch_requests", len(args[0]))
+            with profiler.section("sg.%s" % method_name):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    def _restore_shotgun(self):
+        for sg in getattr(self, "_instrumented", []):
+            for method_name in SG_METHODS:
+                sg.__dict__.pop(method_name, None)
+            sg.__dict__.pop("_publish_profiler", None)
+        self._instrumented = []
+
+    def report(self):
+        """
+        Return the report as a dictionary: the section tree with calls and
+        seconds per node, and the counters.
+        """
+
+        def convert(name, node):
+            return {
+                "name": name,
+                "calls": node["calls"],
+                "seconds": round(node["seconds"], 6),
+                "children": [convert(n, c) for (n, c) in node["children"].items()],
+            }
+
+        with self._lock:
+            sections = [convert(n, c) for (n, c) in self._root["children"].items()]
+            return {
+                "started": self._started,
+                "wall_seconds": round(time.time() - (self._started or time.time()), 3),
+                "sections": sections,
+                "counters": dict(self._counters),
+            }
+
+    def summary(self, report=None):
+        """Return the report as indented human readable text."""
+        report = report or self.report()
+        lines = ["Publish profile (%.2fs wall clock)" % report["wall_seconds"]]
+
+        def add(section, depth):
+            lines.append(
+                "%s%-40s %5d call(s) %9.3fs"
+                % ("  " * depth, section["name"], section["calls"], section["seconds"])
+            )
+            for child in section["children"]:
+                add(child, depth + 1)
+
+        for section in report["sections"]:
+            add(section, 1)
+        if report["counters"]:
+            lines.append("Counters:")
+            for name, value in sorted(report["counters"].items()):
+                lines.append("  %-40s %d" % (name, value))
+        return "\n".join(lines)
+
+    def write_report(self, dirname=None):
+        """
+        Write the JSON report to dirname (~/.log by default), then reset the
+        profiler. Returns (path, summary).
+        """
+        report = self.report()
+        summary = self.summary(report)
+        dirname = dirname or os.path.join(os.path.expanduser("~"), ".log")
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        path = os.path.join(
+            dirname,
+            datetime.today().strftime("%Y%m%d_%H%M%S") + "_publish_profile.json",
+        )
+        with open(path, "w") as fp:
+            json.dump(report, fp, indent=2)
+        self.enabled = False
+        self.reset()
+        return path, summary
+
+
+_profiler = PublishProfiler()
+
+
+def get_profiler():
+    """Return the process wide profiler."""
+    return _profiler
+
+
+def env_enabled():
+    """True if profiling is switched on through the environment."""
+    return os.getenv(ENV_VAR, "").lower() not in ("", "0", "false", "no")
+
+
+def get_hook_profiler(hook, settings=None):
+    """
+    Return the process wide profiler for a publish hook, enabling it if the
+    WW_PUBLISH_PROFILE environment variable or the "Profile Publish" setting
+    asks for it. Its sections do nothing while it is disabled.
+
+    :param hook: The calling hook. The ShotGrid calls of its parent are
+        counted once the profiler is enabled.
+    :param settings: The calling plugin's configured settings, if known.
+    """
+    profiler = get_profiler()
+    if not profiler.enabled:
+        setting = settings.get("Profile Publish") if settings else None
+        if env_enabled() or (setting and setting.value):
+            profiler.enable(hook.parent.shotgun)
+    return profiler
+
+
+def profiled(method):
+    """
+    Time a plugin method (settings, item) in a section named after the class
+    defining it, e.g. "BasicFilePublishPlugin.publish", so a subclass and
+    the base class methods it calls get their own nested sections.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, settings, item, *args, **kwargs):
+        profiler = get_hook_profiler(self, settings)
+        with profiler.section(method.__qualname__):
+            return method(self, settings, item, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,143 @@
+# :coding: utf-8
+
+"""
+Maps local publish paths to their location on the ftp server.
+
+The storage roots of roots.yml (on every platform) are compiled into one
+anchored regular expression, so only a leading root is rewritten: with the
+primary root /show, "/show/showcase/devil/a.exr" becomes
+"/shotgrid_pub/show/showcase/devil/a.exr". Folder renames such as
+dev -> pub only apply to whole path components. Directories are mapped
+once and cached, so a sequence costs one mapping per folder.
+"""
+
+import posixpath
+import re
+import threading
+
+# remote folder the storage roots are published under
+REMOTE_PREFIX = "/shotgrid_pub"
+
+# roots.yml keys (and sgtk platform names) of the linux root path, which
+# the remote layout follows
+_LINUX_KEYS = ("linux_path", "linux2", "linux")
+
+
+def _normalize(path):
+    return path.replace("\\", "/").rstrip("/")
+
+
+class RemotePathMapper(object):
+    """
+    Translates local paths below the storage roots to remote paths.
+    """
+
+    def __init__(self, roots, remote_prefix=REMOTE_PREFIX, segment_map=None):
+        """
+        :param roots: Storage roots as in roots.yml, {root_name: {"linux_path":
+            ..., "windows_path": ..., ...}}. sgtk's platform keyed root
+            dictionaries work as well.
+        :param str remote_prefix: Remote folder the roots are placed under.
+        :param segment_map: Optional {folder: folder} renames applied to
+            whole path components below the root, e.g. {"dev": "pub"}.
+        """
+        self.segment_map = dict(segment_map or {})
+        self._remote_roots = {}
+        alternatives = {}
+        for (root_name, platform_paths) in roots.items():
+            linux_path = None
+            for key in _LINUX_KEYS:
+                if platform_paths.get(key):
+                    linux_path = platform_paths[key]
+                    break
+            if not linux_path:
+                continue
+            self._remote_roots[root_name] = posixpath.join(
+                remote_prefix, _normalize(linux_path).lstrip("/")
+            )
+            for local_path in platform_paths.values():
+                if isinstance(local_path, str) and local_path:
+                    alternatives[_normalize(local_path).lower()] = root_name
+
+        if not alternatives:
+            raise ValueError("No storage roots to map remote paths from.")
+
+        # longest first so nested roots win over their parents
+        self._root_names = {}
+        groups = []
+        for (index, local_path) in enumerate(
+            sorted(alternatives, key=len, reverse=True)
+        ):
+            group = "r%d" % index
+            self._root_names[group] = alternatives[local_path]
+            groups.append("(?P<%s>%s)" % (group, re.escape(local_path)))
+        self._regex = re.compile(
+            r"^(?:%s)(?=/|$)" % "|".join(groups), re.IGNORECASE
+        )
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def map_dir(self, path):
+        """
+        Return the remote path of a local directory (cached).
+
+        :raises ValueError: If path is not below one of the storage roots.
+        """
+        with self._lock:
+            remote = self._cache.get(path)
+        if remote is not None:
+            return remote
+
+        local = _normalize(path)
+        match = self._regex.match(local)
+        if not match:
+            raise ValueError(
+                "%s is not below a storage root, can't map it to the ftp server."
+                % (path,)
+            )
+        remote = self._remote_roots[self._root_names[match.lastgroup]]
+        rest = local[match.end() :]
+        if rest:
+            segments = rest.strip("/").split("/")
+            if self.segment_map:
+                segments = [self.segment_map.get(s, s) for s in segments]
+            remote = posixpath.join(remote, *segments)
+
+        with self._lock:
+            self._cache[path] = remote
+        return remote
+
+    def map(self, path):
+        """
+        Return the remote path of a local file. The folder part is mapped
+        with map_dir(), the file name is kept.
+        """
+        local = _normalize(path)
+        (dirname, basename) = local.rsplit("/", 1) if "/" in local else ("", local)
+        return posixpath.join(self.map_dir(dirname), basename)
+
+    def map_many(self, paths):
+        """
+        Return [(local, remote)] for the given paths, e.g. all frames of a
+        sequence.
+        """
+        return [(path, self.map(path)) for path in paths]
+
+
+_mappers = {}
+_mappers_lock = threading.Lock()
+
+
+def get_mapper(roots, remote_prefix=REMOTE_PREFIX, segment_map=None):
+    """
+    Return the process wide RemotePathMapper for these roots and options.
+    """
+    key = (
+        repr(sorted(roots.items(), key=lambda root: root[0])),
+        remote_prefix,
+        repr(sorted((segment_map or {}).items())),
+    )
+    with _mappers_lock:
+        if key not in _mappers:
+            _mappers[key] = RemotePathMapper(roots, remote_prefix, segment_map)
+        return _mappers[key]
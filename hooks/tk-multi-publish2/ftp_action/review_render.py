@@ -0,0 +1,213 @@
+# :coding: utf-8
+
+"""
+Renders review movies in background `nuke -t` processes, at most
+max_renders at a time.
+
+The publish pass submits one ReviewJob per item. Its script runs in a
+subprocess: review_submit_nuke.py renders the movie and creates its Version
+with the review submission app, review_render_nuke.py only renders frames.
+A job's optional upload callable then runs on a separate thread pool, so
+the next movies render while the previous ones upload. The finalize pass
+waits for each job's future and reports its progress.
+"""
+
+import collections
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# the nuke -t script rendering one movie from a json job file
+RENDER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "review_render_nuke.py"
+)
+
+# the nuke -t script rendering and submitting one movie with the review
+# submission app
+SUBMIT_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "review_submit_nuke.py"
+)
+
+# prefix of the line the scripts print after each frame
+PROGRESS_PREFIX = "WW_REVIEW_FRAME "
+
+# prefix of the json result line of the submit script
+RESULT_PREFIX = "WW_REVIEW_RESULT "
+
+# number of output lines of a render process kept for its error message
+_OUTPUT_TAIL = 40
+
+
+class ReviewJob(object):
+    """
+    The render and upload of one review movie.
+    """
+
+    def __init__(self, name, render_args, upload=None, script=RENDER_SCRIPT):
+        """
+        :param str name: Display name used in progress and error messages.
+        :param dict render_args: Job of the script, with at least
+            "first_frame" and "last_frame". See review_render_nuke.py and
+            review_submit_nuke.py.
+        :param upload: Callable run on the upload pool with the job once the
+            movie is rendered. Its return value is the result of the job.
+            Without it, the result is the script's RESULT_PREFIX value or
+            else the "output_path" of render_args.
+        :param str script: The nuke -t script run with the job.
+        """
+        self.name = name
+        self.render_args = render_args
+        self.upload = upload
+        self.script = script
+        self.frame_count = max(
+            1, render_args["last_frame"] - render_args["first_frame"] + 1
+        )
+        self.frames_done = 0
+        self.stage = "queued"
+        self.future = Future()
+        self.cancelled = False
+        self._process = None
+
+    def cancel(self):
+        """
+        Give up on the job: a queued job won't render, a running render
+        process is killed and the movie isn't uploaded. An upload already
+        running completes.
+        """
+        self.cancelled = True
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def progress(self):
+        """Return (percent, message) describing where the job is."""
+        if self.stage == "rendering":
+            percent = min(100, 100 * self.frames_done // self.frame_count)
+            return (
+                percent,
+                "Rendering review movie for %s: %d/%d frames"
+                % (self.name, self.frames_done, self.frame_count),
+            )
+        if self.stage == "uploading":
+            return (100, "Uploading review movie for %s" % (self.name,))
+        return (0, "Review movie for %s is %s" % (self.name, self.stage))
+
+
+class ReviewQueue(object):
+    """
+    Review movie render processes and upload threads, shared by the items
+    of a publish.
+    """
+
+    def __init__(self, nuke_exe, max_renders=2, max_uploads=2):
+        """
+        :param str nuke_exe: Path of the nuke executable running the renders.
+        :param int max_renders: Number of concurrent render processes.
+        :param int max_uploads: Number of concurrent uploads.
+        """
+        self.nuke_exe = nuke_exe
+        self._renders = ThreadPoolExecutor(
+            max_workers=max(1, max_renders), thread_name_prefix="review-render"
+        )
+        self._uploads = ThreadPoolExecutor(
+            max_workers=max(1, max_uploads), thread_name_prefix="review-upload"
+        )
+
+    def submit(self, job):
+        """
+        Queue the job's render, followed by its upload if it has one.
+        Returns job.future.
+        """
+        render = self._renders.submit(self._render, job)
+        render.add_done_callback(lambda future: self._rendered(job, future))
+        return job.future
+
+    def _rendered(self, job, render):
+        error = render.exception()
+        if error is None and job.cancelled:
+            error = RuntimeError("The review movie for %s was cancelled." % job.name)
+        if error is not None:
+            job.stage = "failed"
+            job.future.set_exception(error)
+            return
+        if job.upload is None:
+            job.stage = "done"
+            job.future.set_result(render.result())
+            return
+        job.stage = "uploading"
+        upload = self._uploads.submit(job.upload, job)
+        upload.add_done_callback(lambda future: self._uploaded(job, future))
+
+    def _uploaded(self, job, upload):
+        error = upload.exception()
+        if error is not None:
+            job.stage = "failed"
+            job.future.set_exception(error)
+        else:
+            job.stage = "done"
+            job.future.set_result(upload.result())
+
+    def _render(self, job):
+        if job.cancelled:
+            raise RuntimeError("The review movie for %s was cancelled." % job.name)
+        job.stage = "rendering"
+        output_dir = os.path.dirname(job.render_args.get("output_path") or "")
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        # only readable by the user, the job may hold their credentials
+        (handle, job_path) = tempfile.mkstemp(prefix="review_", suffix=".json")
+        try:
+            with os.fdopen(handle, "w") as fp:
+                json.dump(job.render_args, fp)
+
+            process = subprocess.Popen(
+                [self.nuke_exe, "-t", job.script, job_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+            job._process = process
+            if job.cancelled:
+                # cancelled while the process was starting
+                process.kill()
+            tail = collections.deque(maxlen=_OUTPUT_TAIL)
+            result = job.render_args.get("output_path")
+            for line in process.stdout:
+                if line.startswith(PROGRESS_PREFIX):
+                    job.frames_done += 1
+                elif line.startswith(RESULT_PREFIX):
+                    result = json.loads(line[len(RESULT_PREFIX) :])
+                else:
+                    tail.append(line.rstrip())
+            process.stdout.close()
+            returncode = process.wait()
+        finally:
+            os.remove(job_path)
+
+        if job.cancelled:
+            raise RuntimeError("The review movie for %s was cancelled." % job.name)
+        if returncode != 0:
+            raise RuntimeError(
+                "Rendering the review movie for %s failed (exit code %d):\n%s"
+                % (job.name, returncode, "\n".join(tail))
+            )
+        return result
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(nuke_exe, max_renders=2, max_uploads=2):
+    """
+    Return the process wide ReviewQueue for these limits.
+    """
+    key = (nuke_exe, max_renders, max_uploads)
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = ReviewQueue(nuke_exe, max_renders, max_uploads)
+        return _queues[key]
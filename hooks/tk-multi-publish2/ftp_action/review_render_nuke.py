@@ -0,0 +1,82 @@
+# :coding: utf-8
+
+"""
+Renders frames to a movie or a list of images, without the slate and
+burn-ins of the review submission app (see review_submit_nuke.py). Run by
+thumbnail_cache.ThumbnailService and review_render.ReviewQueue as
+
+    nuke -t review_render_nuke.py <job.json>
+
+A job holds the frames "path" (with a %0Nd frame token), the
+"output_path", "first_frame", "last_frame" and optionally "color_space",
+"width", "height" (without it the width is kept and the aspect ratio
+preserved) and "file_type" ("mov" by default). The job file holds one job
+or a list of jobs. A progress line is printed after each frame.
+"""
+
+import json
+import sys
+import traceback
+
+import nuke
+
+# see review_render.PROGRESS_PREFIX
+PROGRESS_PREFIX = "WW_REVIEW_FRAME "
+
+
+def _frame_rendered():
+    sys.stdout.write("%s%d\n" % (PROGRESS_PREFIX, nuke.frame()))
+    sys.stdout.flush()
+
+
+def render(job):
+    first_frame = int(job["first_frame"])
+    last_frame = int(job["last_frame"])
+
+    read = nuke.nodes.Read(file=job["path"])
+    read["first"].setValue(first_frame)
+    read["last"].setValue(last_frame)
+    read["on_error"].setValue("black")
+    if job.get("color_space"):
+        read["colorspace"].setValue(job["color_space"])
+    nodes = [read]
+
+    if job.get("width"):
+        node = nuke.nodes.Reformat(inputs=[read])
+        nodes.append(node)
+        node["type"].setValue("to box")
+        node["box_width"].setValue(int(job["width"]))
+        if job.get("height"):
+            node["box_height"].setValue(int(job["height"]))
+            node["box_fixed"].setValue(True)
+
+    write = nuke.nodes.Write(inputs=[nodes[-1]])
+    nodes.append(write)
+    write["file"].setValue(job["output_path"].replace("\\", "/"))
+    write["file_type"].setValue(job.get("file_type") or "mov")
+
+    try:
+        nuke.execute(write, first_frame, last_frame)
+    finally:
+        # leave an empty graph for the next job
+        for node in reversed(nodes):
+            nuke.delete(node)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as fp:
+        jobs = json.load(fp)
+    nuke.addAfterFrameRender(_frame_rendered, nodeClass="Write")
+    if isinstance(jobs, dict):
+        render(jobs)
+    else:
+        # render every image, and fail at the end if one of them failed
+        failed = 0
+        for job in jobs:
+            try:
+                render(job)
+            except Exception:
+                traceback.print_exc()
+                failed += 1
+        if failed:
+            sys.exit(1)
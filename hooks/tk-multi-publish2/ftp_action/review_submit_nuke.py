@@ -0,0 +1,76 @@
+# :coding: utf-8
+
+"""
+Renders and submits one review movie with the tk-multi-reviewsubmission
+app, the way the Submit for Review plugin does it in the session. Run by
+review_render.ReviewQueue as
+
+    nuke -t review_submit_nuke.py <job.json>
+
+The job holds "sgtk_path" (the folder the sgtk package is imported from),
+the publish "context" serialized with the user's credentials, the "engine"
+and "app" instance names, the "template" name and the remaining arguments
+of the app's render_and_submit_version(). The engine is started for the
+context, so the movie gets the app's slate, burn-ins, codec and colorspace
+settings. A progress line is printed after each frame and the submitted
+Version is printed last, see review_render.RESULT_PREFIX.
+"""
+
+import json
+import sys
+import traceback
+
+import nuke
+
+# see review_render.PROGRESS_PREFIX and review_render.RESULT_PREFIX
+PROGRESS_PREFIX = "WW_REVIEW_FRAME "
+RESULT_PREFIX = "WW_REVIEW_RESULT "
+
+
+def _frame_rendered():
+    sys.stdout.write("%s%d\n" % (PROGRESS_PREFIX, nuke.frame()))
+    sys.stdout.flush()
+
+
+def submit(job):
+    sys.path.insert(0, job["sgtk_path"])
+    import sgtk
+
+    context = sgtk.Context.deserialize(job["context"])
+    engine = sgtk.platform.start_engine(job["engine"], context.sgtk, context)
+    try:
+        app = engine.apps.get(job["app"])
+        if app is None:
+            raise RuntimeError("%s is not configured for this context." % job["app"])
+
+        version = app.render_and_submit_version(
+            context.sgtk.templates[job["template"]],
+            job["fields"],
+            job["first_frame"],
+            job["last_frame"],
+            job["sg_publishes"],
+            job["sg_task"],
+            job["comment"],
+            job["thumbnail_path"],
+            lambda *args, **kwargs: None,
+            job["color_space"],
+        )
+    finally:
+        engine.destroy()
+
+    if not version:
+        raise RuntimeError("The review submission app returned no version.")
+    return {"type": version["type"], "id": version["id"], "code": version.get("code")}
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as fp:
+        job = json.load(fp)
+    nuke.addAfterFrameRender(_frame_rendered, nodeClass="Write")
+    try:
+        version = submit(job)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    sys.stdout.write("%s%s\n" % (RESULT_PREFIX, json.dumps(version)))
+    sys.stdout.flush()
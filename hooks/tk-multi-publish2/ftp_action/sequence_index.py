@@ -0,0 +1,206 @@
+# :coding: utf-8
+
+"""
+Finds the frame sequences of rendered outputs, listing each folder once.
+
+A SequenceIndex scans a directory with os.scandir the first time one of
+its paths is queried and groups the file names into sequences by prefix,
+frame padding and extension. Every later query for that folder (other
+Write nodes rendering next to it, the flame clip frame spec) is answered
+from memory. Create one index per collection or publish pass so new
+renders are picked up the next time.
+
+The last FOLDER_CACHE_SIZE parsed folders are also kept for the whole
+process, keyed by the folder's modification time: a new index only stats a
+folder that hasn't changed since it was last listed.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from .ftputil import lrucache
+
+# name.0001.exr, name_001.exr: the frame is the last run of digits before
+# the extension
+_FRAME_FILE = re.compile(r"^(?P<prefix>.*?)(?P<frame>\d+)(?P<ext>\.[^.]+)$")
+
+# the same with a frame token: name.####.exr, name.%04d.exr, name.@@@@.exr
+_FRAME_PATH = re.compile(
+    r"^(?P<prefix>.*?)(?P<frame>\d+|#+|@+|%0?(?P<digits>\d*)d)(?P<ext>\.[^.]+)$"
+)
+
+# Folders modified less than this many seconds ago are not cached: a file
+# created within the same mtime tick wouldn't change the folder's mtime.
+_RACY_SECONDS = 2.0
+
+# number of parsed folders kept for the process, least recently used first
+# out
+FOLDER_CACHE_SIZE = 256
+
+# {dirname: (mtime_ns, names, sequences)} shared by all indexes
+_folders = lrucache.LRUCache(FOLDER_CACHE_SIZE)
+_folders_lock = threading.Lock()
+
+
+class Sequence(namedtuple("Sequence", "dirname prefix padding extension frames")):
+    """
+    The files of one frame sequence: dirname/<prefix><frame><extension>,
+    the frame zero padded to padding digits. frames is sorted.
+    """
+
+    __slots__ = ()
+
+    @property
+    def first_frame(self):
+        return self.frames[0]
+
+    @property
+    def last_frame(self):
+        return self.frames[-1]
+
+    def path(self, frame):
+        """Return the path of the given frame."""
+        return os.path.join(
+            self.dirname,
+            "%s%0*d%s" % (self.prefix, self.padding, frame, self.extension),
+        )
+
+    @property
+    def paths(self):
+        """Paths of all frames on disk, in frame order."""
+        return [self.path(frame) for frame in self.frames]
+
+    def frame_ranges(self):
+        """
+        Return the frames on disk as [(first, last)] runs of consecutive
+        frames, e.g. [(1001, 1010), (1012, 1050)].
+        """
+        ranges = []
+        for frame in self.frames:
+            if ranges and frame == ranges[-1][1] + 1:
+                ranges[-1][1] = frame
+            else:
+                ranges.append([frame, frame])
+        return [tuple(r) for r in ranges]
+
+    def missing_frames(self):
+        """Return the frames missing between first_frame and last_frame."""
+        ranges = self.frame_ranges()
+        missing = []
+        for ((_, last), (first, _)) in zip(ranges, ranges[1:]):
+            missing.extend(range(last + 1, first))
+        return missing
+
+    def frame_spec_path(self):
+        """
+        Return the path with the frame range in brackets, e.g.
+        "/project/foo.[0001-0010].jpg".
+        """
+        return os.path.join(
+            self.dirname,
+            "%s[%0*d-%0*d]%s"
+            % (
+                self.prefix,
+                self.padding,
+                self.first_frame,
+                self.padding,
+                self.last_frame,
+                self.extension,
+            ),
+        )
+
+
+class SequenceIndex(object):
+    """
+    Directory listings and frame sequences by folder, built on demand.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._sequences = {}
+
+    def _scan(self, dirname):
+        dirname = os.path.normpath(dirname or os.curdir)
+        if dirname in self._names:
+            return dirname
+
+        try:
+            mtime_ns = os.stat(dirname).st_mtime_ns
+        except OSError:
+            (self._names[dirname], self._sequences[dirname]) = (set(), {})
+            return dirname
+
+        with _folders_lock:
+            cached = _folders[dirname] if dirname in _folders else None
+        if cached and cached[0] == mtime_ns:
+            (self._names[dirname], self._sequences[dirname]) = cached[1:]
+            return dirname
+
+        names = set()
+        frames = {}
+        try:
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    names.add(entry.name)
+                    match = _FRAME_FILE.match(entry.name)
+                    if match and entry.is_file():
+                        key = (
+                            match.group("prefix"),
+                            len(match.group("frame")),
+                            match.group("ext"),
+                        )
+                        frames.setdefault(key, []).append(int(match.group("frame")))
+        except OSError:
+            pass
+
+        sequences = dict(
+            (key, Sequence(dirname, key[0], key[1], key[2], sorted(values)))
+            for (key, values) in frames.items()
+        )
+        (self._names[dirname], self._sequences[dirname]) = (names, sequences)
+        if time.time() - mtime_ns / 1e9 > _RACY_SECONDS:
+            with _folders_lock:
+                _folders[dirname] = (mtime_ns, names, sequences)
+        return dirname
+
+    def exists(self, path):
+        """True if path is an entry of its (indexed) folder."""
+        (dirname, name) = os.path.split(os.path.normpath(path))
+        return name in self._names[self._scan(dirname)]
+
+    def find(self, path):
+        """
+        Return the Sequence a path belongs to, or None. path is either one
+        frame ("plate.1001.exr") or a pattern ("plate.####.exr",
+        "plate.%04d.exr"; "%d" matches any padding).
+        """
+        (dirname, name) = os.path.split(os.path.normpath(path))
+        match = _FRAME_PATH.match(name)
+        if not match:
+            return None
+        sequences = self._sequences[self._scan(dirname)]
+
+        token = match.group("frame")
+        if token.isdigit() or token[0] in "#@":
+            padding = len(token)
+        elif match.group("digits"):
+            padding = int(match.group("digits"))
+        else:
+            # unpadded %d: whichever padding is on disk
+            for key in sorted(sequences):
+                if key[0] == match.group("prefix") and key[2] == match.group("ext"):
+                    return sequences[key]
+            return None
+        return sequences.get((match.group("prefix"), padding, match.group("ext")))
+
+
+def find_sequence(path):
+    """
+    Return the Sequence of path (a frame or a frame pattern), or None.
+    Uses the process wide folder cache, so repeated calls for an unchanged
+    folder cost one stat.
+    """
+    return SequenceIndex().find(path)
@@ -0,0 +1,98 @@
+# :coding: utf-8
+
+"""
+Tags publishes made from the vietnam location so they can be picked up
+for the transfer back to the main site.
+
+The publish plugins queue their publishes with queue_tags(); the post
+phase hook tags everything queued by the publish with flush_tags(), in as
+few shotgun.batch() calls as possible.
+"""
+
+import os
+import threading
+
+VIETNAM_TAG = "ww_vietnam"
+
+IMAGE_FORMATS = (".dpx", ".jpg", ".jpeg", ".png", ".mov", ".mp4", ".exr", ".tiff", ".tif")
+
+# maximum number of requests sent in one shotgun.batch() call
+BATCH_SIZE = 100
+
+# Tag entities by name, shared by every publish in this process.
+_tags = {}
+_tags_lock = threading.Lock()
+
+# [(publishes, extensions, tag name)] waiting for flush_tags()
+_queued = []
+_queued_lock = threading.Lock()
+
+
+def get_tag(sg, name=VIETNAM_TAG):
+    """
+    Return the Tag entity with the given name, creating it if needed. The
+    lookup runs once per process.
+
+    :param sg: Shotgun API instance.
+    :param str name: Tag name.
+    """
+    with _tags_lock:
+        if name not in _tags:
+            tag = sg.find_one("Tag", [["name", "is", name]])
+            if not tag:
+                tag = sg.create("Tag", {"name": name})
+            _tags[name] = {"type": "Tag", "id": tag["id"]}
+        return _tags[name]
+
+
+def tag_requests(sg, publishes, extensions, name=VIETNAM_TAG):
+    """
+    Return shotgun.batch() update requests tagging the publishes whose path
+    has one of the given extensions.
+
+    :param sg: Shotgun API instance.
+    :param publishes: List of PublishedFile dictionaries with id and path
+        (e.g. the items' sg_publish_data).
+    :param extensions: Lowercase file extensions including the dot.
+    :param str name: Tag name.
+    """
+    requests = []
+    for publish in publishes:
+        path = (publish.get("path") or {}).get("local_path") or ""
+        if os.path.splitext(path)[1].lower() not in extensions:
+            continue
+        requests.append(
+            {
+                "request_type": "update",
+                "entity_type": "PublishedFile",
+                "entity_id": publish["id"],
+                "data": {"tags": [get_tag(sg, name)]},
+            }
+        )
+    return requests
+
+
+def queue_tags(publishes, extensions, name=VIETNAM_TAG):
+    """
+    Queue the publishes with one of the given extensions for the next
+    flush_tags(). Same arguments as tag_requests().
+    """
+    with _queued_lock:
+        _queued.append((list(publishes), extensions, name))
+
+
+def flush_tags(sg):
+    """
+    Tag all the queued publishes with batched requests and empty the queue.
+    Returns the number of publishes tagged.
+    """
+    with _queued_lock:
+        queued = list(_queued)
+        del _queued[:]
+
+    requests = []
+    for (publishes, extensions, name) in queued:
+        requests.extend(tag_requests(sg, publishes, extensions, name))
+    for start in range(0, len(requests), BATCH_SIZE):
+        sg.batch(requests[start : start + BATCH_SIZE])
+    return len(requests)
@@ -0,0 +1,209 @@
+# :coding: utf-8
+
+"""
+Small JPEG thumbnails of rendered frames, made once and kept on disk.
+
+A thumbnail is keyed by the frame's path, modification time and width, so
+a frame that is collected again (the next publish of the same render, a
+collector refresh) reuses its file, and a re-render gets a new one. The
+collector requests the thumbnails of a collection pass in one batch; a
+background thread renders them with a single `nuke -t` process
+(review_render_nuke.py) while the artist looks at the publish tree.
+wait_for() returns the thumbnail once it is there.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from .review_render import RENDER_SCRIPT
+
+# width of the thumbnails, the height follows the frame's aspect ratio
+THUMBNAIL_WIDTH = 512
+
+# thumbnails not used for that many days are removed
+MAX_AGE_DAYS = 30
+
+# seconds the nuke process gets for a batch of thumbnails before it is
+# killed and the batch fails
+RENDER_TIMEOUT = 300
+
+# {source path: Future of the thumbnail path} of the thumbnails being made
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+class ThumbnailService(object):
+    """
+    Thumbnails of rendered frames in cache_dir, made in the background.
+    """
+
+    def __init__(self, cache_dir, nuke_exe, width=THUMBNAIL_WIDTH):
+        """
+        :param str cache_dir: Folder the thumbnails are stored in.
+        :param str nuke_exe: Path of the nuke executable making them.
+        :param int width: Width of the thumbnails.
+        """
+        self.cache_dir = cache_dir
+        self.nuke_exe = nuke_exe
+        self.width = width
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.prune()
+
+    def cache_path(self, path):
+        """
+        Return where the thumbnail of the frame at path is stored, or None
+        if the frame doesn't exist.
+        """
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        key = "%s|%d|%d" % (os.path.normpath(path), mtime_ns, self.width)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".jpg")
+
+    def cached(self, path):
+        """
+        Return the thumbnail of the frame at path if it was made already,
+        None otherwise.
+        """
+        thumbnail = self.cache_path(path)
+        if thumbnail and os.path.exists(thumbnail):
+            # keep used thumbnails from being pruned
+            os.utime(thumbnail, None)
+            return thumbnail
+        return None
+
+    def request(self, paths):
+        """
+        Make the missing thumbnails of the given frames in a background
+        thread. Returns {path: thumbnail path} of the frames that have (or
+        will have) a thumbnail.
+        """
+        thumbnails = {}
+        jobs = []
+        futures = []
+        with _pending_lock:
+            for path in paths:
+                thumbnail = self.cache_path(path)
+                if thumbnail is None:
+                    continue
+                thumbnails[path] = thumbnail
+                if path in _pending or os.path.exists(thumbnail):
+                    continue
+                future = _pending[path] = Future()
+                jobs.append((path, thumbnail))
+                futures.append(future)
+
+        if jobs:
+            thread = threading.Thread(
+                target=self._make, args=(jobs, futures), name="thumbnails"
+            )
+            thread.daemon = True
+            thread.start()
+        return thumbnails
+
+    def _make(self, jobs, futures):
+        try:
+            self._render(jobs)
+        finally:
+            for ((path, thumbnail), future) in zip(jobs, futures):
+                with _pending_lock:
+                    _pending.pop(path, None)
+                future.set_result(thumbnail if os.path.exists(thumbnail) else None)
+
+    def _render(self, jobs):
+        renders = []
+        for (path, thumbnail) in jobs:
+            thumbnail_dir = os.path.dirname(thumbnail)
+            if not os.path.isdir(thumbnail_dir):
+                os.makedirs(thumbnail_dir)
+            # rendered next to the thumbnail and renamed once complete
+            (handle, temp_path) = tempfile.mkstemp(suffix=".jpg", dir=thumbnail_dir)
+            os.close(handle)
+            renders.append(
+                {
+                    "path": path,
+                    "output_path": temp_path,
+                    "first_frame": 1,
+                    "last_frame": 1,
+                    "width": self.width,
+                    "file_type": "jpeg",
+                }
+            )
+
+        (handle, job_path) = tempfile.mkstemp(prefix="thumbnails_", suffix=".json")
+        completed = False
+        try:
+            with os.fdopen(handle, "w") as fp:
+                json.dump(renders, fp)
+            subprocess.run(
+                [self.nuke_exe, "-t", RENDER_SCRIPT, job_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=RENDER_TIMEOUT,
+            )
+            completed = True
+        except subprocess.TimeoutExpired:
+            # run() killed the hung process, its images may be partial
+            pass
+        finally:
+            os.remove(job_path)
+            for ((_, thumbnail), render) in zip(jobs, renders):
+                temp_path = render["output_path"]
+                if completed and os.path.getsize(temp_path):
+                    os.replace(temp_path, thumbnail)
+                else:
+                    os.remove(temp_path)
+
+    def prune(self, max_age_days=MAX_AGE_DAYS):
+        """Remove the thumbnails not used for max_age_days."""
+        oldest = time.time() - max_age_days * 24 * 3600
+        for (dirname, _, filenames) in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirname, filename)
+                try:
+                    if os.path.getmtime(path) < oldest:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+def wait_for(path, thumbnail, timeout=None):
+    """
+    Return the thumbnail of the frame at path once it is made, or None if
+    making it failed or takes longer than timeout seconds.
+
+    :param str path: The frame the thumbnail was requested for.
+    :param str thumbnail: The thumbnail path returned by request().
+    """
+    with _pending_lock:
+        future = _pending.get(path)
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            return None
+    return thumbnail if os.path.exists(thumbnail) else None
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(cache_dir, nuke_exe, width=THUMBNAIL_WIDTH):
+    """
+    Return the process wide ThumbnailService for these options.
+    """
+    key = (cache_dir, nuke_exe, width)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = ThumbnailService(cache_dir, nuke_exe, width)
+        return _services[key]
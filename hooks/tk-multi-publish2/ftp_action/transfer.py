@@ -0,0 +1,185 @@
+# :coding: utf-8
+
+"""
+Shared, lazily connected ftp hosts for the publish hooks.
+
+The validate phase calls prepare() so the login happens in the background
+while the artist reviews the publish; publish() then gets the ready host
+from host(). The connection is reused by every item of the publish and
+closed by the post_phase hook.
+
+The login comes from the WW_FTP_USER/WW_FTP_PASSWORD environment variables
+or the server's entry in ~/.netrc.
+"""
+
+import netrc
+import os
+import threading
+
+from . import host as ftp_host
+from .ftputil import bandwidth
+
+VIETNAM_SERVER = "220.127.148.3"
+DEBUG_SERVER = "10.0.20.38"
+
+
+def server_address():
+    """
+    Return the ftp server for this session: the rnd server for debugging,
+    the vietnam link otherwise.
+    """
+    if os.getenv("TK_DEBUG") or os.getenv("USER") == "w10296":
+        return DEBUG_SERVER
+    return VIETNAM_SERVER
+
+
+def login_data(ftp_ip):
+    """
+    Return the (user, password) login for ftp_ip: the WW_FTP_USER and
+    WW_FTP_PASSWORD environment variables if set, the server's ~/.netrc
+    entry otherwise. The user is empty if neither has one.
+    """
+    user = os.getenv("WW_FTP_USER", "")
+    password = os.getenv("WW_FTP_PASSWORD", "")
+    if not user:
+        try:
+            (user, _, password) = netrc.netrc().authenticators(ftp_ip)
+        except (IOError, TypeError, netrc.NetrcParseError):
+            # no netrc file or no entry in netrc
+            pass
+    return user, password
+
+
+class TransferService(object):
+    """
+    One ftp connection, opened on first use or in the background by
+    prepare(), and re-opened if the server dropped it.
+    """
+
+    def __init__(self, ftp_ip, user=None, password=None, bandwidth_limit=None):
+        """
+        :param str ftp_ip: Address of the ftp server.
+        :param str user: Login user, by default the one of login_data().
+        :param str password: Password of the user.
+        :param dict bandwidth_limit: Upload rate limit of the server, shared
+            by every upload of the process: "rate" is the default in bytes/s
+            (None is unlimited) and "windows" a list of (start hour, end
+            hour, rate) overriding it between local hours. Unlimited if
+            None.
+        """
+        self.ftp_ip = ftp_ip
+        if bandwidth_limit:
+            bandwidth.configure(
+                ftp_ip,
+                rate=bandwidth_limit.get("rate"),
+                windows=[tuple(w) for w in bandwidth_limit.get("windows") or []],
+            )
+        if user is None:
+            user, password = login_data(ftp_ip)
+        self._user = user
+        self._password = password
+        self._lock = threading.Lock()
+        self._thread = None
+        self._host = None
+        self._error = None
+
+    def _connect(self):
+        try:
+            if not self._user:
+                raise ValueError(
+                    "No ftp login for %s, set WW_FTP_USER and WW_FTP_PASSWORD "
+                    "or add the server to ~/.netrc" % self.ftp_ip
+                )
+            connected = ftp_host.ftpHost(self.ftp_ip, self._user, self._password)
+        except Exception as e:
+            connected, error = None, e
+        else:
+            error = None
+        with self._lock:
+            self._host, self._error = connected, error
+
+    def prepare(self):
+        """
+        Start connecting in a background thread unless a connection exists
+        or is being made.
+        """
+        with self._lock:
+            if self._host is not None or self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._connect, name="ftp-connect-%s" % self.ftp_ip
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _alive(self, host):
+        try:
+            host.keep_alive()
+        except Exception:
+            return False
+        return True
+
+    def host(self):
+        """
+        Return the connected ftpHost, waiting for prepare() or connecting
+        now. A failed or dropped connection is retried once.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+        with self._lock:
+            current = self._host
+        if current is not None and self._alive(current):
+            return current
+        if current is not None:
+            try:
+                current.close()
+            except Exception:
+                pass
+
+        self._connect()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            return self._host
+
+    def close(self):
+        """Close the connection (a later host() reconnects)."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            current, self._host = self._host, None
+        if current is not None:
+            current.close()
+            print("---------------Ftp server close---------------")
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(ftp_ip=None, bandwidth_limit=None):
+    """
+    Return the process wide TransferService for ftp_ip (by default the
+    server_address() of this session). bandwidth_limit is applied when
+    the service is created, see TransferService.
+    """
+    ftp_ip = ftp_ip or server_address()
+    with _services_lock:
+        if ftp_ip not in _services:
+            _services[ftp_ip] = TransferService(
+                ftp_ip, bandwidth_limit=bandwidth_limit
+            )
+        return _services[ftp_ip]
+
+
+def close_all():
+    """Close every open connection."""
+    with _services_lock:
+        services = list(_services.values())
+    for service in services:
+        service.close()
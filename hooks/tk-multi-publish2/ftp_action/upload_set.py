@@ -0,0 +1,111 @@
+# :coding: utf-8
+
+"""
+Builds the exact list of files to upload for a publish.
+
+Every directory involved is listed once with os.scandir and the entries
+(and their cached stat results) are reused for all paths in it, so a
+2000 frame sequence costs one directory scan instead of 2000 stats.
+"""
+
+import os
+import re
+
+# %04d, %d, ####, @@@@ and $F4 style frame tokens
+_FRAME_TOKEN = re.compile(r"%0?(\d*)d|#+|@+|\$F(\d*)")
+
+
+def _frame_regex(name):
+    """
+    Return a compiled regex matching the file names of a frame pattern such
+    as "plate.%04d.exr", or None if name has no frame token.
+    """
+    parts = []
+    last = 0
+    for match in _FRAME_TOKEN.finditer(name):
+        parts.append(re.escape(name[last : match.start()]))
+        parts.append(r"-?\d+")
+        last = match.end()
+    if not parts:
+        return None
+    parts.append(re.escape(name[last:]))
+    return re.compile("".join(parts) + "$")
+
+
+class UploadSet(object):
+    """
+    Collects files for upload, scanning each directory once.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._files = []
+        self._seen = set()
+
+    def _listing(self, dirname):
+        """
+        Return {name: os.DirEntry} for dirname (empty if it doesn't exist).
+        """
+        dirname = os.path.normpath(dirname)
+        if dirname not in self._listings:
+            try:
+                with os.scandir(dirname) as entries:
+                    self._listings[dirname] = dict((e.name, e) for e in entries)
+            except OSError:
+                self._listings[dirname] = {}
+        return self._listings[dirname]
+
+    def _add_entry(self, entry):
+        if entry.is_dir():
+            for child in sorted(self._listing(entry.path).values(), key=lambda e: e.name):
+                self._add_entry(child)
+        elif entry.is_file():
+            path = os.path.normpath(entry.path)
+            if path not in self._seen:
+                self._seen.add(path)
+                self._files.append((path, entry.stat().st_size))
+
+    def add(self, path):
+        """
+        Add a file, a directory (recursively) or a frame pattern. Paths that
+        don't exist are ignored.
+
+        :returns: Number of files added.
+        """
+        count = len(self._files)
+        dirname, name = os.path.split(os.path.normpath(path))
+        listing = self._listing(dirname or os.curdir)
+
+        if name in listing:
+            self._add_entry(listing[name])
+        else:
+            regex = _frame_regex(name)
+            if regex:
+                for entry_name in sorted(listing):
+                    if regex.match(entry_name):
+                        self._add_entry(listing[entry_name])
+        return len(self._files) - count
+
+    def add_all(self, paths):
+        for path in paths:
+            self.add(path)
+
+    @property
+    def files(self):
+        """List of (path, size) tuples in the order they were added."""
+        return list(self._files)
+
+    @property
+    def total_size(self):
+        return sum(size for (_, size) in self._files)
+
+
+def collect(paths):
+    """
+    Return [(path, size)] for the files among paths, with directories
+    expanded recursively and frame patterns matched against the directory
+    listing.
+    """
+    upload_set = UploadSet()
+    upload_set.add_all(paths)
+    return upload_set.files
@@ -0,0 +1,124 @@
+# :coding: utf-8
+
+"""
+Finds the versions of a work file that exist on disk.
+
+The folder is listed once; the versions are read from the file names,
+through the work template when there is one, so finding the next free
+version of a file at v150 costs one directory scan instead of 150 stats.
+"""
+
+import os
+import re
+
+# zero config version token, as matched by the path_info hook: the last
+# "v" followed by digits in the file name
+_VERSION_TOKEN = re.compile(r"v(\d+)", re.IGNORECASE)
+
+
+def _version_match(name):
+    matches = list(_VERSION_TOKEN.finditer(name))
+    return matches[-1] if matches else None
+
+
+class VersionScan(object):
+    """
+    The versions on disk of the file at path: the files of its folder that
+    only differ from it by version number.
+    """
+
+    def __init__(self, path, template=None, get_version_number=None):
+        """
+        :param str path: Path of a versioned file.
+        :param template: Work template the path is matched against. Without
+            it or if the path doesn't match, the "v<digits>" token of the
+            file name is the version.
+        :param get_version_number: Optional callable returning the version
+            of a path without a template (e.g. the publisher's
+            util.get_version_number). Defaults to reading the token.
+        """
+        self.path = path
+        self.template = None
+        self.fields = None
+        if template is not None and template.validate(path):
+            self.fields = template.get_fields(path)
+            if "version" in self.fields:
+                self.template = template
+        self._get_version_number = get_version_number
+        self._versions = None
+
+        (self._dirname, name) = os.path.split(path)
+        match = _version_match(name)
+        if match:
+            (prefix, suffix) = (name[: match.start()], name[match.end() :])
+            self._name_parts = (prefix, len(match.group(1)), suffix)
+            self._name_regex = re.compile(
+                "%sv\\d+%s$" % (re.escape(prefix), re.escape(suffix)), re.IGNORECASE
+            )
+        else:
+            self._name_parts = None
+            self._name_regex = None
+
+    def _read_version(self, path):
+        if self.template is not None:
+            if not self.template.validate(path):
+                return None
+            fields = self.template.get_fields(path)
+            for (key, value) in self.fields.items():
+                if key != "version" and fields.get(key) != value:
+                    return None
+            return fields.get("version")
+        if self._get_version_number is not None:
+            return self._get_version_number(path)
+        match = _version_match(os.path.basename(path))
+        return int(match.group(1)) if match else None
+
+    @property
+    def versions(self):
+        """Sorted list of the versions found on disk (listed once)."""
+        if self._versions is None:
+            versions = set()
+            try:
+                with os.scandir(self._dirname or os.curdir) as entries:
+                    names = [e.name for e in entries]
+            except OSError:
+                names = []
+            for name in names:
+                # without a template, only names shaped like the file itself
+                # are parsed
+                if self.template is None and (
+                    self._name_regex is None or not self._name_regex.match(name)
+                ):
+                    continue
+                version = self._read_version(os.path.join(self._dirname, name))
+                if version is not None:
+                    versions.add(version)
+            self._versions = sorted(versions)
+        return self._versions
+
+    def exists(self, version):
+        """True if the given version exists on disk."""
+        return version in self.versions
+
+    def next_free(self, version):
+        """Return the first version from version on that isn't on disk."""
+        existing = set(self.versions)
+        while version in existing:
+            version += 1
+        return version
+
+    def version_path(self, version):
+        """
+        Return the path of the given version, or None if the path has no
+        recognizable version.
+        """
+        if self.template is not None:
+            fields = dict(self.fields)
+            fields["version"] = version
+            return self.template.apply_fields(fields)
+        if self._name_parts is None:
+            return None
+        (prefix, padding, suffix) = self._name_parts
+        return os.path.join(
+            self._dirname, "%sv%0*d%s" % (prefix, padding, version, suffix)
+        )
@@ -0,0 +1,58 @@
+# Copyright (c) 2022 Autodesk, Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+
+"""
+Gives the publish hooks access to the ftp_action package.
+
+The publish plugins, the collector and the post phase hook get the package
+once when they are loaded, e.g.::
+
+    ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+        "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+    )
+    transfer = ftp_action.import_module("transfer")
+"""
+
+import importlib.util
+import os
+import sys
+
+import sgtk
+
+HookBaseClass = sgtk.get_hook_baseclass()
+
+# module name the ftp_action folder is loaded under
+FTP_ACTION_PACKAGE = "ww_ftp_action"
+
+
+class FtpActionHook(HookBaseClass):
+    """
+    Loads the ftp_action package once per process.
+    """
+
+    def get_package(self):
+        """
+        Return the ftp_action package, see its import_module() and
+        loaded_module().
+
+        The package is loaded once per process from its folder under the
+        name FTP_ACTION_PACKAGE, so sys.path is left untouched.
+        """
+        package = sys.modules.get(FTP_ACTION_PACKAGE)
+        if package is None:
+            ftp_action_path = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "ftp_action"
+            )
+            spec = importlib.util.spec_from_file_location(
+                FTP_ACTION_PACKAGE,
+                os.path.join(ftp_action_path, "__init__.py"),
+                submodule_search_locations=[ftp_action_path],
+            )
+            package = importlib.util.module_from_spec(spec)
+            sys.modules[FTP_ACTION_PACKAGE] = package
+            spec.loader.exec_module(package)
+        return package
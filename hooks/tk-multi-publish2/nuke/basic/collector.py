@@ -9,6 +9,7 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+
 import nuke
 import sgtk
 
@@ -20,6 +21,14 @@ _NUKE_OUTPUTS = {
     "WriteGeo": "file",
 }
 
+# node class of the tk-nuke-writenode app's shotgun write nodes
+_SG_WRITENODE_CLASS = "WriteTank"
+
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
 
 class NukeSessionCollector(HookBaseClass):
     """
@@ -61,6 +70,12 @@ class NukeSessionCollector(HookBaseClass):
                 "to publish plugins via the collected item's "
                 "properties. ",
             },
+            "Collect Group Outputs": {
+                "type": "bool",
+                "default": False,
+                "description": "Also collect the Write and WriteGeo nodes "
+                "inside groups and gizmos.",
+            },
         }
 
         # update the base settings with these settings
@@ -97,8 +112,15 @@ class NukeSessionCollector(HookBaseClass):
 
         # run node collection if not in hiero
         if hasattr(engine, "hiero_enabled") and not engine.hiero_enabled:
-            self.collect_sg_writenodes(project_item)
-            self.collect_node_outputs(project_item)
+            # walk the node graph once for both collections
+            nodes_by_class = _scan_session_nodes()
+            group_outputs = settings.get("Collect Group Outputs")
+            self.collect_sg_writenodes(project_item, nodes_by_class)
+            self.collect_node_outputs(
+                project_item,
+                nodes_by_class,
+                include_groups=bool(group_outputs and group_outputs.value),
+            )
 
     def collect_current_nuke_session(self, settings, parent_item):
         """
@@ -240,19 +262,36 @@ class NukeSessionCollector(HookBaseClass):
                 project_item.properties["work_template"] = work_template
                 self.logger.debug("Work template defined for NukeStudio collection.")
 
-    def collect_node_outputs(self, parent_item):
+    def collect_node_outputs(
+        self, parent_item, nodes_by_class=None, include_groups=False
+    ):
         """
         Scan known output node types in the session and see if they reference
         files that have been written to disk.
 
         :param parent_item: The parent item for any nodes collected
+        :param nodes_by_class: The session's nodes by class, as returned by
+            _scan_session_nodes(). Scanned here if not given.
+        :param include_groups: Also collect nodes inside groups and gizmos.
         """
 
+        if nodes_by_class is None:
+            nodes_by_class = _scan_session_nodes()
+
+        # every output folder is listed once, however many nodes render
+        # into it
+        sequence_index = ftp_action.import_module("sequence_index").SequenceIndex()
+
         # iterate over all the known output types
         for node_type in _NUKE_OUTPUTS:
 
-            # get all the instances of the node type
-            all_nodes_of_type = [n for n in nuke.allNodes() if n.Class() == node_type]
+            # get all the instances of the node type. nested nodes have
+            # their group in their full name ("Group1.Write1")
+            all_nodes_of_type = [
+                n
+                for n in nodes_by_class.get(node_type, [])
+                if include_groups or "." not in n.fullName()
+            ]
 
             # iterate over each instance
             for node in all_nodes_of_type:
@@ -263,15 +302,15 @@ class NukeSessionCollector(HookBaseClass):
                 # expressions/format
                 file_path = node[param_name].evaluate()
 
-                if not file_path or not os.path.exists(file_path):
+                if not file_path or not sequence_index.exists(file_path):
                     # no file or file does not exist, nothing to do
                     continue
 
                 self.logger.info("Processing %s node: %s" % (node_type, node.name()))
 
-                # file exists, let the basic collector handle it
-                item = super(NukeSessionCollector, self)._collect_file(
-                    parent_item, file_path, frame_sequence=True
+                # file exists. the frames of a sequence come from the index
+                item = self._collect_indexed_file(
+                    parent_item, file_path, sequence_index.find(file_path)
                 )
 
                 # the item has been created. update the display name to include
@@ -279,11 +318,31 @@ class NukeSessionCollector(HookBaseClass):
                 # collected within the current session.
                 item.name = "%s (%s)" % (item.name, node.name())
 
-    def collect_sg_writenodes(self, parent_item):
+    def _collect_indexed_file(self, parent_item, path, sequence):
+        """
+        Create the item of a rendered file with the basic collector's
+        _collect_file(), taking the frames of its sequence from the
+        SequenceIndex.
+
+        :param parent_item: The parent item for the collected file
+        :param str path: The rendered file (current frame of the node)
+        :param sequence: The ftp_action.sequence_index.Sequence of path, or
+            None if it isn't part of a frame sequence.
+        """
+        item = super(NukeSessionCollector, self)._collect_file(
+            parent_item, path, frame_sequence=sequence is not None
+        )
+        if sequence is not None and "sequence_paths" in item.properties:
+            item.properties["sequence_paths"] = sequence.paths
+        return item
+
+    def collect_sg_writenodes(self, parent_item, nodes_by_class=None):
         """
         Collect any rendered sg write nodes in the session.
 
         :param parent_item:  The parent item for any sg write nodes collected
+        :param nodes_by_class: The session's nodes by class, as returned by
+            _scan_session_nodes(). The app finds the nodes if not given.
         """
 
         publisher = self.parent
@@ -300,7 +359,16 @@ class NukeSessionCollector(HookBaseClass):
         first_frame = int(nuke.root()["first_frame"].value())
         last_frame = int(nuke.root()["last_frame"].value())
 
-        for node in sg_writenode_app.get_write_nodes():
+        if nodes_by_class is None:
+            write_nodes = sg_writenode_app.get_write_nodes()
+        else:
+            write_nodes = nodes_by_class.get(_SG_WRITENODE_CLASS, [])
+
+        # first frames whose small thumbnail is still to be made, by path
+        thumbnails = self._get_thumbnail_service()
+        pending_thumbnails = {}
+
+        for node in write_nodes:
 
             # see if any frames have been rendered for this write node
             rendered_files = sg_writenode_app.get_node_render_files(node)
@@ -350,8 +418,12 @@ class NukeSessionCollector(HookBaseClass):
             item = parent_item.create_item(item_type, type_display, display_name)
             item.set_icon_from_path(item_info["icon_path"])
 
-            # if the supplied path is an image, use the path as # the thumbnail.
-            item.set_thumbnail_from_path(path)
+            # use a small copy of the first frame as the thumbnail. until it
+            # is made, the frame itself is the thumbnail.
+            thumbnail = thumbnails.cached(path) if thumbnails else None
+            item.set_thumbnail_from_path(thumbnail or path)
+            if thumbnails and not thumbnail:
+                pending_thumbnails[path] = item
 
             # disable thumbnail creation since we get it for free
             item.thumbnail_enabled = False
@@ -389,6 +461,29 @@ class NukeSessionCollector(HookBaseClass):
 
             self.logger.info("Collected file: %s" % (publish_path,))
 
+        if pending_thumbnails:
+            # made in the background, see the post_validate hook
+            requested = thumbnails.request(list(pending_thumbnails))
+            for (path, thumbnail) in requested.items():
+                pending_thumbnails[path].properties["pending_thumbnail"] = {
+                    "source": path,
+                    "thumbnail": thumbnail,
+                }
+
+    def _get_thumbnail_service(self):
+        """
+        Return the ftp_action ThumbnailService storing its thumbnails in the
+        publisher's cache folder, or None if the folder can't be created.
+        """
+        thumbnail_cache = ftp_action.import_module("thumbnail_cache")
+        try:
+            return thumbnail_cache.get_service(
+                os.path.join(self.parent.cache_location, "thumbnails"), nuke.EXE_PATH
+            )
+        except OSError as e:
+            self.logger.debug("Thumbnail cache not available: %s" % (e,))
+            return None
+
     def _get_node_colorspace(self, node):
         """
         Get the colorspace for the specified nuke node
@@ -414,3 +509,25 @@ def _session_path():
     """
     root_name = nuke.root().name()
     return None if root_name == "Root" else root_name
+
+
+def _scan_session_nodes():
+    """
+    Walk the node graph of the current script once, including the contents
+    of groups and gizmos, and return the nodes by class.
+
+    :returns: Dictionary {node class: [nodes]} in graph order.
+    """
+    nodes_by_class = {}
+    groups = [nuke.root()]
+    while groups:
+        group = groups.pop(0)
+        for node in group.nodes():
+            node_class = node.Class()
+            nodes_by_class.setdefault(node_class, []).append(node)
+
+            # the internals of a shotgun write node belong to it and are
+            # collected through collect_sg_writenodes()
+            if isinstance(node, nuke.Group) and node_class != _SG_WRITENODE_CLASS:
+                groups.append(node)
+    return nodes_by_class
@@ -8,7 +8,11 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import json
 import os
+import re
+import shutil
+import tempfile
 from datetime import datetime
 
 import nuke
@@ -18,16 +22,45 @@ from sgtk.util.filesystem import ensure_folder_exists
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
+# the publish profiler of the ftp_action package, shared by the publish hooks
+publish_profiler = ftp_action.import_module("publish_profiler")
+
+# nodes whose "file" knob is remapped in the script uploaded from vietnam
+_REMAPPED_NODE_CLASSES = ("Read", "Write")
+
+# node classes reading files the script depends on, and their file knob
+_DEPENDENCY_KNOBS = {
+    "Read": "file",
+    "DeepRead": "file",
+    "ReadGeo": "file",
+    "ReadGeo2": "file",
+    "Camera": "file",
+    "Camera2": "file",
+    "Camera3": "file",
+}
+
+# "####" frame tokens, published as "%04d"
+_HASH_FRAME_TOKEN = re.compile(r"#+")
+
+# {(node name, node class, knob value): dependency path} of the last scan
+_dependency_cache = {}
+
 
 class NukeSessionPublishPlugin(HookBaseClass):
     """
     Plugin for publishing an open nuke session.
 
-    This hook relies on functionality found in the base file publisher hook in
-    the publish2 app and should inherit from it in the configuration. The hook
-    setting for this plugin should look something like this::
+    This hook relies on functionality found in the base file publisher hook of
+    this configuration (parallel copies, promotion modes, batched
+    registration, ftp upload) and should inherit from it. The hook setting for
+    this plugin should look something like this::
 
-        hook: "{self}/publish_file.py:{engine}/tk-multi-publish2/basic/nuke_publish_script.py"
+        hook: "{self}/publish_file.py:{config}/tk-multi-publish2/publish_file.py:{config}/tk-multi-publish2/nuke/basic/nuke_publish_script.py"
 
     """
 
@@ -121,7 +154,7 @@ class NukeSessionPublishPlugin(HookBaseClass):
                 "description": "Template path for published work files. Should"
                 "correspond to a template defined in "
                 "templates.yml.",
-            }
+            },
         }
 
         # update the base settings
@@ -140,6 +173,7 @@ class NukeSessionPublishPlugin(HookBaseClass):
         """
         return ["nuke.session"]
 
+    @publish_profiler.profiled
     def accept(self, settings, item):
         """
         Method called by the publisher to determine if an item is of any
@@ -188,6 +222,7 @@ class NukeSessionPublishPlugin(HookBaseClass):
         return {"accepted": True, "checked": True}
     
 
+    @publish_profiler.profiled
     def validate(self, settings, item):
         """
         Validates the given item to check that it is ok to publish. Returns a
@@ -205,6 +240,10 @@ class NukeSessionPublishPlugin(HookBaseClass):
 
         publisher = self.parent
 
+        # log in to the ftp server while the rest of the tree validates
+        if os.getenv("WW_LOCATION") == 'vietnam':
+            self._get_transfer_service(settings).prepare()
+
         path = _session_path()
         # ---- ensure the session has been saved
 
@@ -255,12 +294,13 @@ class NukeSessionPublishPlugin(HookBaseClass):
         
         if next_version_path and os.path.exists(next_version_path):
 
-            # determine the next available version_number. just keep asking for
-            # the next one until we get one that doesn't exist.
-            while os.path.exists(next_version_path):
-                (next_version_path, version) = self._get_next_version_info(
-                    next_version_path, item
-                )
+            # determine the next available version number from one listing
+            # of the work folder
+            scan = self._get_version_scan(path, item)
+            free_version = scan.next_free(version + 1)
+            free_path = scan.version_path(free_version)
+            if free_path:
+                (next_version_path, version) = (free_path, free_version)
 
             error_msg = "The next version of this file already exists on disk."
             self.logger.error(
@@ -293,6 +333,7 @@ class NukeSessionPublishPlugin(HookBaseClass):
         # run the base class validation
         return super(NukeSessionPublishPlugin, self).validate(settings, item)
 
+    @publish_profiler.profiled
     def publish(self, settings, item):
         """
         Executes the publish logic for the given item and settings.
@@ -310,88 +351,111 @@ class NukeSessionPublishPlugin(HookBaseClass):
         # ensure the session is saved
         #_save_session(path)
 
-        # search the 'WW_LOCATION' env
-        if os.getenv("WW_LOCATION") == 'vietnam':
-
-            org_node = []
-            for node in nuke.allNodes():
-                if node.Class() in ['Read', 'Write' ]:
-                    org_node.append( [node, node['file'].value()] )
-                    if 'show' in node['file'].value():
-                        partition = node['file'].value().partition('show')
-                        new_path = '/show' + partition[2]
-                        new_path = new_path.replace( '\\', '/' )
-                        
-                        node['file'].setValue( new_path )
+        # the published and uploaded script is the session as saved by the
+        # artist
+        if os.getenv("WW_LOCATION") == 'vietnam' and nuke.root().modified():
             nuke.scriptSave()
-        
-            # ftputil module path append
-            import sys
 
-            current_path = os.path.abspath(__file__)
+        # update the item with the saved session path
+        item.properties["path"] = path
 
-            for i in range(3):
-                current_path = os.path.dirname(current_path)
-            
-            ftp_action_path = os.path.join(current_path, 'ftp_action')
+        profiler = publish_profiler.get_hook_profiler(self)
 
-            sys.path.append(ftp_action_path)
+        # add dependencies for the base class to register when publishing
+        with profiler.section("find_script_dependencies"):
+            item.properties[
+                "publish_dependencies"
+            ] = _nuke_find_additional_script_dependencies()
 
-            from ftputil import ftputil
-            import host
+        # let the base class copy, upload, register and tag the publish
+        super(NukeSessionPublishPlugin, self).publish(settings, item)
 
-            _host = None
-            source_path = ''
-            target_path = ''
+    @publish_profiler.profiled
+    def finalize(self, settings, item):
+        """
+        Execute the finalization pass. This pass executes once all the publish
+        tasks have completed, and can for example be used to version up files.
 
-            # hosting ftp server
-            if os.getenv("WW_LOCATION") == 'vietnam':
-                ftp_ip = "220.127.148.3"
-            else:
-                ftp_ip = '10.0.20.38'
+        :param settings: Dictionary of Settings. The keys are strings, matching
+            the keys returned in the settings property. The values are `Setting`
+            instances.
+        :param item: Item to process
+        """
+
+        # do the base class finalization
+        super(NukeSessionPublishPlugin, self).finalize(settings, item)
+
+        # bump the session file to the next version
+#        if os.getenv('WW_LOCATION') != 'vietnam':
+#            self._save_to_next_version(item.properties["path"], item, _save_session)
+    
+    def _upload_to_vietnam(
+        self, settings, item, upload_paths, dependency_paths, publish_fields
+    ):
+        """
+        Upload a copy of the session to the pub folder next to its dev folder
+        on the ftp server, with the paths of its Read and Write nodes mapped
+        to the main site, and record the verified checksum. The published
+        copy and the dependencies are not uploaded.
+
+        :param settings: This plugin instance's configured settings
+        :param item: The item being published
+        :param upload_paths: Unused, the remapped session copy is uploaded.
+        :param dependency_paths: Unused.
+        :param publish_fields: Extra PublishedFile fields to register, updated
+            with the checksum if "FTP Checksum Field" is set.
+        """
+        path = item.properties.path
+
+        # the uploaded copy reads and writes on the main site's /show
+        roots = self.sgtk.pipeline_configuration.get_all_platform_data_roots()
+        remote_path = ftp_action.import_module("remote_path")
+        temp_dir = tempfile.mkdtemp(prefix="ww_upload_")
+        try:
+            with publish_profiler.get_hook_profiler(self).section("remap_script_paths"):
+                (upload_path, remapped) = _save_remapped_script_copy(
+                    remote_path.get_mapper(roots, remote_prefix="/"), temp_dir
+                )
+            self.logger.debug(
+                "Remapped %d Read/Write path(s) in the uploaded script." % remapped
+            )
 
-            _host = host.ftpHost(
-                ftp_ip,
-                "west_rnd",
-                "rnd2022!"
+            bandwidth = ftp_action.import_module("ftputil.bandwidth")
+            ftp_error = ftp_action.import_module("ftputil.ftp_error")
+            host = ftp_action.import_module("host")
+
+            # hosting ftp server, connected in the background since validate()
+            _host = self._get_transfer_service(settings).host()
+
+            # ftp upload action and logging; the script goes to the pub
+            # folder next to its dev folder on the server
+            source_path = upload_path
+            target_path = remote_path.get_mapper(
+                roots, segment_map={"dev": "pub"}
+            ).map(path)
+
+            compress = host.is_compressed_upload(
+                source_path,
+                host.compressed_extensions(
+                    settings["File Types"].value,
+                    settings["FTP Compressed Types"].value,
+                ),
             )
-            # if os.getenv('TK_DEBUG') or os.getenv('USER') == 'w10296':
-            #     print("----------------------DEBUG-------------------------")
-            #     _host = host.ftpHost(
-            #         "10.0.20.38",
-            #         "west_rnd",
-            #         "rnd2022!"
-            #     )
-            # else:
-            #     _host = host.ftpHost(
-            #         "220.127.148.3",
-            #         "west_rnd",
-            #         "rnd2022!"
-            #     )
-
-            # ftp upload action and logging
-            if not sys.platform in ["linux2", "linux"]:
-                source_path = path.replace("\\", "/")
-
-                target_path = source_path.replace("C:", "")
-                target_path = target_path.replace("show", "shotgrid_pub/show")
-                target_path = target_path.replace("dev","pub")
-                
-            else:
-                source_path = path
 
-                target_path = source_path.replace("show", "shotgrid_pub/show")
-                target_path = target_path.replace("dev","pub")
-                
             log_data = list()
             log_data.append("=================================================")
             log_data.append(datetime.today().strftime("%Y/%m/%d %H:%M:%S\n"))
 
             try:
                 print(source_path, "->", target_path)
-                _host._upload(source_path,target_path)
+                publish_profiler.get_hook_profiler(self).count(
+                    "ftp_bytes_uploaded", os.path.getsize(source_path)
+                )
+                upload_result = _host._upload(
+                    source_path, target_path, bandwidth.PRIORITY_INTERACTIVE, compress
+                )
 
-            except ftputil.ftp_error.FTPIOError as e:
+            except ftp_error.FTPIOError as e:
                 print("---------------Create directory--------------")
                 target_dir = os.path.dirname(target_path)
                 print("path : %s", target_dir)
@@ -400,104 +464,169 @@ class NukeSessionPublishPlugin(HookBaseClass):
                 log_data.append('Create directory to save nuke file')
 
                 print(source_path, "->", target_path)
-                _host._upload(source_path, target_path)
-            
+                upload_result = _host._upload(
+                    source_path, target_path, bandwidth.PRIORITY_INTERACTIVE, compress
+                )
+
             log_data.append('{0} to {1} upload file.'.format(source_path, target_path))
+            log_data.append('  md5 {md5} size {size} verified by {method}'.format(**upload_result))
             log_data.append("=================================================")
             _host._ftp_log(log_data)
-            
-            _host.close()
-            print('---------------Ftp server close---------------')
-        # update the item with the saved session path
-        item.properties["path"] = path
-
-        # add dependencies for the base class to register when publishing
-        item.properties[
-            "publish_dependencies"
-        ] = _nuke_find_additional_script_dependencies()
+        finally:
+            # the copy is only needed for the upload, failed or not
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
-        # let the base class register the publish
-
-        super(NukeSessionPublishPlugin, self).publish(settings, item)
-
-#        for node, org_path in  org_node:
-#            node['file'].setValue( org_path )
+        item.properties["ftp_upload_checksums"] = [upload_result]
+        self.logger.info(
+            "Verified FTP upload (md5 %s, %s)."
+            % (upload_result["md5"], upload_result["method"])
+        )
+        checksum_field = settings["FTP Checksum Field"].value
+        if checksum_field:
+            publish_fields[checksum_field] = json.dumps([upload_result])
 
-        nuke.scriptSave()
+    def _get_transfer_service(self, settings):
+        """
+        Return the shared ftp connection to the vietnam server (the rnd
+        server when not running in vietnam), rate limited by the "FTP
+        Bandwidth Limit" setting.
 
-        # update 'tag' field
-        if os.getenv("WW_LOCATION") == 'vietnam': 
-            self.update_last_publishfile_tag(item)
+        :param settings: This plugin instance's configured settings
+        """
+        transfer = ftp_action.import_module("transfer")
+        if os.getenv("WW_LOCATION") == 'vietnam':
+            ftp_ip = transfer.VIETNAM_SERVER
+        else:
+            ftp_ip = transfer.DEBUG_SERVER
+        return transfer.get_service(
+            ftp_ip, bandwidth_limit=settings["FTP Bandwidth Limit"].value
+        )
 
-    def finalize(self, settings, item):
+    def update_last_publishfile_tag(self, item):
         """
-        Execute the finalization pass. This pass executes once all the publish
-        tasks have completed, and can for example be used to version up files.
+        Queue the item's publish for the ww_vietnam tag if it is a nuke
+        script. Called by the base class finalize pass, the post phase hook
+        tags it with the rest of the publish.
 
-        :param settings: Dictionary of Settings. The keys are strings, matching
-            the keys returned in the settings property. The values are `Setting`
-            instances.
-        :param item: Item to process
+        :param item: A published item with sg_publish_data.
         """
+        sg_tag = ftp_action.import_module("sg_tag")
+        sg_tag.queue_tags([item.properties.sg_publish_data], (".nk",))
 
-        # do the base class finalization
-        super(NukeSessionPublishPlugin, self).finalize(settings, item)
 
-        # bump the session file to the next version
-#        if os.getenv('WW_LOCATION') != 'vietnam':
-#            self._save_to_next_version(item.properties["path"], item, _save_session)
-    
-    def update_last_publishfile_tag(self, item):
-        current_context = self.parent.context
-        
-        sg_filters = [
-            ["project", "is", current_context.project],
-            ["entity", "is", current_context.entity],
-            ["task", "is", current_context.task],
-            ["created_by", "is", current_context.user]
-        ]
+def _nuke_find_additional_script_dependencies():
+    """
+    Find all dependencies for the current nuke script: the files read by
+    the nodes in _DEPENDENCY_KNOBS, inside groups too. A sequence is listed
+    once, as its frame pattern (%04d).
+
+    Paths are cached by node, class and knob value, so publishing an
+    unchanged graph again only reads the knob values. Knobs with a TCL
+    expression are evaluated every time.
+    """
 
-        sg_fields = ['id', 'created_at', 'tags', 'path']
+    # figure out all the inputs to the scene and pass them as dependency
+    # candidates
+    cache = {}
+    dependency_paths = []
+    seen = set()
+    for node in nuke.allNodes(recurseGroups=True):
+        node_class = node.Class()
+        knob_name = _DEPENDENCY_KNOBS.get(node_class)
+        if not knob_name:
+            continue
 
-        find_published_files = self.parent.shotgun.find("PublishedFile", sg_filters, sg_fields, 
-                                                        order=[{'field_name':'created_at','direction':'desc'}])
+        # cameras only read their file if asked to
+        read_from_file = node.knob("read_from_file")
+        if read_from_file is not None and not read_from_file.value():
+            continue
 
-        if find_published_files:
-            last_published_file = find_published_files[0]
+        knob = node.knob(knob_name)
+        value = knob.value() if knob is not None else None
+        if not value:
+            continue
 
-            last_publish_file_ext = last_published_file['path']['local_path']
-            last_publish_file_ext = os.path.splitext(last_publish_file_ext)[1]
+        key = (node.fullName(), node_class, value)
+        if key in _dependency_cache:
+            file_path = _dependency_cache[key]
+        else:
+            file_path = _dependency_path(knob, value)
+        if "[" not in value:
+            cache[key] = file_path
 
-            tag_info = self.parent.shotgun.find_one("Tag", [["name", "is", "ww_vietnam"]])
-            if not tag_info:
-                tag_info = self.parent.shotgun.create("Tag", {"name", "ww_vietnam"})
+        if file_path and file_path not in seen:
+            seen.add(file_path)
+            dependency_paths.append(file_path)
 
-            if tag_info and last_publish_file_ext == '.nk':
-                self.parent.shotgun.update("PublishedFile", last_published_file['id'], {"tags": [tag_info]})
-            elif last_publish_file_ext != '.nk':
-                print("last publish file is not '.nk'.")
+    _dependency_cache.clear()
+    _dependency_cache.update(cache)
+    return dependency_paths
 
 
-def _nuke_find_additional_script_dependencies():
+def _dependency_path(knob, value):
     """
-    Find all dependencies for the current nuke script
+    Return the normalized dependency path of a file knob with the given
+    value, frame tokens as %0Nd.
     """
+    if "[" in value:
+        # a TCL expression, use its current value. file knobs set to "" in
+        # Python will evaluate to None. This is different than if you set
+        # file to an empty string in the UI, which will evaluate to ""!
+        value = knob.evaluate()
+        if not value:
+            return None
+    value = _HASH_FRAME_TOKEN.sub(lambda m: "%%0%dd" % len(m.group(0)), value)
+    return sgtk.util.ShotgunPath.normalize(value)
+
+
+def _save_remapped_script_copy(mapper, temp_dir):
+    """
+    Save a copy of the current script with the file paths of its Read and
+    Write nodes mapped to the main site. The session itself is not changed.
 
-    # figure out all the inputs to the scene and pass them as dependency
-    # candidates
-    dependency_paths = []
-    for read_node in nuke.allNodes("Read"):
-        # make sure we have a file path and normalize it
-        # file knobs set to "" in Python will evaluate to None. This is
-        # different than if you set file to an empty string in the UI, which
-        # will evaluate to ""!
-        file_path = read_node.knob("file").evaluate()
-        if not file_path:
-            continue
-        file_path = sgtk.util.ShotgunPath.normalize(file_path)
-        dependency_paths.append(file_path)
+    All knob values are read in one pass and only the paths that change are
+    set, in a single undo group, for the time it takes to save the copy.
 
-    return dependency_paths
+    :param mapper: RemotePathMapper of the ftp_action package mapping the
+        local storage roots to the main site's roots.
+    :param str temp_dir: Folder for the copy.
+    :returns: Tuple of the copy's path and the number of remapped paths.
+    """
+    changes = []
+    for node in nuke.allNodes():
+        if node.Class() not in _REMAPPED_NODE_CLASSES:
+            continue
+        knob = node["file"]
+        value = knob.value()
+        try:
+            new_value = mapper.map(value) if value else value
+        except ValueError:
+            # not below a storage root (or an expression), keep it
+            continue
+        if new_value != value:
+            changes.append((knob, value, new_value))
+
+    root = nuke.root()
+    root_name = root.name()
+    modified = root.modified()
+    copy_path = os.path.join(temp_dir, os.path.basename(root_name))
+
+    undo = nuke.Undo()
+    undo.begin("Remap file paths for upload")
+    try:
+        for (knob, _, new_value) in changes:
+            knob.setValue(new_value)
+        nuke.scriptSave(copy_path)
+    finally:
+        for (knob, value, _) in changes:
+            knob.setValue(value)
+        undo.end()
+        # saving may rename the script, put the session back as it was
+        if root.name() != root_name:
+            root["name"].setValue(root_name)
+        root.setModified(modified)
+
+    return (copy_path, len(changes))
 
 
 def _save_session(path):
@@ -9,11 +9,17 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+
 import nuke
 import sgtk
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
 
 class NukeStartVersionControlPlugin(HookBaseClass):
     """
@@ -178,9 +184,13 @@ class NukeStartVersionControlPlugin(HookBaseClass):
         # get the path to a versioned copy of the file.
         version_path = publisher.util.get_version_path(path, "v001")
         if os.path.exists(version_path):
+            # only list the folder to report the latest existing version
+            scan = ftp_action.import_module("version_scan").VersionScan(
+                version_path, get_version_number=publisher.util.get_version_number
+            )
             error_msg = (
-                "A file already exists with a version number. Please "
-                "choose another name."
+                "A file already exists with a version number (up to v%03d). "
+                "Please choose another name." % ((scan.versions or [1])[-1],)
             )
             self.logger.error(error_msg, extra=_get_save_as_action())
             raise Exception(error_msg)
@@ -9,13 +9,22 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import datetime
+import json
 import os
 import shutil
+import tempfile
 import uuid
-import xml.dom.minidom as minidom
-import glob
+import xml.etree.ElementTree as ElementTree
+import xml.parsers.expat as expat
 import re
 
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
 import sgtk
 
 from sgtk.util import (
@@ -26,6 +35,20 @@ from sgtk.util import (
 
 CLIP_PUBLISH_TYPE = "Flame Batch OpenClip"
 
+# default number of clip file backups kept by _write_flame_clip()
+CLIP_BACKUPS = 10
+
+# journal of pending clip updates and its locks, next to the clip file. The
+# locks are deleted again once released.
+CLIP_JOURNAL_SUFFIX = ".journal"
+CLIP_JOURNAL_LOCK_SUFFIX = ".journal.lock"
+CLIP_COMPACT_LOCK_SUFFIX = ".compact.lock"
+
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
 HookBaseClass = sgtk.get_hook_baseclass()
 
 
@@ -87,8 +110,17 @@ class UpdateFlameClipPlugin(HookBaseClass):
             "Flame Clip Template": {
                 "type": "template",
                 "default": None,
-                "description": "Template path for flame shot clip path.",
-            }
+                "description": "Template path for flame shot clip path. "
+                "The clip's folder must be writable: the updated clip is "
+                "renamed over the old one, and its journal, lock and backup "
+                "files are created next to it.",
+            },
+            "Flame Clip Backups": {
+                "type": "int",
+                "default": CLIP_BACKUPS,
+                "description": "Number of .bak_<timestamp> copies of the clip "
+                "file to keep. 0 disables the backups.",
+            },
         }
 
     @property
@@ -301,7 +333,7 @@ class UpdateFlameClipPlugin(HookBaseClass):
         """
         try:
             # update shot clip xml file with this publish
-            self._update_flame_clip(item)
+            self._update_flame_clip(item, settings["Flame Clip Backups"].value)
         except Exception as exc:
             raise Exception("Unable to update Flame clip xml: %s" % exc)
 
@@ -317,7 +349,7 @@ class UpdateFlameClipPlugin(HookBaseClass):
         """
         pass
 
-    def _update_flame_clip(self, item):
+    def _update_flame_clip(self, item, backups=CLIP_BACKUPS):
         """
         Update the Flame open clip file for this shot with the published render.
         When a shot has been exported from flame, a clip file is available for
@@ -472,7 +504,8 @@ class UpdateFlameClipPlugin(HookBaseClass):
             # If we don't have a writenode, we just parse the first frame of the
             # item's sequence path to get the start and end frames.
             publish_path_flame = _get_flame_frame_spec_from_path(
-                item.properties["sequence_paths"][0]
+                item.properties["sequence_paths"][0],
+                ftp_action.import_module("sequence_index").SequenceIndex(),
             )
 
             if not publish_path_flame:
@@ -549,147 +582,30 @@ class UpdateFlameClipPlugin(HookBaseClass):
                 render_path_fields, "linux2"
             )
 
-        # open up and update our xml file
-        self.logger.debug("Parsing clip file: %s" % flame_clip_path)
-        xml = minidom.parse(flame_clip_path)
-
-        # We need to find the first video track. We do that by getting all of
-        # the tracks:
-        #
-        #   <track type="track" uid="video">
-        #       <trackType>video</trackType>
-        #
-        # We then look at the trackType element within, looking for a type
-        # of "video". When we find one, we break out and move on.
-        first_video_track = None
-
-        for track in xml.getElementsByTagName("track"):
-            for track_type in track.getElementsByTagName("trackType"):
-                if "video" in [c.nodeValue for c in track_type.childNodes]:
-                    first_video_track = track
-                    break
-            if first_video_track is not None:
-                break
+        # record the update in the clip's journal. Appending takes a short
+        # lock only, so concurrent publishes of the same shot don't wait for
+        # each other or lose an update.
+        entry = {
+            "uid": str(uuid.uuid4()),
+            "path": publish_path_flame,
+            "name": _generate_flame_clip_name(item, render_path_fields,),
+            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        _append_flame_clip_journal(flame_clip_path, entry)
 
-        if first_video_track is None:
-            raise Exception(
-                "Could not find the first video track in the published clip file!"
+        # fold the journal into the clip. If another publish is already
+        # doing that, it picks up this entry as well.
+        folded = _compact_flame_clip(flame_clip_path, backups)
+        if folded is None:
+            self.logger.debug(
+                "Clip file %s is being updated by another publish, which will "
+                "add this version." % flame_clip_path
             )
-
-        clip_version = None
-        for span in xml.getElementsByTagName("spans"):
-            span_version = span.attributes.get("version")
-            if span_version is not None:
-                clip_version = span_version.value
-            if clip_version is not None:
-                break
-
-        # For backwards compatibility's sake, we default to version 4.
-        # For a long time, we just hardcoded this to 4, so it makes
-        # sense to default to it here.
-        clip_version = clip_version or "4"
-
-        # now contruct our feed xml chunk we want to insert
-        #
-        # this is the xml structure we want to insert:
-        #
-        # <feed type="feed" vuid="%s" uid="%s">
-        #     <spans type="spans" version="4">
-        #         <span type="span" version="4">
-        #             <path encoding="pattern">%s</path>
-        #         </span>
-        #     </spans>
-        # </feed>
-        unique_id = str(uuid.uuid4())
-
-        # <feed type="feed" vuid="%s" uid="%s">
-        feed_node = xml.createElement("feed")
-        feed_node.setAttribute("type", "feed")
-        feed_node.setAttribute("uid", unique_id)
-        feed_node.setAttribute("vuid", unique_id)
-
-        # <spans type="spans" version="4">
-        spans_node = xml.createElement("spans")
-        spans_node.setAttribute("type", "spans")
-        spans_node.setAttribute("version", clip_version)
-        feed_node.appendChild(spans_node)
-
-        # <span type="span" version="4">
-        span_node = xml.createElement("span")
-        span_node.setAttribute("type", "span")
-        span_node.setAttribute("version", clip_version)
-        spans_node.appendChild(span_node)
-
-        # <path encoding="pattern">%s</path>
-        path_node = xml.createElement("path")
-        path_node.setAttribute("encoding", "pattern")
-        path_node.appendChild(xml.createTextNode(publish_path_flame))
-        span_node.appendChild(path_node)
-
-        # add new feed to first list of feeds inside of our track
-        first_video_track.getElementsByTagName("feeds")[0].appendChild(feed_node)
-
-        # now add same to the versions structure
-        #
-        # <version type="version" uid="%s">
-        #     <name>%s</name>
-        #     <creationDate>%s</creationDate>
-        #     <userData type="dict">
-        #     </userData>
-        # </version>
-        date_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        formatted_name = _generate_flame_clip_name(item, render_path_fields,)
-
-        # <version type="version" uid="%s">
-        version_node = xml.createElement("version")
-        version_node.setAttribute("type", "version")
-        version_node.setAttribute("uid", unique_id)
-
-        # <name>v003 Comp</name>
-        child_node = xml.createElement("name")
-        child_node.appendChild(xml.createTextNode(formatted_name))
-        version_node.appendChild(child_node)
-
-        # <creationDate>1229-12-12 12:12:12</creationDate>
-        child_node = xml.createElement("creationDate")
-        child_node.appendChild(xml.createTextNode(date_str))
-        version_node.appendChild(child_node)
-
-        # <userData type="dict">
-        child_node = xml.createElement("userData")
-        child_node.setAttribute("type", "dict")
-        version_node.appendChild(child_node)
-
-        # add new feed to first list of versions
-        xml.getElementsByTagName("versions")[0].appendChild(version_node)
-        xml_string = xml.toxml(encoding="UTF-8")
-
-        # make a backup of the clip file before we update it
-        #
-        # note - we are not using the template system here for simplicity
-        # (user requiring customization can always modify this hook code
-        # themselves). There is a potential edge case where the backup file
-        # cannot be written at this point because you are on a different machine
-        # or running with different permissions.
-        backup_path = "%s.bak_%s" % (
-            flame_clip_path,
-            datetime.datetime.now().strftime("%Y%m%d_%H%M%S"),
-        )
-
-        try:
-            shutil.copy(flame_clip_path, backup_path)
-        except Exception as e:
-            raise Exception(
-                "Failed to create a backup copy of the Flame clip file '%s': "
-                "%s" % (flame_clip_path, e)
+        else:
+            self.logger.debug(
+                "Added %d version(s) to clip file: %s" % (folded, flame_clip_path)
             )
 
-        fh = open(flame_clip_path, "wt")
-        try:
-            fh.write(xml_string)
-        finally:
-            fh.close()
-
         # Finally, we create a new version of the clip's PublishedFile
         # if we have one associated with this item.
         self._version_up_clip_publish(item)
@@ -731,7 +647,7 @@ class UpdateFlameClipPlugin(HookBaseClass):
             )
 
 
-def _get_flame_frame_spec_from_path(path):
+def _get_flame_frame_spec_from_path(path, sequence_index):
     """
     Parses the file name in an attempt to determine the first and last
     frame number of a sequence. This assumes some sort of common convention
@@ -743,62 +659,477 @@ def _get_flame_frame_spec_from_path(path):
     a frame-spec path, such as "/project/foo.[0001-0010].jpg".
 
     :param str path: The file path to parse.
+    :param sequence_index: SequenceIndex of the ftp_action package used to
+        look up the frames on disk.
 
     :returns: If the path can be parsed, a string path replacing the frame
         number with a frame range spec is returned.
     :rtype: str or None
     """
-    # This pattern will match the following at the end of a string and
-    # retain the frame number or frame token as group(1) in the resulting
-    # match object:
+    # the index lists the folder once and groups its files by prefix,
+    # padding and extension, so only the frames of this sequence count
+    sequence = sequence_index.find(path)
+    if not sequence:
+        return None
+
+    # We end up with something like the following:
     #
-    # 0001
-    # ####
-    # %04d
+    #    /project/foo.[0001-0010].jpg
     #
-    # The number of digits or hashes does not matter; we match as many as
-    # exist.
-    frame_pattern = re.compile(r"^(.+?)([0-9#]+|[%]0\dd)$")
-    root, ext = os.path.splitext(path)
-
-    # NOTE:
-    #   match.group(0) is the entire path.
-    #   match.group(1) is everything up to the frame number.
-    #   match.group(2) is the frame number.
-    match = re.search(frame_pattern, root)
-
-    # If we did not match, we don't know how to parse the file name, or there
-    # is no frame number to extract.
-    if not match:
-        return None
+    return sequence.frame_spec_path()
 
-    # We need to get all files that match the pattern from disk so that we
-    # can determine what the min and max frame number is. We replace the
-    # frame number or token with a * wildcard.
-    glob_path = "%s%s" % (re.sub(match.group(2), "*", root), ext,)
-    files = glob.glob(glob_path)
 
-    # Our pattern from above matches against the file root, so we need
-    # to chop off the extension at the end.
-    file_roots = [os.path.splitext(f)[0] for f in files]
+class _ClipScanDone(Exception):
+    """Raised by the expat handlers once every insertion point is known."""
 
-    # We know that the search will result in a match at this point, otherwise
-    # the glob wouldn't have found the file. We can search and pull group 2
-    # to get the integer frame number from the file root name.
-    frame_padding = len(re.search(frame_pattern, file_roots[0]).group(2))
-    frames = [int(re.search(frame_pattern, f).group(2)) for f in file_roots]
-    min_frame = min(frames)
-    max_frame = max(frames)
 
-    # Turn that into something like "[%04d-%04d]"
-    format_str = "[%%0%sd-%%0%sd]" % (frame_padding, frame_padding)
+def _scan_flame_clip(data):
+    """
+    Find where a publish has to be added to an open clip file.
 
-    # We end up with something like the following:
-    #
-    #    /project/foo.[0001-0010].jpg
+    The clip is fed to expat and only the elements needed are tracked;
+    parsing stops as soon as all insertion points are known.
+
+    :param bytes data: Content of the clip file.
+    :returns: Dictionary with the first video track's first ``feeds``
+        element ("feeds") and the first ``versions`` element ("versions") as
+        (start, end) byte offsets of their start and end tags, or None if
+        missing, and the version attribute of the first ``spans`` element
+        ("spans_version").
+    """
+    parser = expat.ParserCreate()
+    found = {"feeds": None, "versions": None, "spans_version": None}
+    open_elements = []
+    tracks = []
+    text = []
+
+    def _done():
+        return None not in found.values()
+
+    def start_element(name, attributes):
+        open_elements.append(name)
+        if name == "track":
+            tracks.append({"video": False, "feeds_depth": None, "feeds": None})
+        elif name == "trackType":
+            del text[:]
+        elif name == "feeds" and tracks and tracks[-1]["feeds_depth"] is None:
+            tracks[-1]["feeds_depth"] = len(open_elements)
+            tracks[-1]["feeds_start"] = parser.CurrentByteIndex
+        elif name == "versions" and found["versions"] is None:
+            found["versions_depth"] = len(open_elements)
+            found["versions_start"] = parser.CurrentByteIndex
+        elif name == "spans" and found["spans_version"] is None:
+            found["spans_version"] = attributes.get("version")
+
+    def end_element(name):
+        index = parser.CurrentByteIndex
+        depth = len(open_elements)
+        open_elements.pop()
+        if name == "trackType" and tracks and "".join(text).strip() == "video":
+            tracks[-1]["video"] = True
+        elif name == "feeds" and tracks and tracks[-1]["feeds_depth"] == depth:
+            tracks[-1]["feeds"] = (tracks[-1]["feeds_start"], index)
+        elif name == "versions" and found.get("versions_depth") == depth:
+            found["versions"] = (found.pop("versions_start"), index)
+            del found["versions_depth"]
+        elif name == "track":
+            track = tracks.pop()
+            if track["video"] and found["feeds"] is None:
+                found["feeds"] = track["feeds"]
+                if found["feeds"] is None:
+                    # a video track without feeds: nothing to add to
+                    found["feeds"] = False
+        if _done():
+            raise _ClipScanDone()
+
+    def character_data(data):
+        if open_elements and open_elements[-1] == "trackType":
+            text.append(data)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    try:
+        parser.Parse(data, True)
+    except _ClipScanDone:
+        pass
+
+    found.pop("versions_depth", None)
+    if found["feeds"] is False:
+        found["feeds"] = None
+    return found
+
+
+def _insert_into_flame_clip(data, insertions):
+    """
+    Insert elements into the raw clip data.
+
+    :param bytes data: Content of the clip file.
+    :param insertions: List of (offsets, tag, elements) with offsets the
+        (start, end) offsets of the parent element ``tag`` as returned by
+        _scan_flame_clip(), and elements a list of ElementTree Elements
+        appended to it in order.
+    :returns: The updated content.
+    """
+    for ((start, end), tag, elements) in sorted(
+        insertions, key=lambda i: i[0], reverse=True
+    ):
+        chunk = b""
+        for element in elements:
+            element_data = ElementTree.tostring(element, encoding="UTF-8")
+            # tostring() adds a declaration for an explicit encoding
+            if element_data.startswith(b"<?xml"):
+                element_data = element_data.split(b"?>", 1)[1].lstrip()
+            chunk += element_data
+
+        # find the end of the parent's start tag, skipping quoted values
+        quote = None
+        tag_end = start
+        while True:
+            char = data[tag_end : tag_end + 1]
+            tag_end += 1
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in (b'"', b"'"):
+                quote = char
+            elif char in (b">", b""):
+                break
+
+        if data[tag_end - 2 : tag_end] == b"/>":
+            # empty element, <feeds/>: open it up
+            data = b"%s>%s</%s>%s" % (
+                data[: tag_end - 2],
+                chunk,
+                tag.encode("utf-8"),
+                data[tag_end:],
+            )
+        else:
+            # end is the offset of the parent's end tag
+            data = data[:end] + chunk + data[end:]
+    return data
+
+
+def _write_flame_clip(flame_clip_path, data, backups=CLIP_BACKUPS):
+    """
+    Replace the clip file with data.
+
+    The data is written to a temporary file next to the clip and renamed
+    over it, so Flame never reads a partial file. The previous clip is kept
+    as <clip>.bak_<timestamp> (a hard link where possible, not a copy) and
+    only the newest backups are kept.
+
+    :param str flame_clip_path: Path to the clip file.
+    :param bytes data: New content.
+    :param int backups: Number of backups to keep, 0 for none.
+    """
+    # note - we are not using the template system here for simplicity
+    # (user requiring customization can always modify this hook code
+    # themselves). There is a potential edge case where the backup file
+    # cannot be written at this point because you are on a different machine
+    # or running with different permissions.
+    if backups > 0:
+        backup_path = "%s.bak_%s" % (
+            flame_clip_path,
+            datetime.datetime.now().strftime("%Y%m%d_%H%M%S"),
+        )
+        try:
+            if not os.path.exists(backup_path):
+                try:
+                    os.link(flame_clip_path, backup_path)
+                except OSError:
+                    shutil.copy2(flame_clip_path, backup_path)
+        except Exception as e:
+            raise Exception(
+                "Failed to create a backup copy of the Flame clip file '%s': "
+                "%s" % (flame_clip_path, e)
+            )
+
+    (clip_dir, clip_name) = os.path.split(flame_clip_path)
+    (fd, temp_path) = tempfile.mkstemp(prefix=clip_name + ".", dir=clip_dir)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        shutil.copymode(flame_clip_path, temp_path)
+        os.replace(temp_path, flame_clip_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    _prune_flame_clip_backups(flame_clip_path, backups)
+
+
+def _prune_flame_clip_backups(flame_clip_path, backups):
+    """
+    Delete all but the newest backups of a clip file.
+
+    :param str flame_clip_path: Path to the clip file.
+    :param int backups: Number of backups to keep.
+    """
+    (clip_dir, clip_name) = os.path.split(flame_clip_path)
+    prefix = clip_name + ".bak_"
+    with os.scandir(clip_dir or os.curdir) as entries:
+        backup_names = sorted(e.name for e in entries if e.name.startswith(prefix))
+    for name in backup_names[: max(len(backup_names) - backups, 0)]:
+        try:
+            os.remove(os.path.join(clip_dir, name))
+        except OSError:
+            pass
+
+
+def _lock_file(path, blocking=True):
+    """
+    Open path (created if needed) and lock it exclusively.
+
+    _unlock_file() deletes the lock file again. A process that was waiting
+    for the lock of a file deleted meanwhile locks the new file instead.
+
+    :param str path: Lock file path.
+    :param bool blocking: Wait for the lock. Otherwise None is returned if
+        another process holds it.
+    :returns: File descriptor to pass to _unlock_file(), or None.
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+            else:
+                mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+                msvcrt.locking(fd, mode, 1)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return None
+
+        try:
+            current = os.stat(path)
+        except OSError:
+            current = None
+        if current is not None and os.path.samestat(current, os.fstat(fd)):
+            return fd
+
+        # the previous holder deleted the file while we waited
+        _release_lock(fd)
+
+
+def _unlock_file(fd, path):
+    """
+    Release and close a lock taken with _lock_file() and delete its file.
+
+    :param int fd: File descriptor returned by _lock_file().
+    :param str path: Lock file path.
+    """
+    if fcntl is not None:
+        # deleted while still locked, see _lock_file()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        _release_lock(fd)
+    else:
+        # windows can't delete an open file; it stays if another process
+        # has opened it meanwhile
+        _release_lock(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _release_lock(fd):
+    """Release and close a lock taken by _lock_file()."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+def _append_flame_clip_journal(flame_clip_path, entry):
+    """
+    Append an update to the journal of a clip file, <clip>.journal.
+
+    :param str flame_clip_path: Path to the clip file.
+    :param dict entry: The version to add: uid, path (the frame spec path),
+        name and date.
+    """
+    line = (json.dumps(entry, sort_keys=True) + "\n").encode("utf-8")
+    lock_path = flame_clip_path + CLIP_JOURNAL_LOCK_SUFFIX
+    lock = _lock_file(lock_path)
+    try:
+        with open(flame_clip_path + CLIP_JOURNAL_SUFFIX, "ab") as fh:
+            fh.write(line)
+            fh.flush()
+            os.fsync(fh.fileno())
+    finally:
+        _unlock_file(lock, lock_path)
+
+
+def _take_flame_clip_journal(flame_clip_path):
+    """
+    Move the journal's entries to <clip>.journal.pending, where they stay
+    until they are in the clip, and return all pending entries.
+    """
+    journal_path = flame_clip_path + CLIP_JOURNAL_SUFFIX
+    pending_path = journal_path + ".pending"
+
+    lock_path = flame_clip_path + CLIP_JOURNAL_LOCK_SUFFIX
+    lock = _lock_file(lock_path)
+    try:
+        if os.path.exists(journal_path):
+            if os.path.exists(pending_path):
+                # left over by a compaction that failed
+                with open(journal_path, "rb") as src:
+                    with open(pending_path, "ab") as dst:
+                        shutil.copyfileobj(src, dst)
+                os.remove(journal_path)
+            else:
+                os.replace(journal_path, pending_path)
+    finally:
+        _unlock_file(lock, lock_path)
+
+    entries = []
+    if os.path.exists(pending_path):
+        with open(pending_path, "rb") as fh:
+            for line in fh:
+                if line.strip():
+                    entries.append(json.loads(line.decode("utf-8")))
+    return (pending_path, entries)
+
+
+def _compact_flame_clip(flame_clip_path, backups=CLIP_BACKUPS):
+    """
+    Add the versions recorded in the journal of a clip file to the clip,
+    with one scan and one rewrite of the clip for all of them.
+
+    Only one process compacts a clip at a time. Entries appended while it
+    runs are folded in before it returns.
+
+    :param str flame_clip_path: Path to the clip file.
+    :param int backups: Number of clip backups to keep.
+    :returns: Number of versions added, or None if another process is
+        compacting the clip.
+    """
+    journal_path = flame_clip_path + CLIP_JOURNAL_SUFFIX
+    lock_path = flame_clip_path + CLIP_COMPACT_LOCK_SUFFIX
+    folded = 0
+    while True:
+        lock = _lock_file(lock_path, blocking=False)
+        if lock is None:
+            return folded or None
+        try:
+            folded += _fold_flame_clip_journal(flame_clip_path, backups)
+        finally:
+            _unlock_file(lock, lock_path)
+
+        # an entry appended while the lock was held may have given up on
+        # compacting, look again now that the lock is released
+        if not os.path.exists(journal_path):
+            return folded
+
+
+def _fold_flame_clip_journal(flame_clip_path, backups):
+    """
+    Write the pending journal entries into the clip. Must be called with
+    the compaction lock held.
+
+    :returns: Number of versions added.
+    """
+    (pending_path, entries) = _take_flame_clip_journal(flame_clip_path)
+    if not entries:
+        if os.path.exists(pending_path):
+            os.remove(pending_path)
+        return 0
+
+    # find where the new nodes go. The clip is scanned with expat up to
+    # the insertion points, no document tree is built and the rest of the
+    # file is kept byte for byte.
+    with open(flame_clip_path, "rb") as fh:
+        clip_data = fh.read()
+    insertion_points = _scan_flame_clip(clip_data)
+
+    # We need the feeds of the first video track:
     #
-    frame_spec = format_str % (min_frame, max_frame)
-    return "%s%s%s" % (match.group(1), frame_spec, ext)
+    #   <track type="track" uid="video">
+    #       <trackType>video</trackType>
+    #       <feeds>...</feeds>
+    if insertion_points["feeds"] is None:
+        raise Exception(
+            "Could not find the first video track in the published clip file!"
+        )
+    if insertion_points["versions"] is None:
+        raise Exception("Could not find the versions of the published clip file!")
+
+    # For backwards compatibility's sake, we default to version 4.
+    # For a long time, we just hardcoded this to 4, so it makes
+    # sense to default to it here.
+    clip_version = insertion_points["spans_version"] or "4"
+
+    feed_nodes = []
+    version_nodes = []
+    for entry in entries:
+        # already in the clip if a previous compaction failed after
+        # writing it
+        if ('uid="%s"' % entry["uid"]).encode("utf-8") in clip_data:
+            continue
+
+        # <feed type="feed" vuid="%s" uid="%s">
+        #     <spans type="spans" version="4">
+        #         <span type="span" version="4">
+        #             <path encoding="pattern">%s</path>
+        #         </span>
+        #     </spans>
+        # </feed>
+        feed_node = ElementTree.Element(
+            "feed", {"type": "feed", "uid": entry["uid"], "vuid": entry["uid"]}
+        )
+        spans_node = ElementTree.SubElement(
+            feed_node, "spans", {"type": "spans", "version": clip_version}
+        )
+        span_node = ElementTree.SubElement(
+            spans_node, "span", {"type": "span", "version": clip_version}
+        )
+        path_node = ElementTree.SubElement(span_node, "path", {"encoding": "pattern"})
+        path_node.text = entry["path"]
+        feed_nodes.append(feed_node)
+
+        # <version type="version" uid="%s">
+        #     <name>%s</name>
+        #     <creationDate>%s</creationDate>
+        #     <userData type="dict">
+        #     </userData>
+        # </version>
+        version_node = ElementTree.Element(
+            "version", {"type": "version", "uid": entry["uid"]}
+        )
+        ElementTree.SubElement(version_node, "name").text = entry["name"]
+        ElementTree.SubElement(version_node, "creationDate").text = entry["date"]
+        ElementTree.SubElement(version_node, "userData", {"type": "dict"})
+        version_nodes.append(version_node)
+
+    if feed_nodes:
+        # add the feeds to the first video track's feeds and the versions
+        # to the first versions list, then replace the clip atomically
+        clip_data = _insert_into_flame_clip(
+            clip_data,
+            [
+                (insertion_points["feeds"], "feeds", feed_nodes),
+                (insertion_points["versions"], "versions", version_nodes),
+            ],
+        )
+        _write_flame_clip(flame_clip_path, clip_data, backups)
+
+    os.remove(pending_path)
+    return len(feed_nodes)
 
 
 def _generate_flame_clip_name(item, publish_fields):
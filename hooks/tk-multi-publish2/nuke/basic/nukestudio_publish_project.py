@@ -9,12 +9,18 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+
 import sgtk
 from sgtk.platform.qt import QtGui
 from sgtk.util.filesystem import ensure_folder_exists
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
 
 class NukeStudioProjectPublishPlugin(HookBaseClass):
     """
@@ -24,7 +30,7 @@ class NukeStudioProjectPublishPlugin(HookBaseClass):
     the publish2 app and should inherit from it in the configuration. The hook
     setting for this plugin should look something like this::
 
-        hook: "{self}/publish_file.py:{engine}/tk-multi-publish2/basic/nukestudio_publish_script.py"
+        hook: "{self}/publish_file.py:{config}/tk-multi-publish2/nuke/basic/nukestudio_publish_project.py"
 
     """
 
@@ -258,12 +264,13 @@ class NukeStudioProjectPublishPlugin(HookBaseClass):
         (next_version_path, version) = self._get_next_version_info(path, item)
         if next_version_path and os.path.exists(next_version_path):
 
-            # determine the next available version_number. just keep asking for
-            # the next one until we get one that doesn't exist.
-            while os.path.exists(next_version_path):
-                (next_version_path, version) = self._get_next_version_info(
-                    next_version_path, item
-                )
+            # determine the next available version number from one listing
+            # of the work folder
+            scan = self._get_version_scan(path, item)
+            free_version = scan.next_free(version + 1)
+            free_path = scan.version_path(free_version)
+            if free_path:
+                (next_version_path, version) = (free_path, free_version)
 
             error_msg = "The next version of this file already exists on disk."
             self.logger.error(
@@ -344,6 +351,21 @@ class NukeStudioProjectPublishPlugin(HookBaseClass):
         # bump the session file to the next version
         self._save_to_next_version(path, item, save_callback)
 
+    def _get_version_scan(self, path, item):
+        """
+        Return a VersionScan of the ftp_action package finding the versions
+        of path on disk with one listing of its folder.
+
+        :param str path: A path with a version number.
+        :param item: The current item being published
+        """
+        version_scan = ftp_action.import_module("version_scan")
+        return version_scan.VersionScan(
+            path,
+            item.properties.get("work_template"),
+            self.parent.util.get_version_number,
+        )
+
 
 def _get_save_as_action(project):
     """
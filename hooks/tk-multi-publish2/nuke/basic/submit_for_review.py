@@ -10,10 +10,21 @@
 
 import nuke
 import os
+import time
+from concurrent.futures import TimeoutError
+
 import sgtk
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
+# seconds between two progress reports while waiting for a review movie
+PROGRESS_INTERVAL = 5.0
+
 
 class NukeSubmitForReviewPlugin(HookBaseClass):
     """
@@ -74,7 +85,24 @@ class NukeSubmitForReviewPlugin(HookBaseClass):
         The type string should be one of the data types that toolkit accepts
         as part of its environment configuration.
         """
-        return {}
+        return {
+            "Review Render Processes": {
+                "type": "int",
+                "default": 0,
+                "description": "Number of review movies rendered and "
+                "submitted concurrently by the review submission app in "
+                "background 'nuke -t' processes, the finalize pass waiting "
+                "for them. 0 renders each movie in the session, one item "
+                "after the other.",
+            },
+            "Review Timeout": {
+                "type": "int",
+                "default": 1800,
+                "description": "Seconds the finalize pass waits for a review "
+                "movie rendered in the background. Past it, the render "
+                "process is killed and the item fails. 0 waits forever.",
+            },
+        }
 
     @property
     def item_filters(self):
@@ -215,7 +243,6 @@ class NukeSubmitForReviewPlugin(HookBaseClass):
         sg_task = self.parent.context.task
         comment = item.description
         thumbnail_path = item.get_thumbnail_as_path()
-        progress_cb = lambda *args, **kwargs: None
         review_submission_app = self.parent.engine.apps.get("tk-multi-reviewsubmission")
 
         render_template = item.properties.get("work_template")
@@ -241,6 +268,23 @@ class NukeSubmitForReviewPlugin(HookBaseClass):
         last_frame = item.properties.get("last_frame")
         colorspace = item.properties.get("color_space")
 
+        if settings["Review Render Processes"].value > 0:
+            # render in the background, the finalize pass waits for the
+            # version
+            job = self._submit_review_job(
+                settings,
+                item,
+                review_submission_app,
+                publish_template,
+                render_path_fields,
+                [sg_publish_data],
+                thumbnail_path,
+            )
+            self._get_review_jobs(item)["jobs"][id(item)] = job
+            self.logger.info("Queued the review movie for: %s" % (render_path,))
+            return
+
+        progress_cb = self._get_progress_cb(item)
         version = review_submission_app.render_and_submit_version(
             publish_template,
             render_path_fields,
@@ -253,6 +297,55 @@ class NukeSubmitForReviewPlugin(HookBaseClass):
             progress_cb,
             colorspace,
         )
+        self._report_version(version, render_path)
+
+    def finalize(self, settings, item):
+        """
+        Execute the finalization pass. This pass executes once all the publish
+        tasks have completed.
+
+        Waits for the review movie of the item when it was rendered in the
+        background.
+
+        :param settings: Dictionary of Settings. The keys are strings, matching
+            the keys returned in the settings property. The values are `Setting`
+            instances.
+        :param item: Item to process
+        """
+        job = self._get_review_jobs(item)["jobs"].pop(id(item), None)
+        if job is None:
+            return
+
+        timeout = settings["Review Timeout"].value
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        reported = None
+        while True:
+            wait = PROGRESS_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    # a hung render must not freeze the publisher
+                    job.cancel()
+                    raise Exception(
+                        "Review submission for '%s' timed out after %d "
+                        "seconds (%s)."
+                        % (item.properties.get("path"), timeout, job.progress()[1])
+                    )
+            try:
+                version = job.future.result(timeout=wait)
+            except TimeoutError:
+                progress = job.progress()
+                if progress != reported:
+                    self.logger.info("%s (%d%%)" % (progress[1], progress[0]))
+                    reported = progress
+            else:
+                break
+        self._report_version(version, item.properties.get("path"))
+
+    def _report_version(self, version, render_path):
+        """
+        Log the submitted version, or raise if there is none.
+        """
         if version:
             self.logger.info(
                 "Version uploaded for file: %s" % (render_path,),
@@ -270,14 +363,85 @@ class NukeSubmitForReviewPlugin(HookBaseClass):
                 "submit the review associated sequence."
             )
 
-    def finalize(self, settings, item):
+    def _get_progress_cb(self, item):
         """
-        Execute the finalization pass. This pass executes once all the publish
-        tasks have completed.
+        Return a progress callback for the review submission app logging
+        the progress of the item's submission in steps of 10%.
+        """
+        name = item.properties.get("publish_name") or item.name
+        reported = [None]
+
+        def progress_cb(percent, message=None, *args, **kwargs):
+            step = int(percent) // 10
+            if step == reported[0]:
+                return
+            reported[0] = step
+            self.logger.info(
+                "Review submission for %s: %d%% %s" % (name, percent, message or "")
+            )
 
-        :param settings: Dictionary of Settings. The keys are strings, matching
-            the keys returned in the settings property. The values are `Setting`
-            instances.
-        :param item: Item to process
+        return progress_cb
+
+    def _get_review_jobs(self, item):
+        """
+        Return the background review jobs of the item's publish tree: a
+        dictionary with the "root" item and the queued "jobs" by item id.
+        """
+        root_item = item
+        while not root_item.is_root:
+            root_item = root_item.parent
+        review_jobs = getattr(self, "_review_jobs", None)
+        if review_jobs is None or review_jobs["root"] is not root_item:
+            review_jobs = {"root": root_item, "jobs": {}}
+            self._review_jobs = review_jobs
+        return review_jobs
+
+    def _submit_review_job(
+        self,
+        settings,
+        item,
+        review_submission_app,
+        template,
+        fields,
+        sg_publishes,
+        thumbnail_path,
+    ):
+        """
+        Queue the item's review movie in a background nuke process. The
+        process starts the engine for the publish context and calls the
+        review submission app's render_and_submit_version(), so the movie
+        and its Version are the same as when they are made in the session.
+
+        :returns: The ftp_action.review_render.ReviewJob of the item.
         """
-        pass
+        review_render = ftp_action.import_module("review_render")
+        publisher = self.parent
+
+        job = review_render.ReviewJob(
+            item.properties.get("publish_name") or item.name,
+            {
+                "sgtk_path": os.path.dirname(os.path.dirname(sgtk.__file__)),
+                "context": publisher.context.serialize(with_user_credentials=True),
+                "engine": publisher.engine.instance_name,
+                "app": review_submission_app.instance_name,
+                "template": template.name,
+                "fields": fields,
+                "first_frame": item.properties.get("first_frame"),
+                "last_frame": item.properties.get("last_frame"),
+                # the entities only, the rest may not be json serializable
+                "sg_publishes": [
+                    {"type": p["type"], "id": p["id"], "code": p.get("code")}
+                    for p in sg_publishes
+                ],
+                "sg_task": publisher.context.task,
+                "comment": item.description,
+                "thumbnail_path": thumbnail_path,
+                "color_space": item.properties.get("color_space"),
+            },
+            script=review_render.SUBMIT_SCRIPT,
+        )
+        queue = review_render.get_queue(
+            nuke.EXE_PATH, settings["Review Render Processes"].value
+        )
+        queue.submit(job)
+        return job
@@ -8,6 +8,7 @@
 import copy
 import os
 import tempfile
+import time
 import uuid
 
 import sgtk
@@ -15,6 +16,14 @@ from tank_vendor import yaml
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
+# seconds the validation waits for all the thumbnails still being made
+THUMBNAIL_TIMEOUT = 30.0
+
 
 class PostPhase(HookBaseClass):
     """
@@ -24,6 +33,51 @@ class PostPhase(HookBaseClass):
     See the PublishTree documentation for additional details on how to traverse the tree and manipulate it.
     """
 
+    def post_validate(self, publish_tree):
+        """
+        This method is executed after the validation pass has completed for
+        each item in the tree, before the publish pass.
+
+        Drops the conflicting publish index the publish plugins prefetch for
+        validation, so every validation pass sees fresh ShotGrid data and the
+        index isn't saved with the tree for background publishing.
+
+        Also gives the items the small thumbnails the collector had made in
+        the background, so the publish plugins register and submit those
+        instead of the full resolution frames. Items whose thumbnail was
+        changed in the UI keep it.
+
+        :param publish_tree: The :ref:`publish-api-tree` instance representing
+            the items to be published.
+        """
+        root_properties = publish_tree.root_item.properties
+        if "conflicting_publish_index" in root_properties:
+            del root_properties["conflicting_publish_index"]
+
+        thumbnail_cache = ftp_action.loaded_module("thumbnail_cache")
+        if thumbnail_cache is None:
+            return
+
+        # the thumbnails are made by one process: wait for them all at most
+        # THUMBNAIL_TIMEOUT, not that long per item
+        deadline = time.monotonic() + THUMBNAIL_TIMEOUT
+        for item in publish_tree:
+            pending = item.properties.get("pending_thumbnail")
+            if not pending:
+                continue
+            if item.get_thumbnail_as_path() != pending["source"]:
+                # the artist picked another thumbnail
+                del item.properties["pending_thumbnail"]
+                continue
+            thumbnail = thumbnail_cache.wait_for(
+                pending["source"],
+                pending["thumbnail"],
+                max(0.0, deadline - time.monotonic()),
+            )
+            if thumbnail:
+                item.set_thumbnail_from_path(thumbnail)
+                del item.properties["pending_thumbnail"]
+
     def post_publish(self, publish_tree):
         """
         This method is executed after the publish pass has completed for each
@@ -162,6 +216,10 @@ class PostPhase(HookBaseClass):
             the items to be published.
         """
 
+        self._flush_publish_tags()
+        self._write_publish_profile()
+        self._close_ftp_connections()
+
         bg_processing = publish_tree.root_item.properties.get("bg_processing")
         in_bg_process = publish_tree.root_item.properties.get("in_bg_process")
 
@@ -173,3 +231,48 @@ class PostPhase(HookBaseClass):
             # launch the background publishing process and show the monitor app
             bg_publish_app.launch_publish_process(self.__TREE_FILE_PATH)
             bg_publish_app.create_panel()
+
+    def _write_publish_profile(self):
+        """
+        Write the report of the publish profiler, if the publish plugins
+        enabled it, and log its summary.
+        """
+        # the plugins load the ftp_action package on demand; nothing to
+        # report if they never did
+        publish_profiler = ftp_action.loaded_module("publish_profiler")
+        if publish_profiler is None:
+            return
+
+        profiler = publish_profiler.get_profiler()
+        if not profiler.enabled:
+            return
+
+        report_path, summary = profiler.write_report()
+        self.logger.info(
+            "Publish profile written to %s" % (report_path,),
+            extra={
+                "action_show_more_info": {
+                    "label": "Show Profile",
+                    "tooltip": "Show the time spent in each publish step",
+                    "text": "<pre>%s</pre>" % (summary,),
+                }
+            },
+        )
+
+    def _flush_publish_tags(self):
+        """
+        Tag the publishes the publish plugins queued for the vietnam tag,
+        with one batch for the whole publish.
+        """
+        sg_tag = ftp_action.loaded_module("sg_tag")
+        if sg_tag is not None:
+            sg_tag.flush_tags(self.parent.shotgun)
+
+    def _close_ftp_connections(self):
+        """
+        Close the ftp connections the publish plugins opened for this
+        publish, if any.
+        """
+        transfer = ftp_action.loaded_module("transfer")
+        if transfer is not None:
+            transfer.close_all()
@@ -8,15 +8,35 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import errno
+import json
 import os
 import pprint
+import re
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import sgtk
 from sgtk.util.filesystem import copy_file, ensure_folder_exists
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# ioctl request cloning one file's extents into another (linux/fs.h)
+FICLONE = 0x40049409
+
+PROMOTION_MODES = ("auto", "copy", "hardlink", "reflink", "copy_file_range")
+
+# maximum number of requests sent in one shotgun.batch() call
+SG_BATCH_SIZE = 100
+
+# the ftp_action package, loaded once per process by the shared hook
+ftp_action = sgtk.platform.current_engine().execute_hook_expression(
+    "{config}/tk-multi-publish2/ftp_action_hook.py", "get_package"
+)
+
+# the publish profiler of the ftp_action package, shared by the publish hooks
+publish_profiler = ftp_action.import_module("publish_profiler")
+
 
 class BasicFilePublishPlugin(HookBaseClass):
     """
@@ -27,6 +47,12 @@ class BasicFilePublishPlugin(HookBaseClass):
     other file-based publish plugins as it contains standard operations for
     validating and registering publishes with Shotgun.
 
+    In this configuration it is used by the standalone publisher and, as the
+    base of nuke/basic/nuke_publish_script.py, by the Nuke session publish.
+    Generic file items of the Nuke asset step (write node renders) are still
+    published with the app's own publish_file.py, so the parallel sequence
+    copy doesn't apply to them.
+
     Once attached to a publish item, the plugin will key off of properties that
     drive how the item is published.
 
@@ -215,6 +241,87 @@ class BasicFilePublishPlugin(HookBaseClass):
                     "extensions that should be associated."
                 ),
             },
+            "FTP Compressed Types": {
+                "type": "list",
+                "default": [],
+                "description": (
+                    "Publish types which are gzip compressed on the fly when "
+                    "uploaded to the remote FTP server, where they are stored "
+                    "as <file>.gz with a .gz.json manifest. Only list types "
+                    "the remote tools unpack, e.g. the text formats 'Nuke "
+                    "Script', 'Clip File', 'Xml File' or 'Log File'. Use the "
+                    "names from File Types, or '<Ext> File' for other "
+                    "extensions. Off by default."
+                ),
+            },
+            "FTP Bandwidth Limit": {
+                "type": "dict",
+                "default": {"rate": None, "windows": [[9, 19, 20971520]]},
+                "description": (
+                    "Upload rate limit of the FTP server, shared by every "
+                    "upload of the process and applied when its connection "
+                    "is set up. 'rate' is the default in bytes/s (None is "
+                    "unlimited), 'windows' lists [start hour, end hour, "
+                    "rate] entries overriding it between local hours, the "
+                    "end hour excluded. The default leaves room for dailies "
+                    "review traffic during work hours."
+                ),
+            },
+            "Sequence Copy Threads": {
+                "type": "int",
+                "default": 8,
+                "description": (
+                    "Number of frames copied concurrently when a sequence "
+                    "is copied to the publish location."
+                ),
+            },
+            "Promotion Mode": {
+                "type": "str",
+                "default": "auto",
+                "description": (
+                    "How work files are promoted to the publish location: "
+                    "'copy', 'hardlink', 'reflink' (FICLONE), "
+                    "'copy_file_range' or 'auto' (reflink, then "
+                    "copy_file_range, then copy). Links and clones are only "
+                    "attempted when both paths are on the same filesystem and "
+                    "fall back to a plain copy. Hardlinked publishes share "
+                    "the work file's inode: the publish changes whenever the "
+                    "work file is edited, so only use it for renders that "
+                    "are never modified in place."
+                ),
+            },
+            "Batch Publish Registration": {
+                "type": "bool",
+                "default": False,
+                "description": (
+                    "Queue the PublishedFile creation of items nothing else "
+                    "needs during the publish pass (no children, no later "
+                    "task on the item) and create them with batched "
+                    "ShotGrid requests at the start of the finalize pass. "
+                    "If a later task fails during the publish pass, the "
+                    "finalize pass doesn't run: the files of the queued "
+                    "items are already copied and uploaded but get no "
+                    "PublishedFile record (the next publish logs them)."
+                ),
+            },
+            "Profile Publish": {
+                "type": "bool",
+                "default": False,
+                "description": (
+                    "Time each publish phase and sub-step, count ShotGrid "
+                    "calls and bytes copied, and write a report after the "
+                    "finalize pass. Also enabled by the WW_PUBLISH_PROFILE "
+                    "environment variable."
+                ),
+            },
+            "FTP Checksum Field": {
+                "type": "str",
+                "default": None,
+                "description": (
+                    "Optional text field on PublishedFile which receives the "
+                    "verified checksums of the remote FTP upload as JSON."
+                ),
+            },
         }
 
     @property
@@ -231,6 +338,7 @@ class BasicFilePublishPlugin(HookBaseClass):
     ############################################################################
     # standard publish plugin methods
 
+    @publish_profiler.profiled
     def accept(self, settings, item):
         """
         Method called by the publisher to determine if an item is of any
@@ -267,6 +375,7 @@ class BasicFilePublishPlugin(HookBaseClass):
         # return the accepted info
         return {"accepted": True}
 
+    @publish_profiler.profiled
     def validate(self, settings, item):
         """
         Validates the given item to check that it is ok to publish.
@@ -284,6 +393,10 @@ class BasicFilePublishPlugin(HookBaseClass):
         publisher = self.parent
         path = item.properties.get("path")
 
+        # log in to the ftp server while the rest of the tree validates
+        if os.getenv("WW_LOCATION") == 'vietnam':
+            self._get_transfer_service(settings).prepare()
+
         # ---- determine the information required to validate
 
         # We allow the information to be pre-populated by the collector or a
@@ -296,12 +409,11 @@ class BasicFilePublishPlugin(HookBaseClass):
         # Note the name, context, and path *must* match the values supplied to
         # register_publish in the publish phase in order for this to return an
         # accurate list of previous publishes of this file.
-        publishes = publisher.util.get_conflicting_publishes(
-            item.context,
-            publish_path,
-            publish_name,
-            filters=["sg_status_list", "is_not", None],
-        )
+        profiler = publish_profiler.get_hook_profiler(self)
+        with profiler.section("conflicting_publishes"):
+            publishes = self._get_conflicting_publishes(
+                item, publish_path, publish_name
+            )
 
         if publishes:
 
@@ -346,6 +458,7 @@ class BasicFilePublishPlugin(HookBaseClass):
 
         return True
 
+    @publish_profiler.profiled
     def publish(self, settings, item):
         """
         Executes the publish logic for the given item and settings.
@@ -374,80 +487,6 @@ class BasicFilePublishPlugin(HookBaseClass):
         # catch-all for any extra kwargs that should be passed to register_publish.
         publish_kwargs = self.get_publish_kwargs(settings, item)
 
-        if os.getenv("WW_LOCATION") == 'vietnam':
-            
-            import sys
-            from datetime import datetime
-
-            current_path = os.path.abspath(__file__)
-            current_path = os.path.dirname(current_path)
-            ftp_action_path = os.path.join(current_path, 'ftp_action')
-
-            sys.path.append(ftp_action_path)
-
-            from ftputil import ftputil
-            import host
-
-            _host = None
-            source_path_list = []
-            target_path_list = []
-
-            publish_path_dir = os.path.dirname(publish_path)
-
-            if os.getenv('TK_DEBUG') or os.getenv('USER') == 'w10296':
-                print("----------------------DEBUG-------------------------")
-                _host = host.ftpHost(
-                    "10.0.20.38",
-                    "west_rnd",
-                    "rnd2022!"
-                )
-            else:
-                _host = host.ftpHost(
-                    "220.127.148.3",
-                    "west_rnd",
-                    "rnd2022!"
-                )
-            
-            if not sys.platform in ["linux2", "linux"]:
-                publish_path_dir = publish_path_dir.replace("\\", "/")
-                publish_path_dir = publish_path_dir.replace("C:", "")
-            else:
-                pass
-            
-            ftp_path_dir = publish_path_dir.replace("show", "shotgrid_pub/show")
-
-            for file_name in os.listdir(publish_path_dir):
-                source_path_list.append(os.path.join(publish_path_dir, file_name))
-                target_path_list.append(os.path.join(ftp_path_dir, file_name))
-            
-            log_data = list()
-            log_data.append("=================================================")
-            log_data.append(datetime.today().strftime("%Y/%m/%d %H:%M:%S\n"))
-            
-            for src, dest in zip(source_path_list, target_path_list):
-                try:
-                    print(src, "->",dest)
-                    _host._upload(src, dest)
-                    log_data.append('{0} to {1} upload file.'.format(src, dest))
-
-                except ftputil.ftp_error.FTPIOError as e:
-                    directory = os.path.dirname(dest)
-                    print("---------------Create directory--------------")
-                    print("path : %s", directory)
-                    _host.makedirs(directory)
-
-                    for src, dest in zip(source_path_list, target_path_list):
-                        print(src, "->",dest)
-                        _host._upload(src, dest)
-                        log_data.append('{0} to {1} upload file.'.format(src, dest))
-
-            log_data.append("=================================================")
-            _host._ftp_log(log_data)
-            
-            _host.close()
-            print('---------------Ftp server close---------------')
-
-
         # if the parent item has publish data, get it id to include it in the list of
         # dependencies
         publish_dependencies_ids = []
@@ -456,8 +495,24 @@ class BasicFilePublishPlugin(HookBaseClass):
                 item.parent.properties.sg_publish_data["id"]
             )
 
+        profiler = publish_profiler.get_hook_profiler(self)
+
         # handle copying of work to publish if templates are in play
-        self._copy_work_to_publish(settings, item)
+        with profiler.section("copy_work_to_publish"):
+            published_files = self._copy_work_to_publish(settings, item)
+
+        # send exactly this item's files to the main site
+        if os.getenv("WW_LOCATION") == 'vietnam':
+            upload_paths = published_files
+            if not upload_paths:
+                upload_paths = item.properties.get("sequence_paths") or [publish_path]
+            with profiler.section("ftp_upload"):
+                self._upload_to_vietnam(
+                    settings, item, upload_paths, publish_dependencies_paths, publish_fields
+                )
+
+        with profiler.section("thumbnail"):
+            thumbnail_path = item.get_thumbnail_as_path()
 
         # arguments for publish registration
         self.logger.info("Registering publish...")
@@ -469,7 +524,7 @@ class BasicFilePublishPlugin(HookBaseClass):
             "name": publish_name,
             "created_by": publish_user,
             "version_number": publish_version,
-            "thumbnail_path": item.get_thumbnail_as_path(),
+            "thumbnail_path": thumbnail_path,
             "published_file_type": publish_type,
             "dependency_paths": publish_dependencies_paths,
             "dependency_ids": publish_dependencies_ids,
@@ -492,8 +547,29 @@ class BasicFilePublishPlugin(HookBaseClass):
         )
 
         # create the publish and stash it in the item properties for other
-        # plugins to use.
-        item.properties.sg_publish_data = sgtk.util.register_publish(**publish_data)
+        # plugins to use. when batching, the creation is queued and the
+        # dry run data is updated in place once it has been created.
+        publish_batch = self._get_publish_batch(item)
+        publish_batch["done"].discard(id(item))
+        with profiler.section("register_publish"):
+            if self._defer_registration(settings, item):
+                sg_publish_data = sgtk.util.register_publish(
+                    dry_run=True, **publish_data
+                )
+                publish_batch["pending"][id(item)] = (
+                    item,
+                    dict(sg_publish_data),
+                    publish_data,
+                )
+                self.logger.info("Publish queued for batch registration.")
+            else:
+                sg_publish_data = sgtk.util.register_publish(**publish_data)
+        item.properties.sg_publish_data = sg_publish_data
+        publish_batch["registered"][id(item)] = item
+        if "ftp_upload_checksums" in item.properties:
+            item.properties.sg_publish_data[
+                "ftp_upload_checksums"
+            ] = item.properties.ftp_upload_checksums
         self.logger.info("Publish registered!")
         self.logger.debug(
             "ShotGrid Publish data...",
@@ -507,9 +583,11 @@ class BasicFilePublishPlugin(HookBaseClass):
             },
         )
 
+        # tagged together with the rest of the tree in the finalize pass
         if os.getenv("WW_LOCATION") == 'vietnam':
-            self.update_last_publishfile_tag(item)
+            publish_batch["tags"][id(item)] = item
 
+    @publish_profiler.profiled
     def finalize(self, settings, item):
         """
         Execute the finalization pass. This pass executes once
@@ -524,13 +602,28 @@ class BasicFilePublishPlugin(HookBaseClass):
 
         publisher = self.parent
 
+        # the first finalize of the tree creates the queued publishes and
+        # clears the conflicting statuses of every registered item at once
+        profiler = publish_profiler.get_hook_profiler(self)
+        publish_batch = self._get_publish_batch(item)
+        if publish_batch["pending"]:
+            with profiler.section("register_pending_publishes"):
+                self._register_pending_publishes(publish_batch)
+        if publish_batch["tags"]:
+            with profiler.section("queue_publish_tags"):
+                self._update_publish_tags(publish_batch)
+        if id(item) in publish_batch["registered"]:
+            with profiler.section("clear_conflicting_statuses"):
+                self._clear_conflicting_statuses(publish_batch)
+
         # get the data for the publish that was just created in SG
         publish_data = item.properties.sg_publish_data
 
         # ensure conflicting publishes have their status cleared
-        publisher.util.clear_status_for_conflicting_publishes(
-            item.context, publish_data
-        )
+        if id(item) not in publish_batch["done"]:
+            publisher.util.clear_status_for_conflicting_publishes(
+                item.context, publish_data
+            )
 
         self.logger.info("Cleared the status of all previous, conflicting publishes")
 
@@ -633,14 +726,22 @@ class BasicFilePublishPlugin(HookBaseClass):
         work_template = item.properties.get("work_template")
         publish_template = self.get_publish_template(settings, item)
 
+        cache = self._get_template_cache(item)
+        cache_key = "publish_path|%s|%s|%s" % (
+            work_template and work_template.name,
+            publish_template and publish_template.name,
+            path,
+        )
+        if cache_key in cache:
+            return cache[cache_key]
+
         work_fields = []
         publish_path = None
 
         # We need both work and publish template to be defined for template
         # support to be enabled.
         if work_template and publish_template:
-            if work_template.validate(path):
-                work_fields = work_template.get_fields(path)
+            work_fields = self._get_work_fields(item, work_template, path) or []
 
             missing_keys = publish_template.missing_keys(work_fields)
 
@@ -665,6 +766,7 @@ class BasicFilePublishPlugin(HookBaseClass):
                 "Could not validate a publish template. Publishing in place."
             )
 
+        cache[cache_key] = publish_path
         return publish_path
 
     def get_publish_version(self, settings, item):
@@ -688,13 +790,22 @@ class BasicFilePublishPlugin(HookBaseClass):
         path = item.properties.path
 
         work_template = item.properties.get("work_template")
+
+        cache = self._get_template_cache(item)
+        cache_key = "publish_version|%s|%s" % (
+            work_template and work_template.name,
+            path,
+        )
+        if cache_key in cache:
+            return cache[cache_key]
+
         work_fields = None
         publish_version = None
 
         if work_template:
-            if work_template.validate(path):
+            work_fields = self._get_work_fields(item, work_template, path)
+            if work_fields is not None:
                 self.logger.debug("Work file template configured and matches file.")
-                work_fields = work_template.get_fields(path)
 
         if work_fields:
             # if version number is one of the fields, use it to populate the
@@ -709,6 +820,7 @@ class BasicFilePublishPlugin(HookBaseClass):
             if publish_version is None:
                 publish_version = 1
 
+        cache[cache_key] = publish_version
         return publish_version
 
     def get_publish_name(self, settings, item):
@@ -738,7 +850,13 @@ class BasicFilePublishPlugin(HookBaseClass):
             name_path = path
             is_sequence = False
 
-        return publisher.util.get_publish_name(name_path, sequence=is_sequence)
+        cache = self._get_template_cache(item)
+        cache_key = "publish_name|%s|%s" % (name_path, is_sequence)
+        if cache_key not in cache:
+            cache[cache_key] = publisher.util.get_publish_name(
+                name_path, sequence=is_sequence
+            )
+        return cache[cache_key]
 
     def get_publish_dependencies(self, settings, item):
         """
@@ -818,6 +936,404 @@ class BasicFilePublishPlugin(HookBaseClass):
     ############################################################################
     # protected methods
 
+    def _get_root_item(self, item):
+        """
+        Return the root item of the publish tree the item belongs to.
+        """
+        root_item = item
+        while not root_item.is_root:
+            root_item = root_item.parent
+        return root_item
+
+    def _get_publish_batch(self, item):
+        """
+        Return this plugin's batching state for the item's publish tree.
+
+        A dictionary with the "pending" publishes to create (by item id),
+        the "registered" items of the publish pass (by item id), the items
+        whose publish gets the vietnam "tags" (by item id) and the ids of the
+        items whose conflicting statuses are "done".
+        """
+        root_item = self._get_root_item(item)
+        publish_batch = getattr(self, "_publish_batch", None)
+        if publish_batch is None or publish_batch["root"] is not root_item:
+            if publish_batch and publish_batch["pending"]:
+                # the previous publish failed before its finalize pass
+                self.logger.warning(
+                    "%d file(s) of the previous publish were published but "
+                    "never registered in ShotGrid."
+                    % (len(publish_batch["pending"]),),
+                    extra={
+                        "action_show_more_info": {
+                            "label": "Show Files",
+                            "tooltip": "Show the unregistered publish files",
+                            "text": "<pre>%s</pre>"
+                            % "\n".join(
+                                publish_data["path"]
+                                for (_, _, publish_data) in publish_batch[
+                                    "pending"
+                                ].values()
+                            ),
+                        }
+                    },
+                )
+            publish_batch = {
+                "root": root_item,
+                "pending": {},
+                "registered": {},
+                "tags": {},
+                "done": set(),
+            }
+            self._publish_batch = publish_batch
+        return publish_batch
+
+    def _defer_registration(self, settings, item):
+        """
+        Return True if the item's publish can be created later in a batch:
+        batching is enabled and nothing reads the item's sg_publish_data
+        before the finalize pass, i.e. it has no children and no active task
+        after this one.
+        """
+        if not settings["Batch Publish Registration"].value:
+            return False
+
+        if item.children:
+            return False
+
+        found = False
+        for task in item.tasks:
+            if found and task.active:
+                return False
+            if task.settings is settings:
+                found = True
+        return found
+
+    def _sg_batch(self, requests):
+        """
+        Send the requests with shotgun.batch() in chunks of SG_BATCH_SIZE and
+        return all the results in order.
+        """
+        results = []
+        for start in range(0, len(requests), SG_BATCH_SIZE):
+            results.extend(
+                self.parent.shotgun.batch(requests[start : start + SG_BATCH_SIZE])
+            )
+        return results
+
+    def _register_pending_publishes(self, publish_batch):
+        """
+        Create the queued publishes, their dependencies and thumbnails, and
+        update each item's sg_publish_data with the created entity.
+        """
+        publisher = self.parent
+        pending = list(publish_batch["pending"].values())
+        publish_batch["pending"] = {}
+
+        self.logger.info("Registering %d queued publish(es)..." % (len(pending),))
+
+        requests = []
+        for (_, entity_data, _) in pending:
+            entity_data.pop("type", None)
+            requests.append(
+                {
+                    "request_type": "create",
+                    "entity_type": "PublishedFile",
+                    "data": entity_data,
+                }
+            )
+        created = self._sg_batch(requests)
+
+        dependency_paths = set()
+        for (_, _, publish_data) in pending:
+            dependency_paths.update(publish_data.get("dependency_paths") or [])
+        dependency_publishes = {}
+        if dependency_paths:
+            dependency_publishes = sgtk.util.find_publish(
+                publisher.sgtk, list(dependency_paths)
+            )
+
+        dependency_requests = []
+        for (item, _, publish_data), entity in zip(pending, created):
+            item.properties.sg_publish_data.update(entity)
+            publish_entity = {"type": "PublishedFile", "id": entity["id"]}
+
+            dependency_ids = list(publish_data.get("dependency_ids") or [])
+            for path in publish_data.get("dependency_paths") or []:
+                if path in dependency_publishes:
+                    dependency_ids.append(dependency_publishes[path]["id"])
+            for dependency_id in dependency_ids:
+                dependency_requests.append(
+                    {
+                        "request_type": "create",
+                        "entity_type": "PublishedFileDependency",
+                        "data": {
+                            "published_file": publish_entity,
+                            "dependent_published_file": {
+                                "type": "PublishedFile",
+                                "id": dependency_id,
+                            },
+                        },
+                    }
+                )
+
+            thumbnail_path = publish_data.get("thumbnail_path")
+            if thumbnail_path and os.path.exists(thumbnail_path):
+                publisher.shotgun.upload_thumbnail(
+                    "PublishedFile", entity["id"], thumbnail_path
+                )
+
+        if dependency_requests:
+            self._sg_batch(dependency_requests)
+
+        self.logger.info("Queued publishes registered!")
+
+    def _clear_conflicting_statuses(self, publish_batch):
+        """
+        Clear the status of the publishes conflicting with any item
+        registered in this publish pass, with one ShotGrid query per project
+        and batched updates. The items are then marked "done".
+        """
+        publisher = self.parent
+        items = list(publish_batch["registered"].values())
+        publish_batch["registered"] = {}
+
+        projects = {}
+        for item in items:
+            if item.context.project:
+                projects.setdefault(item.context.project["id"], []).append(item)
+
+        requests = []
+        for project_id, project_items in projects.items():
+            entity_filters = []
+            for item in project_items:
+                entity = item.context.entity
+                if entity:
+                    entity = {"type": entity["type"], "id": entity["id"]}
+                entity_filter = ["entity", "is", entity]
+                if entity_filter not in entity_filters:
+                    entity_filters.append(entity_filter)
+
+            candidates = publisher.shotgun.find(
+                "PublishedFile",
+                [
+                    ["project", "is", {"type": "Project", "id": project_id}],
+                    ["sg_status_list", "is_not", None],
+                    {"filter_operator": "any", "filters": entity_filters},
+                ],
+                ["project", "entity", "task", "name", "path"],
+            )
+
+            candidates_by_key = {}
+            for candidate in candidates:
+                entity = candidate.get("entity") or {}
+                task = candidate.get("task") or {}
+                key = "%s|%s|%s|%s|%s" % (
+                    project_id,
+                    entity.get("type"),
+                    entity.get("id"),
+                    task.get("id"),
+                    candidate.get("name"),
+                )
+                candidates_by_key.setdefault(key, []).append(candidate)
+
+            for item in project_items:
+                publish_data = item.properties.sg_publish_data
+                key = self._conflicting_publish_key(item.context, publish_data["name"])
+                publish_path = sgtk.util.ShotgunPath.normalize(
+                    publish_data["path"]["local_path"]
+                )
+                for candidate in candidates_by_key.get(key, []):
+                    if candidate["id"] == publish_data["id"]:
+                        continue
+                    candidate_path = sgtk.util.resolve_publish_path(
+                        publisher.sgtk, candidate
+                    )
+                    if (
+                        candidate_path
+                        and sgtk.util.ShotgunPath.normalize(candidate_path)
+                        == publish_path
+                    ):
+                        requests.append(
+                            {
+                                "request_type": "update",
+                                "entity_type": "PublishedFile",
+                                "entity_id": candidate["id"],
+                                "data": {"sg_status_list": None},
+                            }
+                        )
+
+        if requests:
+            self._sg_batch(requests)
+
+        for project_items in projects.values():
+            publish_batch["done"].update(id(item) for item in project_items)
+
+    def _get_conflicting_publishes(self, item, publish_path, publish_name):
+        """
+        Return the publishes with a status that conflict with the given path
+        and name in the item's context.
+
+        The first call during a validation pass prefetches the candidate
+        publishes of every context in the publish tree (see
+        _prefetch_conflicting_publishes). Items without any candidate in that
+        index skip their ShotGrid query entirely. Only items with a candidate
+        run the exact ``get_conflicting_publishes`` lookup.
+
+        :param item: The item being validated.
+        :param str publish_path: The path that will be published.
+        :param str publish_name: The name that will be published.
+        """
+        publisher = self.parent
+
+        root_item = self._get_root_item(item)
+        index = root_item.properties.get("conflicting_publish_index")
+        if index is None:
+            index = self._prefetch_conflicting_publishes(root_item)
+            root_item.properties["conflicting_publish_index"] = index
+
+        key = self._conflicting_publish_key(item.context, publish_name)
+        if index is not False and key is not None:
+            # path_cache is the path relative to its storage root. Windows
+            # paths differing in case only are the same file.
+            ignore_case = sgtk.util.is_windows()
+            normalized_path = _path_cache_form(publish_path, ignore_case)
+            if not any(
+                not path_cache
+                or normalized_path.endswith(
+                    "/" + _path_cache_form(path_cache, ignore_case).lstrip("/")
+                )
+                for path_cache in index.get(key, [])
+            ):
+                return []
+
+        return publisher.util.get_conflicting_publishes(
+            item.context,
+            publish_path,
+            publish_name,
+            filters=["sg_status_list", "is_not", None],
+        )
+
+    def _conflicting_publish_key(self, context, publish_name):
+        """
+        Return the conflicting publish index key for a context and publish
+        name, or None if the context has no project.
+        """
+        if not context.project:
+            return None
+        entity = context.entity or {}
+        task = context.task or {}
+        return "%s|%s|%s|%s|%s" % (
+            context.project["id"],
+            entity.get("type"),
+            entity.get("id"),
+            task.get("id"),
+            publish_name,
+        )
+
+    def _prefetch_conflicting_publishes(self, root_item):
+        """
+        Fetch the PublishedFiles with a status for every context in the
+        publish tree with one ShotGrid query per project.
+
+        :param root_item: The root item of the publish tree.
+
+        :return: Dictionary mapping _conflicting_publish_key() values to lists
+            of path_cache values, or False if the prefetch failed.
+        """
+        publisher = self.parent
+
+        contexts = {}
+        for tree_item in root_item.descendants:
+            context = tree_item.context
+            if context and context.project:
+                contexts.setdefault(context.project["id"], []).append(context)
+
+        index = {}
+        for project_id, project_contexts in contexts.items():
+            entity_filters = []
+            for context in project_contexts:
+                entity = context.entity
+                if entity:
+                    entity = {"type": entity["type"], "id": entity["id"]}
+                entity_filter = ["entity", "is", entity]
+                if entity_filter not in entity_filters:
+                    entity_filters.append(entity_filter)
+
+            try:
+                publishes = publisher.shotgun.find(
+                    "PublishedFile",
+                    [
+                        ["project", "is", {"type": "Project", "id": project_id}],
+                        ["sg_status_list", "is_not", None],
+                        {"filter_operator": "any", "filters": entity_filters},
+                    ],
+                    ["project", "entity", "task", "name", "path_cache"],
+                )
+            except Exception as e:
+                self.logger.debug(
+                    "Could not prefetch conflicting publishes: %s" % (e,)
+                )
+                return False
+
+            for publish in publishes:
+                entity = publish.get("entity") or {}
+                task = publish.get("task") or {}
+                key = "%s|%s|%s|%s|%s" % (
+                    project_id,
+                    entity.get("type"),
+                    entity.get("id"),
+                    task.get("id"),
+                    publish.get("name"),
+                )
+                index.setdefault(key, []).append(publish.get("path_cache") or "")
+
+        self.logger.debug(
+            "Prefetched %d conflicting publish candidate(s) for %d project(s)."
+            % (sum(len(paths) for paths in index.values()), len(contexts))
+        )
+        return index
+
+    def _get_template_cache(self, item):
+        """
+        Return the dictionary caching template resolution results for the
+        item. It lives in the item's properties so it is shared by this
+        plugin's validate, publish and finalize phases (and by subclasses).
+        Keys contain the template names and path, so a path change (e.g.
+        saving to the next version) simply misses the cache.
+
+        :param item: The item being published.
+        """
+        cache = item.properties.get("template_resolution_cache")
+        if cache is None:
+            cache = {}
+            item.properties["template_resolution_cache"] = cache
+        return cache
+
+    def _get_work_fields(self, item, work_template, path):
+        """
+        Return the fields work_template extracts from path, or None if the
+        path does not match the template. Each (template, path) pair is only
+        parsed once per item.
+
+        :param item: The item being published.
+        :param work_template: The template to parse the path with.
+        :param str path: The path to parse.
+
+        :return: A new dictionary the caller is free to modify, or None.
+        """
+        cache = self._get_template_cache(item)
+        cache_key = "work_fields|%s|%s" % (work_template.name, path)
+        if cache_key not in cache:
+            if work_template.validate(path):
+                cache[cache_key] = work_template.get_fields(path)
+            else:
+                cache[cache_key] = None
+
+        work_fields = cache[cache_key]
+        if work_fields is None:
+            return None
+        return dict(work_fields)
+
     def _copy_work_to_publish(self, settings, item):
         """
         This method handles copying work file path(s) to a designated publish
@@ -839,6 +1355,8 @@ class BasicFilePublishPlugin(HookBaseClass):
         If the item has "sequence_paths" set, it will attempt to copy all paths
         assuming they meet the required criteria with respect to the templates.
 
+        :returns: The list of publish files written, or None if nothing was
+            copied.
         """
 
         # ---- ensure templates are available
@@ -873,45 +1391,195 @@ class BasicFilePublishPlugin(HookBaseClass):
                 )
                 return
 
-        # ---- copy the work files to the publish location
+        # ---- resolve the publish path of every work file
 
-        for work_file in work_files:
+        publish_files = self._resolve_publish_files(
+            item, work_template, publish_template, work_files
+        )
+        if publish_files is None:
+            return
 
-            if not work_template.validate(work_file):
-                self.logger.warning(
-                    "Work file '%s' did not match work template '%s'. "
-                    "Publishing in place." % (work_file, work_template)
-                )
-                return
+        # ---- copy the work files to the publish location
 
-            work_fields = work_template.get_fields(work_file)
+        # create each destination folder once rather than once per frame
+        for publish_folder in set(os.path.dirname(p) for (_, p) in publish_files):
+            ensure_folder_exists(publish_folder)
 
-            missing_keys = publish_template.missing_keys(work_fields)
+        promotion_mode = settings["Promotion Mode"].value or "copy"
+        if promotion_mode not in PROMOTION_MODES:
+            self.logger.warning(
+                "Unknown promotion mode '%s'. Copying files." % (promotion_mode,)
+            )
+            promotion_mode = "copy"
 
-            if missing_keys:
-                self.logger.warning(
-                    "Work file '%s' missing keys required for the publish "
-                    "template: %s" % (work_file, missing_keys)
-                )
-                return
+        profiler = publish_profiler.get_hook_profiler(self)
 
-            publish_file = publish_template.apply_fields(work_fields)
+        def _copy(paths):
+            work_file, publish_file = paths
+            method = self._promote_file(work_file, publish_file, promotion_mode)
+            if profiler.enabled:
+                profiler.count("files_promoted.%s" % method)
+                profiler.count("bytes_promoted", os.path.getsize(publish_file))
+            self.logger.debug(
+                "Promoted work file '%s' to publish file '%s' (%s)."
+                % (work_file, publish_file, method)
+            )
 
-            # copy the file
+        errors = []
+        if len(publish_files) == 1:
             try:
-                publish_folder = os.path.dirname(publish_file)
-                ensure_folder_exists(publish_folder)
-                copy_file(work_file, publish_file)
+                _copy(publish_files[0])
             except Exception:
-                raise Exception(
-                    "Failed to copy work file from '%s' to '%s'.\n%s"
-                    % (work_file, publish_file, traceback.format_exc())
-                )
+                errors.append((publish_files[0], traceback.format_exc()))
+        else:
+            max_workers = max(1, settings["Sequence Copy Threads"].value or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    (paths, executor.submit(_copy, paths)) for paths in publish_files
+                ]
+                for paths, future in futures:
+                    try:
+                        future.result()
+                    except Exception:
+                        errors.append((paths, traceback.format_exc()))
+
+        if errors:
+            (work_file, publish_file), error = errors[0]
+            raise Exception(
+                "Failed to copy %d of %d work file(s) to the publish location. "
+                "First failure copying '%s' to '%s'.\n%s"
+                % (len(errors), len(publish_files), work_file, publish_file, error)
+            )
 
-            self.logger.debug(
-                "Copied work file '%s' to publish file '%s'."
-                % (work_file, publish_file)
+        return [publish_file for (_, publish_file) in publish_files]
+
+    def _promote_file(self, work_file, publish_file, mode):
+        """
+        Put a copy of work_file at publish_file using the given promotion mode
+        and return the method that was actually used.
+
+        Hardlinks and clones need the publish folder to be on the same
+        filesystem as the work file. Anything which fails falls back to the
+        next method and finally to a regular copy.
+
+        :param str work_file: Source path.
+        :param str publish_file: Destination path. Its folder must exist.
+        :param str mode: One of PROMOTION_MODES.
+        """
+        # an earlier hardlink promotion leaves publish_file sharing the work
+        # file's inode: writing through it would truncate the work file, so
+        # always start from a new inode
+        if os.path.lexists(publish_file):
+            os.remove(publish_file)
+
+        if mode != "copy":
+            same_filesystem = (
+                os.stat(work_file).st_dev
+                == os.stat(os.path.dirname(publish_file)).st_dev
             )
+            if mode == "auto":
+                methods = ["reflink", "copy_file_range"] if same_filesystem else []
+            elif same_filesystem or mode == "copy_file_range":
+                methods = [mode]
+            else:
+                methods = []
+
+            for method in methods:
+                try:
+                    if method == "hardlink":
+                        os.link(work_file, publish_file)
+                        # shares the work file's inode; leave its mode alone
+                        return method
+                    elif method == "reflink":
+                        _clone_file(work_file, publish_file)
+                    else:
+                        _copy_file_range(work_file, publish_file)
+                except (OSError, IOError, AttributeError, ImportError) as e:
+                    self.logger.debug(
+                        "Could not %s '%s' to '%s': %s. Falling back."
+                        % (method, work_file, publish_file, e)
+                    )
+                    continue
+                os.chmod(publish_file, 0o666)
+                return method
+
+        copy_file(work_file, publish_file)
+        return "copy"
+
+    def _resolve_publish_files(self, item, work_template, publish_template, work_files):
+        """
+        Return a list of (work_file, publish_file) tuples, or None if the work
+        files can't be published to the publish template.
+
+        The work template is only parsed for the first file. The frame number
+        of the remaining files of a sequence is matched with a regular
+        expression built from the resolved fields, so only files which don't
+        match it fall back to a full template parse.
+
+        :param item: The item being published.
+        :param work_template: Template the work files are expected to match.
+        :param publish_template: Template to resolve the publish paths with.
+        :param work_files: List of work file paths.
+        """
+        first_file = work_files[0]
+        base_fields = self._get_work_fields(item, work_template, first_file)
+        if base_fields is None:
+            self.logger.warning(
+                "Work file '%s' did not match work template '%s'. "
+                "Publishing in place." % (first_file, work_template)
+            )
+            return None
+
+        missing_keys = publish_template.missing_keys(base_fields)
+        if missing_keys:
+            self.logger.warning(
+                "Work file '%s' missing keys required for the publish "
+                "template: %s" % (first_file, missing_keys)
+            )
+            return None
+
+        frame_key = None
+        frame_regex = None
+        for key in work_template.keys.values():
+            if isinstance(key, sgtk.templatekey.SequenceKey):
+                frame_key = key.name
+                break
+
+        if frame_key and len(work_files) > 1:
+            fields = dict(base_fields)
+            fields[frame_key] = "FORMAT: %d"
+            frame_regex = _frame_regex(work_template.apply_fields(fields))
+
+        publish_files = []
+        for work_file in work_files:
+            fields = None
+            if frame_regex:
+                match = frame_regex.match(work_file)
+                if match and len(set(match.groups())) == 1:
+                    fields = dict(base_fields)
+                    fields[frame_key] = int(match.group(1))
+
+            if fields is None:
+                if not work_template.validate(work_file):
+                    self.logger.warning(
+                        "Work file '%s' did not match work template '%s'. "
+                        "Publishing in place." % (work_file, work_template)
+                    )
+                    return None
+
+                fields = work_template.get_fields(work_file)
+
+                missing_keys = publish_template.missing_keys(fields)
+                if missing_keys:
+                    self.logger.warning(
+                        "Work file '%s' missing keys required for the publish "
+                        "template: %s" % (work_file, missing_keys)
+                    )
+                    return None
+
+            publish_files.append((work_file, publish_template.apply_fields(fields)))
+
+        return publish_files
 
     def _get_next_version_info(self, path, item):
         """
@@ -943,8 +1611,7 @@ class BasicFilePublishPlugin(HookBaseClass):
         work_fields = None
 
         if work_template:
-            if work_template.validate(path):
-                work_fields = work_template.get_fields(path)
+            work_fields = self._get_work_fields(item, work_template, path)
 
         # if we have template and fields, use them to determine the version info
         if work_fields and "version" in work_fields:
@@ -1001,8 +1668,11 @@ class BasicFilePublishPlugin(HookBaseClass):
             self.logger.warning("Could not determine the next version path.")
             return None
         elif os.path.exists(next_version_path):
+            # tell which version is free, from one listing of the folder
+            scan = self._get_version_scan(path, item)
             self.logger.warning(
-                "The next version of the path already exists",
+                "The next version of the path already exists, the next free "
+                "version is v%s." % (scan.next_free(version),),
                 extra={"action_show_folder": {"path": next_version_path}},
             )
             return None
@@ -1013,34 +1683,230 @@ class BasicFilePublishPlugin(HookBaseClass):
 
         return next_version_path
 
-    def update_last_publishfile_tag(self, item):
-        current_context = item.context
-        
-        sg_filters = [
-            ["project", "is", current_context.project],
-            ["entity", "is", current_context.entity],
-            ["task", "is", current_context.task],
-            ["created_by", "is", current_context.user]
+    def _get_version_scan(self, path, item):
+        """
+        Return a VersionScan of the ftp_action package finding the versions
+        of path on disk with one listing of its folder.
+
+        :param str path: A path with a version number.
+        :param item: The current item being published
+        """
+        version_scan = ftp_action.import_module("version_scan")
+        return version_scan.VersionScan(
+            path,
+            item.properties.get("work_template"),
+            self.parent.util.get_version_number,
+        )
+
+    def _upload_to_vietnam(
+        self, settings, item, upload_paths, dependency_paths, publish_fields
+    ):
+        """
+        Upload the item's published files to the ftp server and record the
+        verified checksums.
+
+        :param settings: This plugin instance's configured settings
+        :param item: The item being published
+        :param upload_paths: Published files, directories or frame patterns.
+        :param dependency_paths: The publish dependencies. Only the ones next
+            to the published files (e.g. sidecar files) are uploaded.
+        :param publish_fields: Extra PublishedFile fields to register, updated
+            with the checksums if "FTP Checksum Field" is set.
+        """
+        from datetime import datetime
+
+        bandwidth = ftp_action.import_module("ftputil.bandwidth")
+        host = ftp_action.import_module("host")
+        upload_set = ftp_action.import_module("upload_set")
+
+        # frame sequences yield the link to interactive publishes
+        if "sequence_paths" in item.properties:
+            priority = bandwidth.PRIORITY_BULK
+        else:
+            priority = bandwidth.PRIORITY_INTERACTIVE
+
+        # only this item's outputs, not everything in the publish folder
+        publish_dirs = set(os.path.dirname(os.path.normpath(p)) for p in upload_paths)
+        upload_paths = list(upload_paths) + [
+            p
+            for p in dependency_paths or []
+            if os.path.dirname(os.path.normpath(p)) in publish_dirs
         ]
+        upload_files = upload_set.collect(upload_paths)
+
+        # connected in the background since validate(), kept open for the
+        # other items and closed by the post_phase hook
+        _host = self._get_transfer_service(settings).host()
+
+        # text payloads (scripts, scenes, xml) shrink a lot with gzip
+        compressed_exts = host.compressed_extensions(
+            settings["File Types"].value,
+            settings["FTP Compressed Types"].value,
+        )
+
+        log_data = list()
+        log_data.append("=================================================")
+        log_data.append(datetime.today().strftime("%Y/%m/%d %H:%M:%S\n"))
+        upload_results = []
+        remote_dirs = set()
+
+        # files outside the storage roots (e.g. a dependency on a local
+        # drive) have no place on the ftp server
+        mapper = self._get_remote_path_mapper()
+        uploads = []
+        for (src, size) in upload_files:
+            try:
+                uploads.append((src, size, mapper.map(src)))
+            except ValueError as e:
+                self.logger.warning("Skipping the FTP upload of %s: %s" % (src, e))
+
+        for (src, size, dest) in uploads:
+            ftp_path_dir = dest.rsplit("/", 1)[0]
+            if ftp_path_dir not in remote_dirs:
+                if not _host.path.isdir(ftp_path_dir):
+                    print("---------------Create directory--------------")
+                    print("path : %s", ftp_path_dir)
+                    _host.makedirs(ftp_path_dir)
+                remote_dirs.add(ftp_path_dir)
+
+            print(src, "->",dest)
+            compress = host.is_compressed_upload(src, compressed_exts)
+            upload_results.append(_host._upload(src, dest, priority, compress))
+            publish_profiler.get_hook_profiler(self).count("ftp_bytes_uploaded", size)
+            log_data.append('{0} to {1} upload file.'.format(src, dest))
+            log_data.append('  md5 {md5} size {size} verified by {method}'.format(**upload_results[-1]))
+
+        log_data.append("=================================================")
+        _host._ftp_log(log_data)
+
+        item.properties["ftp_upload_checksums"] = upload_results
+        self.logger.info(
+            "Verified %d FTP upload(s), %d bytes."
+            % (len(upload_results), sum(size for (_, size, _) in uploads)),
+            extra={
+                "action_show_more_info": {
+                    "label": "Checksums",
+                    "tooltip": "Show the checksums of the uploaded files",
+                    "text": "<pre>%s</pre>" % (pprint.pformat(upload_results),),
+                }
+            },
+        )
+        checksum_field = settings["FTP Checksum Field"].value
+        if checksum_field:
+            publish_fields[checksum_field] = json.dumps(upload_results)
 
-        sg_fields = ['id', 'created_at', 'tags', 'path']
+    def update_last_publishfile_tag(self, item):
+        """
+        Queue the item's publish for the ww_vietnam tag if it is an image.
+        The post phase hook tags everything the publish queued in one batch.
+
+        Called by the finalize pass, once the publish exists in ShotGrid, for
+        every item published from vietnam. Subclasses override it to tag
+        other file types.
+
+        :param item: A published item with sg_publish_data.
+        """
+        sg_tag = ftp_action.import_module("sg_tag")
+        sg_tag.queue_tags([item.properties.sg_publish_data], sg_tag.IMAGE_FORMATS)
+
+    def _get_transfer_service(self, settings):
+        """
+        Return the shared ftp connection of this session, rate limited by
+        the "FTP Bandwidth Limit" setting.
+
+        :param settings: This plugin instance's configured settings
+        """
+        return ftp_action.import_module("transfer").get_service(
+            bandwidth_limit=settings["FTP Bandwidth Limit"].value
+        )
+
+    def _get_remote_path_mapper(self, segment_map=None):
+        """
+        Return the mapper translating local paths below the storage roots of
+        this configuration to their path on the ftp server.
+
+        :param segment_map: Optional {folder: folder} renames, see
+            ftp_action/remote_path.py.
+        """
+        remote_path = ftp_action.import_module("remote_path")
+        return remote_path.get_mapper(
+            self.sgtk.pipeline_configuration.get_all_platform_data_roots(),
+            segment_map=segment_map,
+        )
+
+    def _update_publish_tags(self, publish_batch):
+        """
+        Queue the publishes of all the tree's tagged items for the vietnam
+        tag with update_last_publishfile_tag().
+        """
+        items = list(publish_batch["tags"].values())
+        publish_batch["tags"] = {}
 
-        find_published_files = self.parent.shotgun.find("PublishedFile", sg_filters, sg_fields, 
-                                                        order=[{'field_name':'created_at','direction':'desc'}])
+        for item in items:
+            self.update_last_publishfile_tag(item)
 
-        if find_published_files:
-            last_published_file = find_published_files[0]
 
-            last_publish_file_ext = last_published_file['path']['local_path']
-            last_publish_file_ext = os.path.splitext(last_publish_file_ext)[1]
+def _path_cache_form(path, ignore_case):
+    """
+    Return path with forward slashes, like the path_cache field of a
+    PublishedFile, lowercase if ignore_case.
+    """
+    path = path.replace("\\", "/")
+    return path.lower() if ignore_case else path
 
-            image_format = ['.dpx', '.jpg', '.jpeg', '.png', '.mov', '.mp4', '.exr', '.tiff', '.tif']
 
-            tag_info = self.parent.shotgun.find_one("Tag", [["name", "is", "ww_vietnam"]])
-            if not tag_info:
-                tag_info = self.parent.shotgun.create("Tag", {"name", "ww_vietnam"})
+def _frame_regex(pattern):
+    r"""
+    Return a compiled regular expression matching the frames of a sequence
+    path with %d or %0Nd frame tokens, each token captured as a group, e.g.
+    /show/.../plate.%04d.exr -> /show/.../plate\.(\d{4,})\.exr
+    """
+    regex = ""
+    for index, token in enumerate(re.split(r"(%0?\d*d)", pattern)):
+        if index % 2 == 0:
+            regex += re.escape(token)
+        elif token.startswith("%0"):
+            regex += r"(\d{%d,})" % int(token[2:-1])
+        else:
+            regex += r"(\d+)"
+    return re.compile(regex + "$")
 
-            if tag_info and last_publish_file_ext.lower() in image_format:
-                self.parent.shotgun.update("PublishedFile", last_published_file['id'], {"tags": [tag_info]})
-            elif not last_publish_file_ext.lower() in image_format:
-                print("last publish file incorrect image file format.")
\ No newline at end of file
+
+def _clone_file(src, dst):
+    """
+    Clone src into dst with the FICLONE ioctl (btrfs, XFS, ZFS block
+    cloning...). The new file shares src's extents until either is written.
+    """
+    import fcntl
+
+    with open(src, "rb") as src_fp:
+        with open(dst, "wb") as dst_fp:
+            try:
+                fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+            except (OSError, IOError):
+                dst_fp.close()
+                os.remove(dst)
+                raise
+
+
+def _copy_file_range(src, dst):
+    """
+    Copy src to dst with os.copy_file_range, which lets the kernel or the
+    NFS server copy the data without moving it through user space.
+    """
+    with open(src, "rb") as src_fp:
+        size = os.fstat(src_fp.fileno()).st_size
+        with open(dst, "wb") as dst_fp:
+            offset = 0
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(
+                        src_fp.fileno(), dst_fp.fileno(), size - offset
+                    )
+                    if not copied:
+                        raise OSError(errno.EIO, "copy_file_range stopped early")
+                    offset += copied
+            except (OSError, IOError):
+                dst_fp.close()
+                os.remove(dst)
+                raise